@@ -0,0 +1,210 @@
+#!/usr/local/bin/python
+# encoding: utf-8
+'''
+sphinxhp.archive -- write output into a single zip or tar archive.
+
+Writers given an L{OutputArchive} add their files to it as members
+instead of creating them in an output directory. The archive is
+written to a file or a stream such as stdout as members are added,
+without temporary files: the content of a member is held in memory
+until the writer closes it, static files are read straight from
+their source.
+
+:author:    | André Berg
+:copyright: | 2011 Berg Media. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre.bergmedia@googlemail.com
+'''
+
+import os
+import io
+import time
+import tarfile
+import zipfile
+import threading
+
+import constants
+from compat import open_gzip
+
+
+__all__ = ['ARCHIVE_KINDS', 'OutputArchive', 'ArchiveMember', 'archive_kind']
+
+__date__ = constants.__date__
+__updated__ = '2026-10-18'
+
+
+DEBUG = 0 or ('BMDebugLevel' in os.environ and os.environ['BMDebugLevel'] > 0)
+TESTRUN = 0 or ('BMTestRunLevel' in os.environ and os.environ['BMTestRunLevel'] > 0)
+PROFILE = 0 or ('BMProfileLevel' in os.environ and os.environ['BMProfileLevel'] > 0)
+
+
+#: archive kinds by file extension, longest first
+ARCHIVE_KINDS = [
+    ('.tar.gz', 'tar.gz'),
+    ('.tgz', 'tar.gz'),
+    ('.tar.bz2', 'tar.bz2'),
+    ('.tar.xz', 'tar.xz'),
+    ('.tar', 'tar'),
+    ('.zip', 'zip')
+]
+
+
+def archive_kind(path, default='zip'):
+    '''Return the archive kind for the extension of `path`, or `default`.'''
+    for ext, kind in ARCHIVE_KINDS:
+        if path.endswith(ext):
+            return kind
+    return default
+
+
+class ArchiveMember(io.BytesIO):
+    '''
+    Content of an archive member being written. It is added to
+    the archive by L{commit}, or dropped by L{discard}.
+    '''
+
+    def __init__(self, archive, name):
+        super(ArchiveMember, self).__init__()
+        self.archive = archive
+        self.name = name
+        self._data = None
+
+    def close(self):
+        # keep the content, text and gzip streams close
+        # the member before it is committed
+        if not self.closed:
+            self._data = self.getvalue()
+        super(ArchiveMember, self).close()
+
+    def open_text(self, encoding='utf-8', errors='strict', newline=None, compress=False):
+        '''Return a stream writing strings to this member, gzip compressed if `compress`.'''
+        if compress:
+            return open_gzip(fileobj=self, encoding=encoding, errors=errors, newline=newline)
+        return io.TextIOWrapper(self, encoding=encoding, errors=errors, newline=newline)
+
+    def commit(self):
+        '''Add the content written to the archive and return it.'''
+        self.close()
+        data, self._data = self._data, None
+        self.archive.add_data(self.name, data)
+        return data
+
+    def discard(self):
+        self.close()
+        self._data = None
+
+
+class OutputArchive(object):
+    '''
+    Zip or tar archive written to the file at `path` or to the
+    binary `stream`. `kind` is C{'zip'}, C{'tar'}, C{'tar.gz'},
+    C{'tar.bz2'} or C{'tar.xz'} (default: from the extension
+    of `path`, see L{archive_kind}).
+
+    Members are written in the order they are added. Adding is
+    thread-safe. All members get the time the archive was opened.
+    '''
+
+    def __init__(self, path=None, stream=None, kind=None):
+        super(OutputArchive, self).__init__()
+        if path is None and stream is None:
+            raise ValueError("E: either path or stream must be given")
+        if kind is None:
+            kind = archive_kind(path or '')
+        self.kind = kind
+        self.path = path
+        self.names = []
+        self.lock = threading.Lock()
+        self.mtime = time.time()
+        self._own_stream = stream is None
+        if stream is None:
+            stream = open(path, 'wb')
+        self.stream = stream
+        try:
+            if kind == 'zip':
+                self._zip = zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED)
+                self._tar = None
+            elif kind == 'tar' or kind.startswith('tar.'):
+                # stream mode, so the archive doesn't need to be seekable
+                self._tar = tarfile.open(fileobj=stream, mode='w|' + kind[4:])
+                self._zip = None
+            else:
+                raise ValueError("E: archive kind must be one of %r but is %r" %
+                                 (sorted(set(k for _, k in ARCHIVE_KINDS)), kind))
+        except Exception:
+            if self._own_stream:
+                stream.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def member(self, name):
+        '''Return a new L{ArchiveMember} named `name`.'''
+        return ArchiveMember(self, name)
+
+    def _zipinfo(self, name):
+        info = zipfile.ZipInfo(name, time.localtime(self.mtime)[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        return info
+
+    def _tarinfo(self, name, size):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(self.mtime)
+        info.mode = 0o644
+        return info
+
+    def add_data(self, name, data):
+        '''Add a member `name` with the bytes `data`.'''
+        with self.lock:
+            if self._zip is not None:
+                self._zip.writestr(self._zipinfo(name), data)
+            else:
+                self._tar.addfile(self._tarinfo(name, len(data)), io.BytesIO(data))
+            self.names.append(name)
+
+    def add_file(self, src, name):
+        '''Add a member `name` with the content of the file `src`, read as it is written.'''
+        with self.lock:
+            if self._zip is not None:
+                with open(src, 'rb') as f:
+                    with self._zip.open(self._zipinfo(name), 'w', force_zip64=True) as member:
+                        block = f.read(constants.DEFAULT_BUFFER_SIZE)
+                        while block:
+                            member.write(block)
+                            block = f.read(constants.DEFAULT_BUFFER_SIZE)
+            else:
+                with open(src, 'rb') as f:
+                    self._tar.addfile(self._tarinfo(name, os.fstat(f.fileno()).st_size), f)
+            self.names.append(name)
+
+    def close(self):
+        '''Write the archive's end records. A `stream` given is flushed, but left open.'''
+        with self.lock:
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
+            if self._tar is not None:
+                self._tar.close()
+                self._tar = None
+            if self.stream is not None:
+                if self._own_stream:
+                    self.stream.close()
+                else:
+                    self.stream.flush()
+                self.stream = None
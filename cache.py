@@ -0,0 +1,209 @@
+#!/usr/local/bin/python
+# encoding: utf-8
+'''
+sphinxhp.cache -- on-disk persistence of initialized databases.
+
+A snapshot file consists of two consecutive pickles: a small
+header dict used to decide if the snapshot is still valid and
+the body holding the database contents. Only the header needs
+to be read to reject a stale snapshot. Page-to-type maps, which
+let a database read only the pages it needs, use the same layout.
+
+A cache directory may be shared by several processes, e.g. jobs
+extracting different sites or formats on one build host. Files are
+always written under a temporary name and renamed into place (see
+L{atomic_write}), so readers need no locking and never see a
+partially written file. Only filling the cache is serialized: a
+process about to extract a site takes the L{fill_lock} for its
+snapshot and checks again for a usable snapshot once it has the
+lock. Concurrent requests for the same site thus do the work once,
+the others wait and read the result.
+
+:author:    | André Berg
+:copyright: | 2011 Berg Media. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre.bergmedia@googlemail.com
+'''
+
+import os
+import pickle
+import hashlib
+import tempfile
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (Windows): concurrent fills do redundant 
+    # work, but still can't corrupt the cache
+    fcntl = None
+
+import constants
+from utils import now, create_path
+
+
+__all__ = ['SNAPSHOT_FORMAT', 'snapshot_path', 'typemap_path', 'atomic_write', 'fill_lock',
+           'write_snapshot', 'read_snapshot_header', 'read_snapshot', 'is_valid_snapshot']
+
+__date__ = constants.__date__
+__updated__ = '2026-10-18'
+
+
+DEBUG = 0 or ('BMDebugLevel' in os.environ and os.environ['BMDebugLevel'] > 0)
+TESTRUN = 0 or ('BMTestRunLevel' in os.environ and os.environ['BMTestRunLevel'] > 0)
+PROFILE = 0 or ('BMProfileLevel' in os.environ and os.environ['BMProfileLevel'] > 0)
+
+
+#: bump whenever the layout of the snapshot body changes
+SNAPSHOT_FORMAT = 1
+
+SNAPSHOT_EXT = '.snapshot'
+TYPEMAP_EXT = '.typemap'
+LOCK_EXT = '.lock'
+
+
+def site_key(site_url):
+    '''Return a file name safe key for `site_url`.'''
+    return hashlib.sha1(site_url.encode('utf-8')).hexdigest()
+
+
+def snapshot_path(cache_dir, site_url):
+    '''Return the path of the snapshot file for `site_url` in `cache_dir`.'''
+    return os.path.join(cache_dir, site_key(site_url) + SNAPSHOT_EXT)
+
+
+def typemap_path(cache_dir, site_url):
+    '''Return the path of the page-to-type map for `site_url` in `cache_dir`.'''
+    return os.path.join(cache_dir, site_key(site_url) + TYPEMAP_EXT)
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    '''
+    Context manager yielding a binary file that replaces the 
+    file at `path` when the block completes.
+    
+    The data is written to a temporary file in the same directory 
+    which is then renamed to `path`. Readers see either the old or 
+    the new file, never a partial one, and if the block raises, 
+    `path` is left untouched.
+    '''
+    dirname = create_path(os.path.dirname(os.path.abspath(path)))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=dirname)
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            yield f
+        finally:
+            f.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def fill_lock(path):
+    '''
+    Context manager holding an exclusive advisory lock for 
+    filling the cache file at `path`.
+    
+    The lock is taken on a companion C{.lock} file and works 
+    across processes as well as between threads. It only 
+    serializes writers: reading `path` needs no lock since it 
+    is always replaced atomically. Callers should check for 
+    a usable file again after acquiring the lock, another 
+    process may have filled it in the meantime.
+    
+    Lock files are never removed, as removing them would let 
+    two processes lock different files for the same path.
+    '''
+    lock_path = path + LOCK_EXT
+    create_path(os.path.dirname(os.path.abspath(lock_path)))
+    f = open(lock_path, 'a')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+    finally:
+        # closing the file releases the lock
+        f.close()
+
+
+def write_snapshot(path, header, body):
+    '''
+    Write `header` and `body` to the snapshot file at `path`.
+
+    The file is replaced atomically (see L{atomic_write}). 
+    C{format} and C{created} are added to the header.
+    '''
+    header = dict(header)
+    header['format'] = SNAPSHOT_FORMAT
+    header['created'] = now()
+    with atomic_write(path) as f:
+        pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(body, f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def read_snapshot_header(path):
+    '''Return the header of the snapshot at `path` or None if it can't be read.'''
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        return pickle.load(f)
+    except Exception as e: # IGNORE:W0703
+        if DEBUG:
+            print("E: reading snapshot header from '%s' failed: %s" % (path, e))
+        return None
+    finally:
+        f.close()
+
+
+def read_snapshot(path):
+    '''Return C{(header, body)} of the snapshot at `path`.'''
+    f = open(path, 'rb')
+    try:
+        header = pickle.load(f)
+        body = pickle.load(f)
+    finally:
+        f.close()
+    return header, body
+
+
+def is_valid_snapshot(header, site_url, sphinx_version=None, ttl=None):
+    '''
+    Return True if a snapshot with `header` may be used for `site_url`.
+
+    @param sphinx_version: the version currently detected on the site.
+        If given, it must match the one recorded in the snapshot.
+    @type sphinx_version: C{string}
+    @param ttl: max. age of the snapshot in seconds. None disables the check.
+    @type ttl: C{int}
+    '''
+    if not header:
+        return False
+    if header.get('format') != SNAPSHOT_FORMAT:
+        return False
+    if header.get('tool_version') != constants.__versionstr__:
+        return False
+    if header.get('site_url') != site_url:
+        return False
+    if sphinx_version is not None and header.get('sphinx_version') != sphinx_version:
+        return False
+    if ttl is not None and now() - header.get('created', 0) > ttl:
+        return False
+    return True
@@ -23,7 +23,7 @@ sphinxhp_extract.compat -- compatibility layer for dual Python integration etc.
 import os, sys
 
 __date__ = '2011-10-01'
-__updated__ = '2013-07-08'
+__updated__ = '2026-10-18'
 
 
 PY3 = sys.version_info >= (3, 0)
@@ -48,6 +48,13 @@ if PY3:
             f.write(text)
         finally:
             f.close()
+    
+    def open_encoded(fname, encoding='utf-8', errors='strict', mode='w', buffering=-1, newline=None):
+        '''
+        Open file `fname` for writing strings, with encoding and `buffering` bytes of buffer. 
+        `newline` is passed to C{open}; C{''} writes line endings untranslated.
+        '''
+        return open(fname, mode=mode, buffering=buffering, encoding=encoding, errors=errors, newline=newline)
 else:
     def to_bytes(s):
         """Convert string `s` to bytes (no-op in 2.x)."""
@@ -65,4 +72,45 @@ else:
             f.write(text.decode('utf-8'))
         finally:
             f.close()
+    
+    def open_encoded(fname, encoding='utf-8', errors='strict', mode='w', buffering=-1, newline=None):  # IGNORE:W0613
+        '''
+        Open file `fname` for writing strings, with encoding and `buffering` bytes of buffer. 
+        Line endings are never translated, so `newline` is ignored.
+        '''
+        import codecs
+        return codecs.open(fname, mode=mode, encoding=encoding, errors=errors, buffering=buffering)
+
+
+
+def open_gzip(fname=None, fileobj=None, encoding='utf-8', errors='strict', buffering=-1, newline=None, 
+              compresslevel=6):
+    '''
+    Open file `fname`, or wrap the binary stream `fileobj`, for writing 
+    strings gzip compressed. The gzip header holds neither file name nor 
+    time, so the same text always gives the same bytes. `fileobj` is 
+    left open when the returned stream is closed.
+    '''
+    import io
+    import gzip
+    raw = fileobj
+    if raw is None:
+        raw = open(fname, 'wb', buffering)
+    gz = gzip.GzipFile(filename='', mode='wb', compresslevel=compresslevel, fileobj=raw, mtime=0)
+    if fileobj is None:
+        # GzipFile closes the file it opened itself, make it close ours too
+        gz.myfileobj = raw
+    return io.TextIOWrapper(gz, encoding=encoding, errors=errors, newline=newline)
+
 
+def gzip_bytes(data, compresslevel=9):
+    '''Return the bytes `data` gzip compressed, like L{open_gzip} without file name or time.'''
+    import io
+    import gzip
+    buf = io.BytesIO()
+    gz = gzip.GzipFile(filename='', mode='wb', compresslevel=compresslevel, fileobj=buf, mtime=0)
+    try:
+        gz.write(data)
+    finally:
+        gz.close()
+    return buf.getvalue()
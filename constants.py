@@ -18,6 +18,8 @@ sphinxhp_extract.constants -- project wide constants.
 :contact:   | andre.bergmedia@googlemail.com
 '''
 
+import os
+
 __version__ = (0, 3, 2)
 __versionstr__ = '.'.join([str(num) for num in __version__])
 __url__ = 'http://github.com/andreberg/sphinxhp-data-extractor'
@@ -27,6 +29,16 @@ __updated__ = '2013-08-16'
 
 DEFAULT_REMOTE_SITE_URL = 'http://sphinx-doc.org'
 
+#: where database snapshots are kept between runs
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 
+                                 'sphinxhp-data-extractor')
+
+#: max. age of a database snapshot in seconds
+DEFAULT_SNAPSHOT_TTL = 24 * 60 * 60
+
+#: size in bytes of the buffer writers write their output files through
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
 #: matches http or https schemes only
 HTTP_URL_REGEX = r'''
 \b
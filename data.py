@@ -28,8 +28,18 @@ import os
 import re
 import sys
 import string  # IGNORE:W0402
+import io
+import csv
+import json
 import codecs
 import shutil
+import posixpath
+import hashlib
+import threading
+import functools
+import collections
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 # pylint:disable-msg=F0401, E0611
@@ -47,12 +57,17 @@ except ImportError:
 
 
 import constants
-from compat import write_encoded
+from compat import write_encoded, open_encoded, open_gzip, gzip_bytes
 from templite import Templite
-from utils import (html_escape, url_escape, linkify, rst_to_html, 
-                            markdown_to_html, nl_to_br, tstamp, create_path, 
-                            urlrequest, deprecated)
+from utils import (ReadWriteLock, html_escape, url_escape, linkify, rst_to_html, 
+                            markdown_to_html, nl_to_br, minify_html, tstamp, create_path, 
+                            urlrequest, deprecated, now)
 from errors import InvalidStateError
+from index import TrigramIndex, FullTextIndex, VersionIndex, parse_version
+from store import StringPool, ColumnStore, MappedEntryList, MappedFile, SharedMapped, encode_mapped, write_mapped
+from manifest import BuildManifest, file_digest, text_digest
+from cache import (snapshot_path, typemap_path, fill_lock, write_snapshot, read_snapshot, 
+                   read_snapshot_header, is_valid_snapshot)
 
 _is_lxml = False
 try:
@@ -65,8 +80,21 @@ except ImportError:
     from xml.etree.ElementTree import XMLParser
     import xml.etree.ElementTree as etree
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+__all__ = ['DataExtractor', 'DatabaseCache', 'SphinxDatabase', 'MappedDatabase', 'FrozenDatabase', 
+           'WriterDispatcher', 'EntryValues', 'CompletionRule', 'HTMLWriter', 'CSVWriter', 'CSVDialect', 
+           'GermanCSVDialect', 'NDJSONWriter', 'TextMateWriter']
+
+#: types a data epath's entry list can have (see `SphinxDatabase.compact`)
+ENTRY_LIST_TYPES = (list, ColumnStore, MappedEntryList)
 
-__all__ = ['DataExtractor', 'SphinxDatabase', 'HTMLWriter', 'CSVWriter', 'TextMateWriter']
+#: types of plain values such as metadata (as opposed to entries)
+SCALAR_TYPES = (str, int, float, type(None))
 
 __date__ = constants.__date__
 __updated__ = '2013-08-20'
@@ -104,16 +132,564 @@ def _data_filename(fname):
     return os.path.join(os.path.split(__file__)[0], fname)
 
 
+#: local files referenced by an HTML or CSS file: C{src='...'}, C{href='...'} and C{url(...)}
+ASSET_REF_RE = re.compile(r'''(?:\b(?:src|href)\s*=\s*['"]|\burl\(\s*['"]?)([^'"()#?:{}\s]+)''')
+
+
+def _referenced_files(*fnames):
+    '''
+    Return the names of the files in C{htmlfiles} referenced by the 
+    C{htmlfiles} templates or style sheets `fnames`, in order of first 
+    reference. Style sheets referenced are searched too, the pages the 
+    templates link to aren't included.
+    '''
+    result = []
+    pending = list(fnames)
+    while pending:
+        source = _data("htmlfiles/" + pending.pop(0))
+        for name in ASSET_REF_RE.findall(source):
+            if name in result or name.endswith('.html') \
+                    or not os.path.isfile(_data_filename("htmlfiles/" + name)):
+                continue
+            result.append(name)
+            if name.endswith('.css'):
+                pending.append(name)
+    return result
+
+
+#: file name suffix and function compressing bytes, per encoding 
+#: L{Writer.precompress} can use (C{'br'} needs the brotli module)
+PRECOMPRESS_ENCODINGS = {'gzip': ('.gz', gzip_bytes)}
+if brotli is not None:
+    PRECOMPRESS_ENCODINGS['br'] = ('.br', brotli.compress)
+
+
+#: how the completion name of an entry is derived, per epath: 
+#: C{(key, search regex, replacement)} (see L{CompletionRule})
+COMPLETION_NAME_RULES = {
+    'data/type/role':      ('name', r':(.+):',                 r'\1'),
+    'data/type/directive': ('name', r'\.\. (.+)::',            r'\1'),
+    'data/type/describe':  ('name', r'(\|(.+)\||\.\. (.+)::)', r'\1'),
+    'data/type/confval':   ('name', r':(.+):',                 r'\1'),
+    'data/type/function':  ('name', r'(.+)(?:\(.*\))?',        r'\1')
+}
+
+DEFAULT_COMPLETION_NAME_RULE = ('name', r'(.+)', r'\1')
+
+#: split on first period, but ignore 'e.g.' and 'etc.'
+FIRST_SENTENCE_RE = re.compile(r'(?<!e|g|c)\.', re.IGNORECASE | re.UNICODE)
+
+
+class CompletionRule(object):
+    '''
+    Derives the values completion formats show for an entry: 
+    the completion name, e.g. C{ref} for role C{:ref:}, and the 
+    summary, the first sentence of the description on a single 
+    line. The search regex is compiled once, case-insensitive.
+    '''
+    __slots__ = ('key', 'search', 'repl')
+    
+    def __init__(self, key, search_regex, repl_regex):
+        self.key = key
+        self.search = re.compile(search_regex, re.IGNORECASE | re.UNICODE)
+        self.repl = repl_regex
+    
+    def completion_name(self, entry):
+        return self.search.sub(self.repl, entry[self.key]).split(':')[-1]
+    
+    def summary(self, entry):  # IGNORE:R0201
+        desc = entry['description']
+        if len(desc) == 0:
+            return 'no description'
+        match = FIRST_SENTENCE_RE.search(desc)
+        if match is not None:
+            desc = desc[:match.start()]
+        return desc.replace('\r', ' ').replace('\n', ' ')
+    
+    def values(self, entry):
+        '''Return C{(completion name, summary)} for `entry`.'''
+        return (self.completion_name(entry), self.summary(entry))
+
+
+#: precompiled L{COMPLETION_NAME_RULES}
+COMPLETION_RULES = dict((epath, CompletionRule(*rule)) for epath, rule in COMPLETION_NAME_RULES.items())
+
+DEFAULT_COMPLETION_RULE = CompletionRule(*DEFAULT_COMPLETION_NAME_RULE)
+
+
+def completion_rule(epath):
+    '''Return the L{CompletionRule} for the entries at `epath`.'''
+    return COMPLETION_RULES.get(epath, DEFAULT_COMPLETION_RULE)
+
+
+def _value_digest(epath, value):
+    '''
+    Return a hex digest of `value`, the data at `epath`. It changes 
+    whenever the data does (see L{SphinxDatabase.get_digest}).
+    '''
+    if not isinstance(value, ENTRY_LIST_TYPES):
+        return text_digest(epath, value)
+    sha = hashlib.sha1(epath.encode('utf-8'))
+    keys = None
+    for entry in value:
+        if keys is None:
+            keys = list(entry.keys())
+            sha.update('\0'.join(keys).encode('utf-8'))
+        sha.update(('\n' + '\0'.join([str(entry[key]) for key in keys])).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def _cached_completions(contents, indexes, epath):
+    '''
+    Return C{(completion name, summary)} for each entry at `epath` 
+    in `contents`, cached in C{indexes['completions']}. `contents` 
+    and `indexes` must be of the same version of a database.
+    '''
+    completions = indexes.get('completions')
+    if completions is None:
+        completions = indexes.setdefault('completions', {})
+    values = completions.get(epath)
+    if values is None:
+        rule = completion_rule(epath)
+        values = completions.setdefault(epath, [rule.values(entry) for entry in contents[epath]])
+    return values
+
+
+class EntryValues(object):
+    '''
+    Values derived from an entry that more than one writer needs.
+    
+    They are computed on first access. Given `completions`, a 
+    function returning the values of all entries at `epath` (see 
+    L{SphinxDatabase.get_completions}), and the `position` of the 
+    entry, they are taken from there, so writers and later builds 
+    from the same database don't compute them again.
+    '''
+    __slots__ = ('epath', 'entry', '_completions', '_position', '_values')
+    
+    def __init__(self, epath, entry, completions=None, position=None):
+        self.epath = epath
+        self.entry = entry
+        self._completions = completions
+        self._position = position
+        self._values = None
+    
+    def _get_values(self):
+        if self._values is None:
+            if self._completions is not None:
+                self._values = self._completions()[self._position]
+            else:
+                self._values = completion_rule(self.epath).values(self.entry)
+        return self._values
+    
+    @property
+    def summary(self):
+        '''First sentence of the description on a single line.'''
+        return self._get_values()[1]
+    
+    @property
+    def completion_name(self):
+        '''Name as offered for completion, e.g. C{ref} for role C{:ref:}.'''
+        return self._get_values()[0]
+
+
 class Writer(object):
-    '''Base class for all writers.'''
+    '''
+    Base class for all writers.
+    
+    A writer is fed by a L{WriterDispatcher} with a sequence of 
+    events: C{begin()}, then for each data unit (a C{data/type/*} 
+    epath) C{begin_unit(unit)}, C{entry(unit, entry, values)} for 
+    every entry and C{end_unit(unit)}, and finally C{end()} which 
+    returns the number of files written. `unit` is a L{DataUnit} 
+    with C{epath} and C{comps} (the epath components after the 
+    primary type) set; C{num_entries} is set before C{end_unit}. 
+    `values` are the L{EntryValues} for the entry. Should the 
+    writer raise, C{abort()} is called instead of further events.
+    
+    Writers write their files as the events arrive through a 
+    buffer of C{buffer_size} bytes (see L{_open}), so the memory 
+    needed doesn't grow with the number of entries.
+    
+    Builds are incremental: a L{BuildManifest} in the output 
+    directory records what the last build wrote. Before a unit 
+    is sent, C{needs_unit(unit)} is asked, which returns False 
+    if the files made from the same input (C{unit.digest}) by 
+    a writer with the same settings are still there. A written 
+    file only replaces the existing one if its content differs, 
+    and does so atomically. Set C{incremental} to False to 
+    ignore the last build. After a build of all units the files 
+    of units that no longer exist are removed.
+    
+    With C{archive} set to an L{archive.OutputArchive} the files 
+    become members named C{archive_prefix/<file name>} instead, 
+    and everything is written.
+    
+    For static web servers every file with an extension in 
+    C{PRECOMPRESS_EXTS} gets a compressed sibling C{<file name>.gz} 
+    (C{.br}) for each encoding in C{precompress} (see 
+    L{PRECOMPRESS_ENCODINGS}), kept up to date with the file.
+    '''
+    
+    #: extensions of the files L{precompress} applies to
+    PRECOMPRESS_EXTS = ('.html', '.css', '.js')
     
     def __init__(self, database, outdir): # IGNORE:W0621
         super(Writer, self).__init__()
         self.database = check_database(database)
-        self.outdir = create_path(os.path.realpath(outdir))
+        # None for writers that write to a stream or archive instead
+        self.outdir = create_path(os.path.realpath(outdir)) if outdir is not None else None
+        self.buffer_size = constants.DEFAULT_BUFFER_SIZE
+        self.incremental = True
+        self.archive = None
+        self.archive_prefix = ''
+        self.precompress = ()
+        self.manifest = None
+        self._full_build = True
+        self._file = None
+        self._file_info = None
+    
+    def _settings(self):
+        '''
+        Return the settings that affect the output, as a list 
+        of strings. Output of a build with other settings is 
+        never reused.
+        '''
+        return [self.__class__.__name__, constants.__versionstr__, getattr(self, 'encoding', ''), 
+                ','.join(self.precompress)]
+    
+    def _tmp_path(self, fname):
+        return os.path.join(self.outdir, '.%s.%d-%d.tmp' % (os.path.basename(fname), os.getpid(), 
+                                                            threading.current_thread().ident))
+    
+    def _open(self, fname, encoding, errors='strict', unit=None, newline=None, compress=False):
+        '''
+        Open the file `fname` in the output directory as the 
+        current output file and return it. Its content goes to 
+        a temporary file until L{_close} is called. 
         
-    def write(self, *args, **kwargs):
-        raise NotImplementedError('Write.write() is abstract for %s' % type(self))
+        @param unit: the unit whose output the file is, if any.
+        @type unit: L{DataUnit}
+        @param newline: passed to L{compat.open_encoded}.
+        @param compress: if True, gzip the content (see L{compat.open_gzip}).
+        @type compress: C{bool}
+        '''
+        self._close()
+        if self.archive is not None:
+            member = self.archive.member(posixpath.join(self.archive_prefix, fname))
+            self._file = member.open_text(encoding=encoding, errors=errors, newline=newline, compress=compress)
+            self._file_info = (fname, member, unit)
+            return self._file
+        if self.outdir is None:
+            raise InvalidStateError("E: writer has neither an output directory nor an archive")
+        fname = os.path.relpath(os.path.join(self.outdir, fname), self.outdir)
+        tmp_path = self._tmp_path(fname)
+        if compress:
+            self._file = open_gzip(tmp_path, encoding=encoding, errors=errors, 
+                                   buffering=self.buffer_size, newline=newline)
+        else:
+            self._file = open_encoded(tmp_path, encoding=encoding, errors=errors, 
+                                      buffering=self.buffer_size, newline=newline)
+        self._file_info = (fname, tmp_path, unit)
+        return self._file
+    
+    def _close(self):
+        '''Close the current output file, if any, and move it into place (see L{_replace}).'''
+        if self._file is not None:
+            f, self._file = self._file, None
+            fname, tmp_path, unit = self._file_info
+            if self.archive is not None:
+                f.close()
+                self._precompress(fname, self._file_info[1].commit())
+                return
+            try:
+                f.close()
+                replaced = self._replace(tmp_path, fname, file_digest(tmp_path), unit)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self._precompress(fname, unit=unit, replaced=replaced)
+    
+    def _discard(self):
+        '''Close the current output file, if any, leaving the old file in place.'''
+        if self._file is not None:
+            f, self._file = self._file, None
+            if self.archive is not None:
+                f.close()
+                self._file_info[1].discard()
+                return
+            try:
+                f.close()
+            finally:
+                os.remove(self._file_info[1])
+    
+    def _replace(self, tmp_path, fname, digest, unit=None):
+        '''
+        Rename `tmp_path` to `fname` in the output directory, 
+        unless the manifest says `fname` has `digest` already. 
+        Return True if it was renamed.
+        '''
+        replaced = self.manifest is None or not self.manifest.has_file(fname, digest)
+        if replaced:
+            os.replace(tmp_path, os.path.join(self.outdir, fname))
+        if self.manifest is not None:
+            self.manifest.add_file(fname, digest, None if unit is None else unit.epath)
+        return replaced
+    
+    def _precompress(self, fname, data=None, unit=None, replaced=True):
+        '''
+        Write the compressed siblings of the output file `fname` 
+        with content `data` (default: read from the file), if it 
+        has any (see L{precompress}). Siblings of a file that 
+        wasn't `replaced` are only written if they are missing.
+        '''
+        if not self.precompress or not fname.endswith(self.PRECOMPRESS_EXTS):
+            return
+        key = None if unit is None else unit.epath
+        for encoding in self.precompress:
+            suffix, compress = PRECOMPRESS_ENCODINGS[encoding]
+            sibling = fname + suffix
+            if not replaced and self.manifest is not None and sibling in self.manifest.files \
+                    and os.path.exists(os.path.join(self.outdir, sibling)):
+                self.manifest.add_file(sibling, self.manifest.files[sibling], key)
+                continue
+            if data is None:
+                with open(os.path.join(self.outdir, fname), 'rb') as f:
+                    data = f.read()
+            compressed = compress(data)
+            if self.archive is not None:
+                self.archive.add_data(posixpath.join(self.archive_prefix, sibling), compressed)
+                continue
+            tmp_path = self._tmp_path(sibling)
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(compressed)
+                self._replace(tmp_path, sibling, hashlib.sha1(compressed).hexdigest(), unit)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    
+    def _copy(self, src, fname):
+        '''
+        Copy the file `src` to `fname` in the output directory 
+        unless it is there already. Return True if it was copied.
+        '''
+        if self.archive is not None:
+            self.archive.add_file(src, posixpath.join(self.archive_prefix, fname))
+            self._precompress(fname, self._read_precompressed(src, fname))
+            return True
+        digest = file_digest(src)
+        if self.manifest is not None and self.manifest.has_file(fname, digest):
+            self._precompress(fname, replaced=False)
+            return False
+        tmp_path = self._tmp_path(fname)
+        try:
+            shutil.copyfile(src, tmp_path)
+            self._replace(tmp_path, fname, digest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._precompress(fname)
+        return True
+    
+    def _read_precompressed(self, src, fname):
+        '''Return the content of `src` if `fname` gets compressed siblings, else None.'''
+        if not self.precompress or not fname.endswith(self.PRECOMPRESS_EXTS):
+            return None
+        with open(src, 'rb') as f:
+            return f.read()
+    
+    def start_build(self, full=True):
+        '''
+        Set up the manifest, reading the last build's if `incremental`. 
+        `full` is False if not all data units are going to be sent.
+        '''
+        self._full_build = full
+        if self.archive is not None:
+            return
+        self.manifest = BuildManifest(self.outdir, text_digest(*self._settings()))
+        if self.incremental:
+            self.manifest.load()
+    
+    def finish_build(self):
+        '''
+        Save the manifest for the next build. After a full build, 
+        the files of units that no longer exist are removed first.
+        '''
+        if self.manifest is None:
+            return
+        if self._full_build:
+            for fname in self.manifest.drop_unvisited():
+                path = os.path.join(self.outdir, fname)
+                if os.path.exists(path):
+                    os.remove(path)
+        self.manifest.save()
+        self.manifest = None
+    
+    def needs_unit(self, unit):
+        '''Return False if the output for `unit` is still current, else start its record.'''
+        if self.manifest is None:
+            return True
+        self.manifest.visit(unit.epath)
+        if self.manifest.is_current(unit.epath, unit.digest):
+            return False
+        self.manifest.start_unit(unit.epath, unit.digest)
+        return True
+    
+    def begin(self):
+        pass
+    
+    def begin_unit(self, unit):
+        pass
+    
+    def entry(self, unit, entry, values):
+        pass
+    
+    def end_unit(self, unit):
+        pass
+    
+    def end(self):
+        return 0
+    
+    def abort(self):
+        self._discard()
+        self.manifest = None
+        
+    def write(self, epaths=None):
+        '''
+        Write the data at `epaths` (default: all data epaths). 
+        Return the number of files written.
+        '''
+        return WriterDispatcher(self.database, [self]).run(epaths)[0]
+
+
+class WriterDispatcher(object):
+    '''
+    Walks the data epaths of a database once and feeds each 
+    entry to all of its writers (see L{Writer}).
+    
+    With `isolate_errors` an exception raised by a writer 
+    is stored in C{errors} and the writer is dropped, while 
+    the others continue. C{timings} holds the seconds spent 
+    in each writer's event handlers.
+    '''
+    
+    def __init__(self, database, writers, isolate_errors=False):
+        super(WriterDispatcher, self).__init__()
+        self.database = check_database(database)
+        self.writers = list(writers)
+        self.isolate_errors = isolate_errors
+        self.errors = {}
+        self.timings = {}
+    
+    def _data_epaths(self, epaths):
+        if not epaths:
+            return self.database.expand_epath('data*')
+        result = []
+        for epath in epaths:
+            for fe in self.database.expand_epath(epath):
+                if self.database.primary_type(fe) == 'data' and fe not in result:
+                    result.append(fe)
+        return result
+    
+    def _fail(self, writer, e):
+        try:
+            writer.abort()
+        except Exception:  # IGNORE:W0703
+            pass
+        if not self.isolate_errors:
+            raise e
+        self.errors[writer] = e
+    
+    def _send(self, writers, event, *args):
+        for writer in list(writers):
+            start = now()
+            try:
+                getattr(writer, event)(*args)
+            except Exception as e:  # IGNORE:W0703
+                self._fail(writer, e)
+                writers.remove(writer)
+            self.timings[writer] += now() - start
+    
+    def _pinned(self):
+        '''Return the current C{(contents, indexes)} of the database.'''
+        with self.database.lock.reading():
+            return self.database.contents, self.database.indexes
+    
+    def run(self, epaths=None):
+        '''
+        Send the data at `epaths` (default: all data epaths) to 
+        the writers. Return the result of each writer's C{end()}, 
+        None for writers that failed.
+        
+        The whole pass reads the version of the data current when 
+        it starts, so a concurrent C{refresh()} or C{__setitem__} 
+        changes nothing under the writers. Units still pending 
+        after a lazy initialize are the exception: each is read 
+        from the version its extraction publishes.
+        
+        Units are only sent to the writers that need them (see 
+        L{Writer.needs_unit}). Units no writer needs aren't sent, 
+        but are still read to compute their digest.
+        '''
+        self.errors = {}
+        self.timings = dict((writer, 0.0) for writer in self.writers)
+        with self.database.lock.reading():
+            unit_epaths = self._data_epaths(epaths)
+            full = not epaths or set(unit_epaths) == set(self._data_epaths(None))
+            contents, indexes = self._pinned()
+        active = list(self.writers)
+        self._send(active, 'start_build', full)
+        self._send(active, 'begin')
+        for epath in unit_epaths:
+            if not active:
+                break
+            unit_contents, unit_indexes = contents, indexes
+            if epath not in unit_contents:
+                # after a lazy initialize, units are extracted one by one
+                # as they are needed, so writers get going early
+                self.database.load([epath])
+                unit_contents, unit_indexes = self._pinned()
+                if epath not in unit_contents:
+                    # dropped by a refresh meanwhile
+                    continue
+            value = unit_contents[epath]
+            if isinstance(value, ENTRY_LIST_TYPES):
+                num_entries = len(value)
+            else:
+                num_entries = 1 if value else 0
+            unit = DataUnit(epath=epath, comps=epath.split('/')[1:], num_entries=num_entries, 
+                            digest=_value_digest(epath, value))
+            writers = [writer for writer in active if writer.needs_unit(unit)]
+            if not writers:
+                continue
+            if isinstance(value, ENTRY_LIST_TYPES):
+                entries = value
+                completions = functools.partial(_cached_completions, unit_contents, unit_indexes, epath)
+            else:
+                entries = [value] if value else []
+                completions = None
+            self._send(writers, 'begin_unit', unit)
+            for position, entry in enumerate(entries):
+                if not writers:
+                    break
+                self._send(writers, 'entry', unit, entry, EntryValues(epath, entry, completions, position))
+            self._send(writers, 'end_unit', unit)
+            active = [writer for writer in active if writer not in self.errors]
+        results = []
+        for writer in self.writers:
+            result = None
+            if writer in active:
+                start = now()
+                try:
+                    result = writer.end()
+                    writer.finish_build()
+                except Exception as e:  # IGNORE:W0703
+                    self._fail(writer, e)
+                    result = None
+                self.timings[writer] += now() - start
+            results.append(result)
+        return results
 
 
 class TextMateWriter(Writer):
@@ -127,67 +703,52 @@ class TextMateWriter(Writer):
         <string>word2</string> <!-- word2 comment -->
     '''
     
+    # need to handle each type seperatly because we need to extract
+    # strings differently from the ids and names (see EntryValues).
+    fext = '.txt'
+    indent = '    ' * 3
+    str_template = '%s<string>%s</string>'
+    cmt_template = '<!-- %s -->'
+    
     def __init__(self, database, outdir):  # IGNORE:W0621
         super(TextMateWriter, self).__init__(database, outdir)
         self.encoding = sys.getdefaultencoding()
+        self._lines = []
+        self._descriptions = []
+        self._num_written_files = 0
     
-    def write(self, epaths=None):  # IGNORE:W0221
-        def __append_entries(entries, settings):
-            lines = []
-            descriptions = []
-            result = []
-            # split on first period, but ignore 'e.g.' and 'etc.'
-            desc_first_line_re = re.compile(r'(?<!e|g|c)\.', re.IGNORECASE | re.UNICODE)
-            key, search_regex, repl_regex = settings
-            for entry in entries:
-                desc = entry['description']
-                if len(desc) > 0:
-                    desc = re.sub(r'[\r\n]', ' ', re.split(desc_first_line_re, desc, 2)[0])
-                else:
-                    desc = 'no description'
-                try:
-                    name = re.sub(search_regex, repl_regex, entry[key], re.IGNORECASE)
-                    name = name.split(':')[-1]
-                    lines.append(str_template % (indent, name))
-                    descriptions.append(cmt_template % desc)
-                except Exception as e: # IGNORE:W0703
-                    if DEBUG:
-                        print('Exception: %s' % e)
-                    continue
-            max_pos = len(max(lines, key=len))
-            for i, line in enumerate(lines):
-                result.append(line + '  ' + (' ' * (max_pos - len(line))) + descriptions[i])
-            return result
-        
-        value_settings = {
-            'data/type/role':      ('name', r':(.+):',                 r'\1'),
-            'data/type/directive': ('name', r'\.\. (.+)::',            r'\1'),
-            'data/type/describe':  ('name', r'(\|(.+)\||\.\. (.+)::)', r'\1'),
-            'data/type/confval':   ('name', r':(.+):',                 r'\1'),
-            'data/type/function':  ('name', r'(.+)(?:\(.*\))?',        r'\1')
-        }
-        default_settings = ('name', r'(.+)', r'\1')
-            
-        # need to handle each type seperatly because we need to extract
-        # strings differently from the ids and names. this is also why
-        # we don't support caller giving a target epath.
-        fext = '.txt'
-        indent = '    ' * 3
-        str_template = '%s<string>%s</string>'
-        cmt_template = '<!-- %s -->'
-        if not epaths:
-            epaths = self.database.expand_epath('data*')
-        num_written_files = 0
-        for epath in epaths:
-            settings = value_settings.get(epath, default_settings)
-            cur_data = self.database.get_data(epath)
-            comps = epath.split('/')[1:]
-            cur_fname = '-'.join(comps) + fext
-            cur_lines = __append_entries(cur_data, settings)
-            write_encoded(os.path.join(self.outdir, cur_fname), 
-                          os.linesep.join(cur_lines), encoding=self.encoding, errors="strict")
-            num_written_files += 1
-        return num_written_files
+    def begin(self):
+        self._num_written_files = 0
+    
+    def begin_unit(self, unit):
+        self._lines = []
+        self._descriptions = []
+    
+    def entry(self, unit, entry, values):
+        desc = values.summary
+        try:
+            self._lines.append(self.str_template % (self.indent, values.completion_name))
+            self._descriptions.append(self.cmt_template % desc)
+        except Exception as e: # IGNORE:W0703
+            if DEBUG:
+                print('Exception: %s' % e)
+    
+    def end_unit(self, unit):
+        # comments are aligned to the longest line, so the lines 
+        # of a unit are only written once all are known
+        max_pos = max([len(line) for line in self._lines] or [0])
+        f = self._open('-'.join(unit.comps) + self.fext, self.encoding, unit=unit)
+        for i, line in enumerate(self._lines):
+            if i > 0:
+                f.write(os.linesep)
+            f.write(line + '  ' + (' ' * (max_pos - len(line))) + self._descriptions[i])
+        self._close()
+        self._lines = []
+        self._descriptions = []
+        self._num_written_files += 1
+    
+    def end(self):
+        return self._num_written_files
 
 
 class ListWriter(Writer):
@@ -202,221 +763,504 @@ class ListWriter(Writer):
         ['word1', ... 'wordN']
     '''
     
-    def __init__(self, database, outdir):  # IGNORE:W0621
+    fext = '.txt'
+    str_template = '%s"%s", '
+    cmt_template = ' # %s'
+    
+    def __init__(self, database, outdir, include_comments=False):  # IGNORE:W0621
         super(ListWriter, self).__init__(database, outdir)
         self.encoding = sys.getdefaultencoding()
+        self.include_comments = include_comments
+        self._lines = []
+        self._descriptions = []
+        self._last_item = None
+        self._num_written_files = 0
     
-    def write(self, epaths=None, include_comments=False):  # IGNORE:W0221
-        def __append_entries(entries, settings):
-            lines = []
-            descriptions = []
-            result = []
-            # split on first period, but ignore 'e.g.' and 'etc.'
-            desc_first_line_re = re.compile(r'(?<!e|g|c)\.', re.IGNORECASE | re.UNICODE)
-            key, search_regex, repl_regex = settings
-            for entry in entries:
-                desc = entry['description']
-                if len(desc) > 0:
-                    desc = re.sub(r'[\r\n]', ' ', re.split(desc_first_line_re, desc, 2)[0])
-                else:
-                    desc = 'no description'
-                try:
-                    name = re.sub(search_regex, repl_regex, entry[key], re.IGNORECASE)
-                    name = name.split(':')[-1]
-                    lines.append(str_template % (indent, name))
-                    descriptions.append(cmt_template % desc)
-                except Exception as e: # IGNORE:W0703
-                    if DEBUG:
-                        print('Exception: %s' % e)
-                    continue
-            max_pos = len(max(lines, key=len))
-            if include_comments is True:
-                for i, line in enumerate(lines):
-                    result.append(line + '  ' + (' ' * (max_pos - len(line))) + descriptions[i])
-            else:
-                result = lines
-            return result
-        
-        value_settings = {
-            'data/type/role':      ('name', r':(.+):',                 r'\1'),
-            'data/type/directive': ('name', r'\.\. (.+)::',            r'\1'),
-            'data/type/describe':  ('name', r'(\|(.+)\||\.\. (.+)::)', r'\1'),
-            'data/type/confval':   ('name', r':(.+):',                 r'\1'),
-            'data/type/function':  ('name', r'(.+)(?:\(.*\))?',        r'\1')
-        }
-        
-        default_settings = ('name', r'(.+)', r'\1')
-            
-        # need to handle each type seperatly because we need to extract
-        # strings differently from the ids and names. this is also why
-        # we don't support caller giving a target epath.
-        fext = '.txt'
-        if include_comments is True:
+    def _settings(self):
+        return super(ListWriter, self)._settings() + [str(self.include_comments)]
+    
+    def begin(self):
+        self._num_written_files = 0
+    
+    def begin_unit(self, unit):
+        self._lines = []
+        self._descriptions = []
+        self._last_item = None
+        if self.include_comments is not True:
+            # without comments there is nothing to align, 
+            # so items are written as they come
+            self._open('-'.join(unit.comps) + self.fext, self.encoding, unit=unit).write("[")
+    
+    def entry(self, unit, entry, values):
+        if self.include_comments is True:
             indent = '   '
         else:
             indent = ''
-        str_template = '%s"%s", '
-        cmt_template = ' # %s'
-        if not epaths:
-            epaths = self.database.expand_epath('data*')
-        num_written_files = 0
-        for epath in epaths:
-            settings = value_settings.get(epath, default_settings)
-            cur_data = self.database.get_data(epath)
-            comps = epath.split('/')[1:]
-            cur_fname = '-'.join(comps) + fext
-            cur_lines = __append_entries(cur_data, settings)
-            if include_comments is True:
-                final_lines = "[" + os.linesep + (os.linesep.join(cur_lines)) + os.linesep + "]"
-            else:
-                cur_lines[-1] = cur_lines[-1][:-2]  # remove ', ' from last entry
-                final_lines = "[" + (''.join(cur_lines)) + "]"
-            write_encoded(os.path.join(self.outdir, cur_fname), 
-                          final_lines, encoding=self.encoding, errors="strict")
-            num_written_files += 1
-        return num_written_files
+        desc = values.summary
+        try:
+            item = self.str_template % (indent, values.completion_name)
+        except Exception as e: # IGNORE:W0703
+            if DEBUG:
+                print('Exception: %s' % e)
+            return
+        if self.include_comments is True:
+            self._lines.append(item)
+            self._descriptions.append(self.cmt_template % desc)
+        else:
+            # each item is written when the next one arrives, 
+            # the last one goes without the trailing ', '
+            if self._last_item is not None:
+                self._file.write(self._last_item)
+            self._last_item = item
+    
+    def end_unit(self, unit):
+        if self.include_comments is True:
+            max_pos = max([len(line) for line in self._lines] or [0])
+            f = self._open('-'.join(unit.comps) + self.fext, self.encoding, unit=unit)
+            f.write("[" + os.linesep)
+            for i, line in enumerate(self._lines):
+                f.write(line + '  ' + (' ' * (max_pos - len(line))) + self._descriptions[i] + os.linesep)
+            f.write("]")
+            self._lines = []
+            self._descriptions = []
+        else:
+            if self._last_item is not None:
+                self._file.write(self._last_item[:-2])  # remove ', ' from last entry
+            self._file.write("]")
+        self._close()
+        self._num_written_files += 1
+    
+    def end(self):
+        return self._num_written_files
+    
+    def write(self, epaths=None, include_comments=None):  # IGNORE:W0221
+        if include_comments is not None:
+            self.include_comments = include_comments
+        return super(ListWriter, self).write(epaths)
+
+
+class CSVDialect(csv.Dialect):
+    '''
+    Dialect of the files L{CSVWriter} writes by default: comma 
+    separated, every value quoted, platform line endings. 
+    
+    Besides the attributes of a C{csv.Dialect} it has C{decimal}, 
+    the decimal separator of values that are decimal numbers.
+    '''
+    delimiter = ','
+    quotechar = '"'
+    escapechar = None
+    doublequote = True
+    skipinitialspace = False
+    lineterminator = os.linesep
+    quoting = csv.QUOTE_ALL
+    decimal = '.'
+
+
+class GermanCSVDialect(CSVDialect):
+    '''Dialect German Excel reads: semicolon separated, with decimal comma.'''
+    delimiter = ';'
+    decimal = ','
+
+
+#: a value that is a decimal number, e.g. C{'0.2'} (but not C{'1.2b1'})
+DECIMAL_RE = re.compile(r'^[+-]?\d+\.\d+$')
 
 
 class CSVWriter(Writer):
-    '''Output the data stored in `SphinxDatabase` as comma separated value files.'''
+    '''
+    Output the data stored in `SphinxDatabase` as comma separated value files.
+    
+    Files are written by the C{csv} module in C{dialect} (see 
+    L{CSVDialect}). Rows are collected in batches of C{batch_size} 
+    which are transformed a column at a time: values that are 
+    decimal numbers get the dialect's decimal separator, then 
+    C{column_callback(column, values)} is passed the name and 
+    the list of values of each column and returns the new list.
+    
+    C{value_callback(row, idx, header)} is the older interface. 
+    It is passed each row formatted as a string, which is slower.
+    '''
+    
+    #: dialect attributes that affect the output
+    DIALECT_ATTRS = ('delimiter', 'quotechar', 'escapechar', 'doublequote', 'lineterminator', 'quoting', 'decimal')
  
     def __init__(self, database, outdir):  # IGNORE:W0621
         super(CSVWriter, self).__init__(database, outdir)
-        self.colsep = ","
-        self.rowsep = os.linesep
+        self.dialect = CSVDialect
         self.empty_value = ''
+        self.batch_size = 1024
+        self.column_callback = None
         self.value_callback = None
         self.encoding = sys.getdefaultencoding()
         self._header = ['name', 'value']
         self._num_written_files = 0
-
-    def _sanitize_data(self, value):
-        value = value.replace('"', '""')
-        #value = value.replace('\n', r'\n')
-        #value = value.replace('\r', r'\r')
-        #value = value.replace('\t', r'\t')
-        value = '"' + value + '"'
-        return value
+        self._metadata_epaths = None
+        self._columns = None
+        self._rows = []
+        self._row_index = 0
+        self._buffer = None
+        self._writer = None
+        self._header_writer = None
+
+    def _settings(self):
+        def __name(callback):
+            if callback is None:
+                return str(None)
+            return '%s.%s' % (callback.__module__, getattr(callback, '__name__', repr(callback)))
+        dialect = [repr(getattr(self.dialect, attr, None)) for attr in self.DIALECT_ATTRS]
+        return super(CSVWriter, self)._settings() + dialect + [self.empty_value, 
+                                                               __name(self.column_callback), 
+                                                               __name(self.value_callback)]
 
     def _sanitize_epaths(self, epaths, primary_type):
         for epath in epaths:
             if self.database.primary_type(epath) != primary_type:
                 raise ValueError('E: epath must begin with "%s/..."' % primary_type)
     
-    def _data_to_csv(self, epath):
-        data = self.database.get_data(epath)  # IGNORE:W0621
-        if data is None:
-            data = self.empty_value
-        result = []
-        if not isinstance(data, list):
-            comps = epath.split('/')[1:]
-            name = " » ".join(comps).replace("_", " ")
-            value = linkify(str(data))
-            curdata = "%s%s%s" % (name, self.colsep, value)
-            result.append(curdata)
+    def _open_csv(self, fname, unit=None):
+        '''
+        Open `fname` like L{_open} and set up the C{csv} writers 
+        for it: one quoting as the dialect says for data rows, 
+        one quoting only where needed for header rows.
+        '''
+        f = self._open(fname, self.encoding, errors='xmlcharrefreplace', unit=unit, newline='')
+        if self.value_callback is None:
+            target = f
         else:
-            if len(data) == 0:
-                return self.empty_value
-            # get column names from the first dict in the data list
-            # this assumes that each item's dict has the same layout
-            # which should always be true considering how this database
-            # is constructed
-            rows = []
-            columns = list(data[0].keys())
-            self._header = columns
-            curdata = self.colsep.join(columns)
-            rows.append(curdata)
-            for item in data:
-                curdata = ''
-                for column in columns:
-                    value = item[column]
-                    if not value:
-                        value = self.empty_value
-                    value = self._sanitize_data(value)
-                    curdata += value + self.colsep
-                curdata = curdata[:-1]  # remove trailing colsep
-                rows.append(curdata)
-            result = rows
-        return result
+            # rows are formatted here, then passed to value_callback
+            target = self._buffer = io.StringIO()
+        self._writer = csv.writer(target, self.dialect)
+        self._header_writer = csv.writer(target, self.dialect, quoting=csv.QUOTE_MINIMAL)
+        self._rows = []
+        self._row_index = 0
+        return f
     
-    def _do_value_callback(self, rows):
+    def _write_rows(self, rows, header=False):
+        '''
+        Write `rows` to the current file. Values that are not strings, 
+        e.g. numbers a C{column_callback} returned, are written as 
+        C{csv.writer} formats them.
+        '''
+        writer = self._header_writer if header else self._writer
         if self.value_callback is None:
+            writer.writerows(rows)
+            return
+        buf = self._buffer
+        terminator = self.dialect.lineterminator
+        for row in rows:
+            writer.writerow(row)
+            line = buf.getvalue()[:-len(terminator)]
+            buf.seek(0)
+            buf.truncate()
+            line = self.value_callback(line, self._row_index, self._header)  # IGNORE:E1102
+            self._file.write(line + terminator)
+            self._row_index += 1
+    
+    def _transform(self, rows, columns):
+        '''Return the batch `rows` with each of the `columns` transformed.'''
+        decimal = getattr(self.dialect, 'decimal', '.')
+        callback = self.column_callback
+        if decimal == '.' and callback is None:
             return rows
-        for idx, value in enumerate(rows):
-            modified_value = self.value_callback(value, idx, self._header)  # IGNORE:E1102
-            rows[idx] = modified_value
+        values_by_column = [list(values) for values in zip(*rows)]
+        for idx, values in enumerate(values_by_column):
+            if decimal != '.':
+                values = [value.replace('.', decimal) 
+                          if isinstance(value, str) and '.' in value and DECIMAL_RE.match(value) else value 
+                          for value in values]
+            if callback is not None:
+                values = callback(columns[idx], values)
+            values_by_column[idx] = values
+        return zip(*values_by_column)
+    
+    def _flush(self):
+        '''Transform and write the rows collected so far.'''
+        if self._rows:
+            rows, self._rows = self._rows, []
+            self._write_rows(self._transform(rows, self._columns))
+    
+    def _metadata_rows(self, epath):
+        '''Return the rows for the metadata at `epath`.'''
+        data = self.database.get_data(epath)  # IGNORE:W0621
+        if not isinstance(data, ENTRY_LIST_TYPES):
+            if data is None:
+                data = self.empty_value
+            comps = epath.split('/')[1:]
+            name = " » ".join(comps).replace("_", " ")
+            return [[name, linkify(str(data))]]
+        if len(data) == 0:
+            return []
+        # get column names from the first dict in the data list
+        # this assumes that each item's dict has the same layout
+        # which should always be true considering how this database
+        # is constructed
+        columns = list(data[0].keys())
+        rows = [columns]
+        for item in self.database.iter_data(epath):
+            rows.append([item[column] or self.empty_value for column in columns])
         return rows
         
-    def _handle_metadata(self, epath=None):
+    def _handle_metadata(self, epaths=None):
+        '''Write the metadata among `epaths` (default: all) to C{metadata.csv}.'''
         primary_type = 'metadata'
-        fullpath = os.path.join(self.outdir, primary_type + '.csv')
-        header = "%s%s" % (self.colsep.join(self._header), self.rowsep)
-        rows = [header]
-        if epath is None:
-            epaths = self.database.expand_epath(primary_type + '*')
-        else:
-            epaths = self.database.expand_epath(epath)
-        try:
-            self._sanitize_epaths(epaths, primary_type)
-        except ValueError:
-            return
+        if epaths is None:
+            epaths = [primary_type + '*']
+        metadata_epaths = []
         for epath in epaths:
-            rest = self._data_to_csv(epath)
-            rest = self._do_value_callback(rest)
-            rows.extend(rest)
-        csvdata = self.rowsep.join(rows)
-        write_encoded(fullpath, csvdata, encoding=self.encoding, errors='xmlcharrefreplace')
-        self._num_written_files += 1
-
-    def _handle_data(self, epath=None):
-        primary_type = 'data'
-        if epath is None:
-            epaths = self.database.expand_epath(primary_type + '*')
-        else:
-            epaths = self.database.expand_epath(epath)
-        try:
-            self._sanitize_epaths(epaths, primary_type)
-        except ValueError:
+            for fe in self.database.expand_epath(epath):
+                if self.database.primary_type(fe) == primary_type and fe not in metadata_epaths:
+                    metadata_epaths.append(fe)
+        if not metadata_epaths:
             return
-        for epath in epaths:
-            rows = self._data_to_csv(epath)
-            if (len(rows) == 0):
-                continue
-            rows = self._do_value_callback(rows)
-            csvdata = self.rowsep.join(rows)
-            comps = epath.split("/")[1:]
+        self._open_csv(primary_type + '.csv')
+        # the columns of _metadata_rows' rows for plain values
+        self._columns = self._header = ['name', 'value']
+        self._write_rows([self._header], header=True)
+        for epath in metadata_epaths:
+            self._rows.extend(self._metadata_rows(epath))
+        self._flush()
+        self._close()
+        self._num_written_files += 1
+    
+    def begin_unit(self, unit):
+        self._columns = None
+        self._rows = []
+    
+    def entry(self, unit, entry, values):
+        if self._columns is None:
+            # get column names from the first entry. this assumes 
+            # that each entry has the same layout which should always 
+            # be true considering how this database is constructed
+            self._columns = self._header = list(entry.keys())
+            comps = unit.comps
             if len(comps) == 1:
-                fullpath = os.path.join(self.outdir, comps[0])
+                fname = comps[0]
             else:
-                fullpath = os.path.join(self.outdir, comps[0] + "-" + comps[1])
-            fullpath += ".csv"
-            write_encoded(fullpath, csvdata, encoding=self.encoding, errors='xmlcharrefreplace')
+                fname = comps[0] + "-" + comps[1]
+            self._open_csv(fname + ".csv", unit=unit)
+            self._write_rows([self._columns], header=True)
+        empty_value = self.empty_value
+        self._rows.append([entry[column] or empty_value for column in self._columns])
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+    
+    def end_unit(self, unit):
+        if self._file is not None:
+            self._flush()
+            self._close()
             self._num_written_files += 1
+    
+    def abort(self):
+        self._rows = []
+        super(CSVWriter, self).abort()
+    
+    def end(self):
+        self._handle_metadata(self._metadata_epaths)
+        return self._num_written_files
             
     def write(self, epaths=None):  # IGNORE:W0221
+        self._metadata_epaths = epaths
+        try:
+            return super(CSVWriter, self).write(epaths)
+        finally:
+            self._metadata_epaths = None
+
+
+class NDJSONWriter(Writer):
+    '''
+    Output the data stored in `SphinxDatabase` as newline delimited 
+    JSON: one object per line, for each entry with its C{epath} 
+    first, for metadata as C{{"epath": ..., "value": ...}}.
+    
+    Writes a file per data unit and C{metadata.ndjson}, gzipped 
+    with a C{.gz} extension if `compress` is True. Given a binary 
+    `stream` instead, e.g. C{sys.stdout.buffer}, all lines go there, 
+    metadata first, and the stream is flushed after each unit so 
+    consumers can start on the first units early. Output to a 
+    stream is never incremental.
+    
+    Example output::
+        
+        {"epath":"data/type/role","id":"role-ref","name":":ref:",...}
+    '''
+    
+    fext = '.ndjson'
+    
+    def __init__(self, database, outdir=None, stream=None, compress=False):  # IGNORE:W0621
+        super(NDJSONWriter, self).__init__(database, outdir if stream is None else None)
+        self.encoding = 'utf-8'
+        self.stream = stream
+        self.compress = compress
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        self._out = None
+        self._metadata_epaths = None
+        self._num_written_files = 0
+    
+    def _settings(self):
+        return super(NDJSONWriter, self)._settings() + [str(self.compress)]
+    
+    def _open_ndjson(self, name, unit=None):
+        '''Open the file for `name` in the output directory as the current output.'''
+        fname = name + self.fext
+        if self.compress:
+            fname += '.gz'
+        self._out = self._open(fname, self.encoding, unit=unit, newline='', compress=self.compress)
+        return self._out
+    
+    def _close_ndjson(self):
+        if self.stream is None:
+            self._close()
+            self._num_written_files += 1
+        self._out = None
+    
+    def _open_stream(self):
+        if self.compress:
+            self._out = open_gzip(fileobj=self.stream, encoding=self.encoding, newline='')
+        else:
+            self._out = io.TextIOWrapper(self.stream, encoding=self.encoding, newline='')
+    
+    def _close_stream(self):
+        '''Finish the output to `stream`, leaving the stream itself open.'''
+        out, self._out = self._out, None
+        if out is not None:
+            if self.compress:
+                # writes the gzip trailer, the stream isn't closed
+                out.close()
+            else:
+                out.flush()
+                out.detach()
+            self.stream.flush()
+    
+    def _write_metadata(self):
+        epaths = self._metadata_epaths
         if epaths is None:
-            epaths = self.database.get_epaths()
+            epaths = ['metadata*']
+        metadata_epaths = []
         for epath in epaths:
-            self._handle_metadata(epath)
-            self._handle_data(epath)
+            for fe in self.database.expand_epath(epath):
+                if self.database.primary_type(fe) == 'metadata' and fe not in metadata_epaths:
+                    metadata_epaths.append(fe)
+        if not metadata_epaths:
+            return
+        if self.stream is None:
+            self._open_ndjson('metadata')
+        for epath in metadata_epaths:
+            self._out.write(self._encoder.encode({'epath': epath, 'value': self.database[epath]}) + '\n')
+        if self.stream is None:
+            self._close_ndjson()
+    
+    def start_build(self, full=True):
+        if self.stream is None:
+            super(NDJSONWriter, self).start_build(full)
+    
+    def finish_build(self):
+        if self.stream is None:
+            super(NDJSONWriter, self).finish_build()
+    
+    def begin(self):
+        self._num_written_files = 0
+        if self.stream is not None:
+            self._open_stream()
+        self._write_metadata()
+    
+    def begin_unit(self, unit):
+        if self.stream is None:
+            self._open_ndjson('-'.join(unit.comps), unit)
+    
+    def _write_entry(self, epath, entry):
+        obj = {'epath': epath}
+        for key in entry.keys():
+            obj[key] = entry[key]
+        self._out.write(self._encoder.encode(obj) + '\n')
+    
+    def entry(self, unit, entry, values):
+        self._write_entry(unit.epath, entry)
+    
+    def end_unit(self, unit):
+        if self.stream is None:
+            self._close_ndjson()
+        else:
+            self._out.flush()
+            self.stream.flush()
+    
+    def abort(self):
+        if self.stream is not None:
+            try:
+                self._close_stream()
+            except Exception:  # IGNORE:W0703
+                pass
+        self._out = None
+        super(NDJSONWriter, self).abort()
+    
+    def end(self):
+        if self.stream is not None:
+            self._close_stream()
         return self._num_written_files
+    
+    def _write_selected(self, epaths):
+        '''
+        Write the metadata and then the entries at `epaths`, some 
+        of which have predicates, to `stream` as L{SphinxDatabase.iter_data} 
+        yields them, flushing after each epath.
+        '''
+        db = self.database
+        self._metadata_epaths = [db.EPATH_PREDICATE_REGEX.sub(r'\g<epath>', epath) for epath in epaths]
+        self.begin()
+        try:
+            for epath in epaths:
+                for fe, item in db.iter_data(epath, with_epaths=True):
+                    if db.primary_type(fe) == 'data':
+                        self._write_entry(fe, item)
+                self._out.flush()
+                self.stream.flush()
+        except Exception:
+            self.abort()
+            raise
+        return self.end()
+    
+    def write(self, epaths=None):  # IGNORE:W0221
+        '''
+        Write the data at `epaths`. Epaths with predicates, e.g. 
+        C{'data/type/role[since>=1.1]'}, are supported for output 
+        to a `stream`.
+        '''
+        if isinstance(epaths, str):
+            epaths = [epaths]
+        self._metadata_epaths = epaths
+        try:
+            if self.stream is not None and epaths and any(epath.endswith(']') for epath in epaths):
+                return self._write_selected(epaths)
+            return super(NDJSONWriter, self).write(epaths)
+        finally:
+            self._metadata_epaths = None
+
+
+def _render_page(source, template_globals, context):
+    '''Render the template `source` with `context`. Run in L{HTMLWriter}'s pool.'''
+    return Templite(source, template_globals).render(context)
 
 
 class HTMLWriter(Writer):
-    '''Output the data stored in the `SphinxDatabase` as HTML files.'''
+    '''
+    Output the data stored in the `SphinxDatabase` as HTML files.
+    
+    Data pages are streamed through the template as entries arrive. 
+    With C{render_jobs} > 1 they are rendered in a pool of that many 
+    processes (threads if C{render_processes} is False) instead, 
+    while the next units are read. Pages are written, and listed 
+    in C{data_units}, in the order of the units, and C{index.html} 
+    after all of them.
+    
+    With C{minify} True the pages are written without indentation 
+    and blank lines (see L{utils.minify_html}). For static web 
+    servers set C{precompress} (see L{Writer}).
+    '''
     # HTMLWriter is adopted from coverage.py's HTMLReport
     
-    # These files will be copied from the htmlfiles dir to the output dir.
-    STATIC_FILES = [
-        "style.css",
-        "jquery-1.4.3.min.js",
-        "jquery.hotkeys.js",
-        "jquery.isonscreen.js",
-        "jquery.tablesorter.js",
-        "scripts.js",
-        "keybd_closed.png",
-        "keybd_open.png"
-    ]
+    # These files will be copied from the htmlfiles dir to the output dir: 
+    # the ones the templates reference.
+    STATIC_FILES = _referenced_files("data.html", "metadata.html", "index.html")
 
     def __init__(self, database, outdir): # IGNORE:W0621
         super(HTMLWriter, self).__init__(database, outdir)
@@ -433,25 +1277,48 @@ class HTMLWriter(Writer):
             '__url__': constants.__url__,
             '__version__': constants.__versionstr__  # yes, versionstr not version!
         }
-        self.data_tmpl = Templite(_data("htmlfiles/data.html"), self.template_globals)
-        self.metadata_tmpl = Templite(_data("htmlfiles/metadata.html"), self.template_globals)
+        self.minify = False
+        self._load_templates()
+        self.render_jobs = 1
+        self.render_processes = True
+        self._unit = None
+        self._stream = None
+        self._entries = None
+        self._executor = None
+        self._rendering = collections.deque()
+        self._num_written_files = 0
 
+    def _settings(self):
+        templates = [_data("htmlfiles/%s.html" % name) for name in ('data', 'metadata', 'index')]
+        return super(HTMLWriter, self)._settings() + [text_digest(*templates), str(self.minify)]
+    
+    def _template_source(self, name):
+        '''Return the source of the template C{htmlfiles/<name>.html}, minified if C{minify}.'''
+        source = _data("htmlfiles/%s.html" % name)
+        if self.minify:
+            source = minify_html(source)
+        return source
+    
+    def _load_templates(self):
+        self._data_source = self._template_source("data")
+        self.data_tmpl = Templite(self._data_source, self.template_globals)
+        self.metadata_tmpl = Templite(self._template_source("metadata"), self.template_globals)
+    
     def _copy_static_files(self):
-        '''Copy static files for HTML report.'''
+        '''Copy static files for HTML report, unless they are in place already.'''
+        num_copied = 0
         for static in self.STATIC_FILES:
-            shutil.copyfile(_data_filename("htmlfiles/" + static), 
-                            os.path.join(self.outdir, static))
-        return len(self.STATIC_FILES)
+            num_copied += self._copy(_data_filename("htmlfiles/" + static), static)
+        return num_copied
                 
     def _write_index_file(self):
         '''Write the index.html file for this report.'''
-        index_tmpl = Templite(_data("htmlfiles/index.html"), self.template_globals)
+        index_tmpl = Templite(self._template_source("index"), self.template_globals)
         data_units = self.data_units    # IGNORE:W0612
         total_entries = 0               # IGNORE:W0612
         for unit in self.data_units:
             total_entries += unit.num_entries
-        self._write_html(os.path.join(self.outdir, "index.html"),
-                         index_tmpl.render(locals()))
+        self._write_html("index.html", index_tmpl, locals())
         
     def _write_file(self, entries, du, filetype='data'):
         '''Generate HTML file for data unit (du).'''
@@ -465,39 +1332,44 @@ class HTMLWriter(Writer):
         try:
             self.data_units.append(du)
             if filetype == 'data':
-                html = self.data_tmpl.render(locals())
+                self._write_html(du.file_relpath, self.data_tmpl, locals())
             elif filetype == 'metadata':
-                html = self.metadata_tmpl.render(locals())
+                self._write_html(du.file_relpath, self.metadata_tmpl, locals())
             else:
                 raise ValueError("unknown template file type: '%s'" % filetype)
-            self._write_html(du.file_abspath, html)
             return True
         except Exception as e:    # IGNORE:W0703
             if DEBUG: 
                 raise(e) 
             return False
         
-    def _write_html(self, fname, html):
-        '''Write `html` to `fname`, properly encoded.'''
-        write_encoded(fname, html, encoding='ascii', errors='xmlcharrefreplace')
-        
-    def write(self, epaths=None): # IGNORE:W0221
-        num_written_files = 0
-        if epaths:
-            if not isinstance(epaths, list):
-                epaths = [epaths]
-        else:
-            epaths = self.database.get_epaths()
-        if not epaths:
-            raise ValueError("E: no data to write")
-        
-        data_epaths = self.database.expand_epath('data*')
-        metadata_epaths = self.database.expand_epath('metadata*')
+    def _abspath(self, fname):
+        '''Return the path of `fname` in the output directory (in the archive, if writing one).'''
+        if self.outdir is None:
+            return posixpath.join(self.archive_prefix, fname)
+        return os.path.join(self.outdir, fname)
+    
+    def _open_html(self, fname, unit=None):
+        '''Open `fname` for writing HTML, properly encoded.'''
+        return self._open(fname, encoding='ascii', errors='xmlcharrefreplace', unit=unit)
+    
+    def _write_html(self, fname, tmpl, context):
+        '''Render `tmpl` with `context` to `fname`.'''
+        f = self._open_html(fname)
+        try:
+            tmpl.render_to(f.write, context)
+        except Exception:
+            self._discard()
+            raise
+        self._close()
+    
+    def begin(self):
+        self.data_units = []
+        self._num_written_files = 0
         
         # consolidate metadata
         consolidated_metadata = []
-        for epath in metadata_epaths:
-            value = self.database.get_data(epath)
+        for epath, value in self.database.iter_data('metadata*', with_epaths=True):
             if not value or len(str(value)) == 0:
                 continue
             comps = epath.split('/')[1:]
@@ -512,47 +1384,164 @@ class HTMLWriter(Writer):
         unit_num_entries = len(consolidated_metadata)
         # pylint: enable-msg=W0612
         out_filename = "metadata.html"
-        out_path = os.path.join(self.outdir, out_filename)
         
-        du = DataUnit(file_relpath=os.path.relpath(out_path, self.outdir), 
-                      file_abspath=os.path.abspath(out_path),
+        du = DataUnit(file_relpath=out_filename, 
+                      file_abspath=self._abspath(out_filename),
                       basename=out_filename, 
                       num_entries=unit_num_entries, 
                       name=unit_name)
         
-        num_written_files += self._write_file(consolidated_metadata, du, filetype='metadata')
-                            
-        for epath in data_epaths: 
-            cur_data = self.database.get_data(epath)
-            if not cur_data or len(str(cur_data)) == 0:
-                continue
-            if not isinstance(cur_data, list):
-                cur_data = [cur_data]
-
-            comps = epath.split('/')[1:]
-            # set local variables for template
-            # pylint: disable-msg=W0612
-            unit_name = string.capwords(' '.join(comps))
-            unit_num_entries = len(cur_data)
-            # pylint: enable-msg=W0612
-            
-            out_filename = '-'.join(comps) + ".html"
-            out_path = os.path.join(self.outdir, out_filename)
-            
-            du = DataUnit(file_relpath=os.path.relpath(out_path, self.outdir), 
-                          file_abspath=os.path.abspath(out_path),
-                          basename=out_filename, 
-                          num_entries=unit_num_entries, 
-                          name=unit_name)
-            
-            num_written_files += self._write_file(cur_data, du, filetype='data')
-        
+        self._num_written_files += self._write_file(consolidated_metadata, du, filetype='metadata')
+    
+    def _data_unit(self, unit):
+        '''Return the L{DataUnit} describing the page for `unit`.'''
+        out_filename = '-'.join(unit.comps) + ".html"
+        return DataUnit(file_relpath=out_filename, 
+                        file_abspath=self._abspath(out_filename),
+                        basename=out_filename, 
+                        num_entries=unit.num_entries, 
+                        name=string.capwords(' '.join(unit.comps)))
+    
+    def needs_unit(self, unit):
+        if super(HTMLWriter, self).needs_unit(unit):
+            return True
+        # the page is current but still belongs in the index
+        if unit.num_entries > 0:
+            self.data_units.append(self._data_unit(unit))
+        return False
+    
+    def _write_rendered(self):
+        '''Write the oldest page rendered by the pool.'''
+        du, unit, future = self._rendering.popleft()
+        f = self._open_html(du.file_relpath, unit)
+        try:
+            f.write(future.result())
+        except Exception:
+            self._discard()
+            raise
+        self._close()
+        self._num_written_files += 1
+    
+    def start_build(self, full=True):
+        super(HTMLWriter, self).start_build(full)
+        # minify may have been set since __init__
+        self._load_templates()
+        if self.render_jobs > 1:
+            executor = ProcessPoolExecutor if self.render_processes else ThreadPoolExecutor
+            self._executor = executor(self.render_jobs)
+            self._rendering.clear()
+    
+    def finish_build(self):
+        self._shutdown()
+        super(HTMLWriter, self).finish_build()
+    
+    def _shutdown(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            for _, _, future in self._rendering:
+                future.cancel()
+            self._rendering.clear()
+            executor.shutdown()
+    
+    def begin_unit(self, unit):
+        self._unit = self._data_unit(unit)
+        if self._executor is not None:
+            self._entries = []
+    
+    def entry(self, unit, entry, values):
+        if self._entries is not None:
+            # plain dicts, to be sent to the pool
+            self._entries.append(dict((key, entry[key]) for key in entry.keys()))
+            return
+        if self._stream is None:
+            # the page is only started with the first entry, 
+            # units without entries don't get one
+            f = self._open_html(self._unit.file_relpath, unit)
+            self._stream = self.data_tmpl.stream(f.write, 'entries', {'unit_name': self._unit.name})
+        self._stream.push(entry)
+    
+    def end_unit(self, unit):
+        if self._entries is not None:
+            entries, self._entries = self._entries, None
+            if not entries:
+                return
+            context = {'entries': entries, 'unit_name': self._unit.name}
+            future = self._executor.submit(_render_page, self._data_source, self.template_globals, context)
+            self._rendering.append((self._unit, unit, future))
+            self.data_units.append(self._unit)
+            # keep enough pages in flight for the pool, but no more
+            while len(self._rendering) > self.render_jobs * 2:
+                self._write_rendered()
+            return
+        if self._stream is None:
+            return
+        self._stream.close()
+        self._stream = None
+        self._close()
+        self.data_units.append(self._unit)
+        self._num_written_files += 1
+    
+    def abort(self):
+        self._stream = None
+        self._entries = None
+        self._shutdown()
+        super(HTMLWriter, self).abort()
+    
+    def end(self):
+        while self._rendering:
+            self._write_rendered()
         self._write_index_file()
-        num_written_files += 1
-        num_copied = self._copy_static_files()
-        num_written_files += num_copied
+        self._num_written_files += 1
+        self._num_written_files += self._copy_static_files()
+        return self._num_written_files
         
-        return num_written_files
+    def write(self, epaths=None): # IGNORE:W0221
+        if epaths:
+            if not isinstance(epaths, list):
+                epaths = [epaths]
+        else:
+            epaths = self.database.get_epaths()
+        if not epaths:
+            raise ValueError("E: no data to write")
+        # the report always covers all data epaths
+        return super(HTMLWriter, self).write()
+
+
+#: response headers that validate a page, and the request headers they are sent back in
+PAGE_VALIDATORS = (('ETag', 'If-None-Match'), ('Last-Modified', 'If-Modified-Since'))
+
+
+def _read_if_modified(url, validators=None):
+    '''
+    Read the resource at `url`, sending the `validators` of the last
+    read as conditional request headers (see L{PAGE_VALIDATORS}).
+
+    Return C{(source, validators)}, the raw bytes and the validators
+    of the response. C{source} is None if the server answered that
+    the resource is unchanged (304); C{validators} are then those
+    given, updated by the response. Servers (or C{file:} URLs) that
+    ignore the headers simply return the resource.
+    '''
+    headers = {}
+    for response_header, request_header in PAGE_VALIDATORS:
+        if validators and validators.get(response_header):
+            headers[request_header] = validators[response_header]
+    try:
+        f = urllib.urlopen(urllib.Request(url, headers=headers))
+    except urllib.HTTPError as e:
+        if e.code != 304:
+            raise IOError("E: couldn't read resource at '%s'. The error msg was: %s" % (url, e))
+        updated = dict(validators)
+        updated.update((name, e.headers[name]) for name, _ in PAGE_VALIDATORS if e.headers.get(name))
+        return None, updated
+    except Exception as e: # IGNORE:W0703
+        raise IOError("E: couldn't read resource at '%s'. The error msg was: %s" % (url, e))
+    try:
+        source = f.read()
+        received = dict((name, f.headers[name]) for name, _ in PAGE_VALIDATORS if f.headers.get(name))
+    finally:
+        f.close()
+    return source, received
 
 
 class DataExtractor(object):
@@ -769,7 +1758,27 @@ class DataUnit(object):
                 setattr(self, key, value)
 
 
-__entry_classcache__ = {}
+class ChangeSet(object):
+    '''
+    The differences a L{SphinxDatabase.refresh} applied.
+    
+    C{added} and C{removed} hold C{(epath, entry)} tuples, 
+    C{modified} holds C{(epath, old_entry, new_entry)} tuples
+    and C{pages} the registry links whose source changed.
+    '''
+    def __init__(self):
+        super(ChangeSet, self).__init__()
+        self.added = []
+        self.removed = []
+        self.modified = []
+        self.pages = []
+    
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.modified)
+    
+    def __repr__(self):
+        return "ChangeSet(added=%d, removed=%d, modified=%d, pages=%r)" % (
+            len(self.added), len(self.removed), len(self.modified), self.pages)
 
 
 class Entry(object):
@@ -788,27 +1797,11 @@ class Entry(object):
     the value associated with the primary key 
     is the same as the one associated to the 
     primary key of the other instance.
-    
-    Entry also implements the Flyweight pattern, 
-    so that only one instance is created per 
-    primary key.
     '''    
-    def __new__(cls, items, primary_type):
-        obj = __entry_classcache__.get(items[primary_type], None)
-        if obj is None:
-            return super(Entry, cls).__new__(cls)
-        else:
-            return obj
-    
     def __init__(self, items, primary_type):
-        if hasattr(self, 'items'):
-            if DEBUG:
-                print(("Using object %r from entry classcache." % self))
-            return
         super(Entry, self).__init__()
         self.primary_type = primary_type
         self.items = items
-        __entry_classcache__[primary_type] = self
 
     def __getitem__(self, key):
         return self.items[key]
@@ -842,7 +1835,125 @@ class Entry(object):
         return list(self.items.values())
 
 
-__db_classcache__ = {}
+class DatabaseCache(object):
+    '''
+    LRU cache of `Database` instances keyed by C{site_url}.
+    
+    Backs the flyweight behaviour of `Database`. Without limits 
+    (the default) instances are kept forever. Otherwise the least 
+    recently used instances are dropped as soon as there are more 
+    than C{max_instances} of them or they hold more than 
+    C{max_entries} entries together, and instances added more than 
+    C{ttl} seconds ago are dropped when next looked at. The most 
+    recently used instance is never dropped for exceeding a bound.
+    
+    Dropping an instance only removes it from the cache: it stays 
+    usable for whoever holds it, but the next lookup for its 
+    C{site_url} creates a new one.
+    '''
+    def __init__(self, max_instances=None, max_entries=None, ttl=None):
+        super(DatabaseCache, self).__init__()
+        self.max_instances = max_instances
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._items = collections.OrderedDict()  # site_url -> (database, added)
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __contains__(self, site_url):
+        return site_url in self._items
+    
+    def configure(self, max_instances=None, max_entries=None, ttl=None):
+        ''' Set the bounds (None meaning unbounded) and apply them.'''
+        with self.lock:
+            self.max_instances = max_instances
+            self.max_entries = max_entries
+            self.ttl = ttl
+            self.trim()
+    
+    def get(self, site_url, cls=None):
+        ''' Return the cached instance for `site_url` or None.
+        
+        @param cls: if given, only return instances of this class.
+        @type cls: C{type}
+        '''
+        with self.lock:
+            item = self._items.get(site_url)
+            if item is not None and self._expired(item):
+                del self._items[site_url]
+                self.expirations += 1
+                item = None
+            if item is None or (cls is not None and not isinstance(item[0], cls)):
+                self.misses += 1
+                return None
+            self._items.move_to_end(site_url)
+            self.hits += 1
+            return item[0]
+    
+    def put(self, site_url, database):
+        ''' Add `database` as the most recently used instance for `site_url`.'''
+        with self.lock:
+            self._items[site_url] = (database, now())
+            self._items.move_to_end(site_url)
+            self.trim()
+    
+    def evict(self, site_url=None):
+        ''' Drop the instance for `site_url`, or all instances if None.
+        
+        @return: the number of instances dropped
+        @rtype: C{int}
+        '''
+        with self.lock:
+            if site_url is None:
+                count = len(self._items)
+                self._items.clear()
+            else:
+                count = 1 if self._items.pop(site_url, None) is not None else 0
+            self.evictions += count
+            return count
+    
+    def trim(self):
+        ''' Drop expired instances, then LRU ones until within bounds.'''
+        with self.lock:
+            for site_url in [key for key, item in self._items.items() if self._expired(item)]:
+                del self._items[site_url]
+                self.expirations += 1
+            while len(self._items) > 1 and (
+                    (self.max_instances is not None and len(self._items) > self.max_instances) or
+                    (self.max_entries is not None and self.total_entries() > self.max_entries)):
+                self._items.popitem(last=False)
+                self.evictions += 1
+    
+    def total_entries(self):
+        ''' Return the number of entries held by the cached instances.'''
+        return sum(max(getattr(item[0], 'total_entries', 0), 0) for item in self._items.values())
+    
+    def stats(self):
+        ''' Return a dict of counters and the current size of the cache.'''
+        with self.lock:
+            return {
+                'instances': len(self._items),
+                'entries': self.total_entries(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'max_instances': self.max_instances,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl
+            }
+    
+    def _expired(self, item):
+        return self.ttl is not None and now() - item[1] > self.ttl
+
+
+__db_classcache__ = DatabaseCache()
 
 
 class Database(object):
@@ -873,29 +1984,52 @@ class Database(object):
     
     Database implements the I{Flyweight} pattern, 
     so that only one instance is created per 
-    per C{site_url}.
+    per C{site_url}. The instances are kept in a 
+    `DatabaseCache` which can be bounded with 
+    L{configure_cache}.
+    
+    Instances can be shared between threads. Changes 
+    are made by one writer at a time (C{update_lock}) 
+    which builds the new contents aside and publishes 
+    them under the write side of C{lock}. Published 
+    containers (C{contents}, C{epaths}, entry lists) 
+    are never changed in place, so a reader holding a 
+    reference to one sees a consistent state. Readers 
+    that need several of them to match take the read 
+    side of C{lock}.
     '''
     
     def __new__(cls, site_url=constants.DEFAULT_REMOTE_SITE_URL, use_cached=True):
-        obj = __db_classcache__.get(site_url, None)
-        if obj is None or use_cached is False:
-            return super(Database, cls).__new__(cls)
-        else:
+        with __db_classcache__.lock:
+            obj = __db_classcache__.get(site_url, cls) if use_cached else None
+            if obj is None:
+                obj = super(Database, cls).__new__(cls)
+                __db_classcache__.put(site_url, obj)
             return obj
  
     def __init__(self, site_url=constants.DEFAULT_REMOTE_SITE_URL, *args, **kwargs):  # IGNORE:W0613
-        if (hasattr(self, 'initialized') and 
-            getattr(self, 'initialized') is True):
-            if DEBUG:
-                print(("Using object %r from db classcache." % self))
-            return
+        with __db_classcache__.lock:
+            if hasattr(self, 'initialized'):
+                if DEBUG:
+                    print(("Using object %r from db classcache." % self))
+                return
+            self._setup(site_url)
+    
+    def _setup(self, site_url):
         super(Database, self).__init__()
         self.site_url = site_url
         self.contents = {}
         self.epaths = {}
         self.total_entries = -1
         self.initialized = False
-        __db_classcache__[site_url] = self
+        self.storage = 'rows'
+        self.indexes = {}
+        self.pages = {}
+        self.page_types = {}
+        self.pending = set()
+        self.cache_dir = None
+        self.lock = ReadWriteLock()
+        self.update_lock = threading.RLock()
     
     def __getitem__(self, key):
         if key in self.contents:
@@ -904,11 +2038,23 @@ class Database(object):
             raise KeyError("E: element '%s' doesn't exist" % key)
     
     def __setitem__(self, key, value):
-        # maybe make this immutable so that self.contents must 
-        # actually be referenced when setting something... 
-        # makes it more obvious if used outside the module 
-        # or class even
-        self.contents[key] = value
+        # copy on write, see class docstring
+        with self.update_lock:
+            contents = dict(self.contents)
+            contents[key] = value
+            indexes = self._drop_completions(self.indexes, [key])
+            with self.lock.writing():
+                self.contents = contents
+                self.indexes = indexes
+    
+    def _drop_completions(self, indexes, epaths):  # IGNORE:R0201
+        '''Return a copy of `indexes` without the completions cached for `epaths`.'''
+        indexes = dict(indexes)
+        if 'completions' in indexes:
+            completions = indexes['completions'] = dict(indexes['completions'])
+            for epath in epaths:
+                completions.pop(epath, None)
+        return indexes
 
     def __len__(self):
         result = -1
@@ -930,7 +2076,36 @@ class Database(object):
         # Database implements the Flyweight pattern
         # there shouldn't be two objects with the
         # same site_url in the first place.
+        if not isinstance(other, Database):
+            return NotImplemented
         return self.site_url == other.site_url
+    
+    def __hash__(self):
+        return hash(self.site_url)
+    
+    @classmethod
+    def configure_cache(cls, max_instances=None, max_entries=None, ttl=None):
+        ''' Bound the flyweight cache shared by all databases.
+        
+        @param max_instances: max. number of cached instances.
+        @type max_instances: C{int}
+        @param max_entries: max. number of entries of all cached 
+            instances together (see C{total_entries}).
+        @type max_entries: C{int}
+        @param ttl: max. age of a cached instance in seconds.
+        @type ttl: C{int}
+        '''
+        __db_classcache__.configure(max_instances=max_instances, max_entries=max_entries, ttl=ttl)
+    
+    @classmethod
+    def evict(cls, site_url=None):
+        ''' Drop the cached instance for `site_url`, or all if None.'''
+        return __db_classcache__.evict(site_url)
+    
+    @classmethod
+    def cache_stats(cls):
+        ''' Return statistics of the flyweight cache, see `DatabaseCache.stats`.'''
+        return __db_classcache__.stats()
         
     def has_key(self, key):
         return key in self.contents
@@ -985,61 +2160,614 @@ class SphinxDatabase(Database):
         ]
     }
     
-    VALID_FORMATS = ['csv', 'html', 'tmprefs', 'list', 'listplain'] 
+    VALID_FORMATS = ['csv', 'html', 'tmprefs', 'list', 'listplain', 'ndjson'] 
+    
+    #: epath with a trailing predicate list, e.g. 'data/type/*[since>=1.0,since<1.2]'
+    EPATH_PREDICATE_REGEX = re.compile(r'^(?P<epath>[^\[]+)\[(?P<predicates>[^\]]*)\]$')
+    PREDICATE_REGEX = re.compile(r'^\s*(?P<field>since|deprecated)\s*(?P<op><=|>=|==|=|<|>)\s*(?P<version>\S+)\s*$')
     
     def primary_type(self, epath):
         ''' Return the primary type for the given epath.'''
         return epath.split("/")[0] 
         
-    def initialize(self):
+    def __getitem__(self, key):
+        if key in self.pending:
+            self.load([key])
+        return super(SphinxDatabase, self).__getitem__(key)
+        
+    def initialize(self, cache_dir=None, ttl=None, refresh=False, lazy=False, check_version=False):
         '''
         Initialize the database. This sources all site paths specified by 
         SphinxDatabase.REGISTRY['links'] and extracts data using DataExtrator 
         instances.
+        
+        If `cache_dir` is given, the contents are loaded from a snapshot 
+        in that directory instead, as long as the snapshot was made for 
+        the same site URL and is younger than `ttl`. Such a snapshot is 
+        used without contacting the site, unless `check_version` asks 
+        to compare the Sphinx version it was made for with the site's 
+        first. Otherwise the data is extracted and a new snapshot is 
+        written.
+        
+        Alongside the snapshot a page-to-type map is kept, recording 
+        which C{dl} classes each page produced. With `lazy` set and a 
+        map for the current Sphinx version at hand, no page is read 
+        up front: the epaths are known from the map and a page is 
+        only read once an epath it contributes to is accessed (see 
+        L{load}).
+        
+        Threads calling initialize() at the same time wait for the 
+        first one to finish; the others return right away. The cache 
+        directory may be shared between processes: if several of them 
+        need to extract the same site, one does and the others wait 
+        for its snapshot (see L{cache.fill_lock}).
+        
+        @param cache_dir: directory holding database snapshots.
+        @type cache_dir: C{string}
+        @param ttl: max. age of a usable snapshot in seconds. None 
+            means snapshots don't expire.
+        @type ttl: C{int}
+        @param refresh: if True, ignore an existing snapshot and 
+            extract (and snapshot) the data again.
+        @type refresh: C{bool}
+        @param lazy: if True, read pages on demand if possible.
+        @type lazy: C{bool}
+        @param check_version: if True, a snapshot is only used if the 
+            site still has the Sphinx version it was made for.
+        @type check_version: C{bool}
         '''
-        if not self.initialized:
-            if DEBUG: 
-                print(("Initializing SphinxDatabase %d... from URL %s" % (id(SphinxDatabase), self.site_url)))
-            # acquire metadata
-            mde = DataExtractor(self.site_url)
-            start_page_path = '/index.html'
-            res_url = self.site_url + start_page_path
-            parsed_version = mde.get_sphinx_version(path=start_page_path)
+        if self.initialized:
+            return
+        with self.update_lock:
+            if self.initialized:
+                return
+            self._initialize(cache_dir, ttl, refresh, lazy, check_version)
+        # bounds on entries can only be applied now that its size is known
+        __db_classcache__.trim()
+    
+    def _initialize(self, cache_dir, ttl, refresh, lazy, check_version):
+        if DEBUG: 
+            print(("Initializing SphinxDatabase %d... from URL %s" % (id(SphinxDatabase), self.site_url)))
+        self.cache_dir = cache_dir
+        site = None
+        if cache_dir is not None and not refresh:
+            # warm start: a snapshot within ttl is trusted without 
+            # fetching anything from the site
+            snapshot = snapshot_path(cache_dir, self.site_url)
+            if check_version:
+                site = self._site_version()
+            if self.load_snapshot(snapshot, sphinx_version=site and site[1], ttl=ttl):
+                if DEBUG:
+                    print("Loaded SphinxDatabase from snapshot '%s'" % snapshot)
+                return
+        res_url, parsed_version = site or self._site_version()
+        if cache_dir is None:
+            self._extract(res_url, parsed_version)
+            return
+        started = now()
+        # the snapshot was tried above, only the page-to-type map is left
+        if self._load_cache(res_url, parsed_version, None, True, lazy):
+            return
+        # another process may be extracting the same site. whoever 
+        # gets the lock first does, the others use its snapshot
+        with fill_lock(snapshot_path(cache_dir, self.site_url)):
+            if refresh:
+                # only a snapshot written while we were waiting will do
+                ttl = now() - started
+            if self._load_cache(res_url, parsed_version, ttl, False, lazy):
+                return
+            self._extract(res_url, parsed_version)
+    
+    def _site_version(self):
+        '''Return the URL of the site's start page and the Sphinx version read from it.'''
+        mde = DataExtractor(self.site_url)
+        start_page_path = '/index.html'
+        return self.site_url + start_page_path, mde.get_sphinx_version(path=start_page_path)
+    
+    def _load_cache(self, res_url, parsed_version, ttl, skip_snapshot, lazy):
+        '''
+        Load the snapshot, or with `lazy` the page-to-type map, 
+        from C{self.cache_dir}. Return True on success.
+        '''
+        if not skip_snapshot:
+            snapshot = snapshot_path(self.cache_dir, self.site_url)
+            if self.load_snapshot(snapshot, sphinx_version=parsed_version, ttl=ttl):
+                if DEBUG:
+                    print("Loaded SphinxDatabase from snapshot '%s'" % snapshot)
+                return True
+        if lazy:
+            typemap = typemap_path(self.cache_dir, self.site_url)
             self['metadata/sphinx/site_url'] = res_url
             self['metadata/sphinx/version'] = parsed_version
-            self.total_entries = 2
+            if self.load_typemap(typemap, sphinx_version=parsed_version):
+                if DEBUG:
+                    print("Loaded page-to-type map from '%s'" % typemap)
+                self['metadata/stats/total_entries'] = self.total_entries
+                self.initialized = True
+                return True
+        return False
+    
+    def _extract(self, res_url, parsed_version):
+        '''Read all pages and write the cache, if there is one.'''
+        self['metadata/sphinx/site_url'] = res_url
+        self['metadata/sphinx/version'] = parsed_version
+        self._crawl()
+        self.initialized = True
+        if self.storage == 'columnar':
+            self.compact()
+        self._save_cache()
+    
+    def _crawl(self):
+        '''
+        Read and parse every registry page not read so far and 
+        (re)build all C{data/type/*} epaths from the pages.
+        '''
+        try:
             links = SphinxDatabase.REGISTRY['links']
-            try:
-                for link in links:
-                    url = self.site_url + '/' + link
-                    de = DataExtractor(url)
-                    defs = de.get_defs()
-                    for _def in defs:
-                        _entries = defs[_def]
-                        _key = 'data/type/' + _def
-                        if _key in self:
-                            cur_entries = self[_key]
-                            #print "type(cur_entries) = %s" % type(cur_entries)
-                            #print "type(_entries) = %s" % type(_entries)
-                            unique_entries = []
-                            for _e in _entries:
-                                if _e not in cur_entries:
-                                    unique_entries.append(_e)
-                            self[_key] += unique_entries
-                            self.total_entries += len(unique_entries)
-                        else:
-                            self[_key] = _entries
-                            self.total_entries += len(_entries)
-            except KeyError:
-                if DEBUG: 
-                    # no links stored - pass
-                    print("skipping processing of links because there are no entries for the current key in the link epaths")
-            self.total_entries += 1  # last settattr
+            for link in links:
+                if link in self.pages:
+                    continue
+                de, digest, validators = self._read_page(link)
+                self.pages[link] = (digest, de.get_defs(), validators)
+        except KeyError:
             if DEBUG: 
-                print("total_entries = %s" % self.total_entries)
-            self['metadata/stats/total_entries'] = self.total_entries
-            self.epaths = list(self.keys())
-            self.initialized = True
+                # no links stored - pass
+                print("skipping processing of links because there are no entries for the current key in the link epaths")
+        contents = dict((ep, v) for ep, v in self.contents.items() if self.primary_type(ep) != 'data')
+        epaths = ['metadata/sphinx/site_url', 'metadata/sphinx/version']
+        total_entries = 2
+        for _def, _entries in self._merge_pages().items():
+            contents['data/type/' + _def] = _entries
+            epaths.append('data/type/' + _def)
+            total_entries += len(_entries)
+        total_entries += 1  # last settattr
+        if DEBUG: 
+            print("total_entries = %s" % total_entries)
+        contents['metadata/stats/total_entries'] = total_entries
+        epaths.append('metadata/stats/total_entries')
+        with self.lock.writing():
+            self.contents = contents
+            self.epaths = epaths
+            self.total_entries = total_entries
+            self.indexes = {}
+            self.page_types = dict((link, sorted(page[1])) for link, page in self.pages.items())
+            self.pending = set()
+    
+    def _save_cache(self):
+        '''Write snapshot and page-to-type map to C{self.cache_dir}, if set.'''
+        if self.cache_dir is not None:
+            self.save_snapshot(snapshot_path(self.cache_dir, self.site_url))
+            self.save_typemap(typemap_path(self.cache_dir, self.site_url))
+    
+    def load(self, epaths=None):
+        '''
+        Make sure the data at `epaths` has been extracted.
+        
+        Only matters after a lazy L{initialize}. The pages that the 
+        page-to-type map lists for the requested C{data/type/*} 
+        epaths are read and parsed, then the epaths are built from 
+        them. Should a page turn out to produce other C{dl} classes 
+        than the map says, the map is stale: all remaining pages are 
+        read and the snapshot and map are written anew.
+        
+        @param epaths: the (expanded) epaths to load. If None, 
+            load everything.
+        @type epaths: C{list<string>}
+        '''
+        if not self.pending:
+            return
+        with self.update_lock:
+            if epaths is None:
+                wanted = set(self.pending)
+            else:
+                wanted = self.pending.intersection(epaths)
+            if not wanted:
+                return
+            types = set(epath.split('/')[-1] for epath in wanted)
+            for link in SphinxDatabase.REGISTRY['links']:
+                if link in self.pages or not types.intersection(self.page_types.get(link, ())):
+                    continue
+                de, digest, validators = self._read_page(link)
+                defs = de.get_defs()
+                self.pages[link] = (digest, defs, validators)
+                if sorted(defs) != self.page_types[link]:
+                    if DEBUG:
+                        print("Page-to-type map is stale at '%s', reading all pages" % link)
+                    self._crawl()
+                    if self.storage == 'columnar':
+                        self.compact()
+                    self._save_cache()
+                    return
+            merged = self._merge_pages(types)
+            pool = self._string_pool() if self.storage == 'columnar' else None
+            contents = dict(self.contents)
+            indexes = dict(self.indexes)
+            version_index = indexes.get('versions')
+            if version_index is not None:
+                version_index = indexes['versions'] = version_index.copy()
+            for epath in wanted:
+                entries = merged.get(epath.split('/')[-1], [])
+                if pool is not None:
+                    entries = ColumnStore(pool, entries)
+                contents[epath] = entries
+                if version_index is not None:
+                    version_index.add_entries(epath, entries)
+            with self.lock.writing():
+                self.contents = contents
+                self.indexes = indexes
+                self.pending = self.pending - wanted
+    
+    def _string_pool(self):
+        '''Return the `StringPool` shared by the column stores, or a new one.'''
+        for value in self.contents.values():
+            if isinstance(value, ColumnStore):
+                return value.pool
+        return StringPool()
+    
+    def save_typemap(self, path):
+        '''
+        Write the page-to-type map, the epaths and the entry total 
+        of the initialized database to `path`. The file uses the 
+        snapshot layout, so L{load_typemap} validates it the same way.
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling save_typemap()")
+        with self.lock.reading():
+            body = {
+                'page_types': dict(self.page_types),
+                'epaths': list(self.epaths),
+                'total_entries': self.total_entries
+            }
+            header = self._snapshot_header()
+        return write_snapshot(path, header, body)
+    
+    def load_typemap(self, path, sphinx_version=None):
+        '''
+        Take epaths and the page-to-type map from the file at `path` 
+        and mark all C{data/type/*} epaths as pending, to be loaded 
+        on first access.
+        
+        Return False and leave the database untouched if there is no 
+        valid map for the site URL and (if given) `sphinx_version`.
+        The map doesn't expire otherwise; a stale map is detected 
+        when loading pages (see L{load}).
+        '''
+        if not is_valid_snapshot(read_snapshot_header(path), self.site_url, 
+                                 sphinx_version=sphinx_version):
+            return False
+        try:
+            _, body = read_snapshot(path)
+        except Exception as e: # IGNORE:W0703
+            if DEBUG:
+                print("E: reading page-to-type map '%s' failed: %s" % (path, e))
+            return False
+        epaths = list(body['epaths'])
+        with self.update_lock, self.lock.writing():
+            self.page_types = body['page_types']
+            self.epaths = epaths
+            self.total_entries = body['total_entries']
+            self.pages = {}
+            self.indexes = {}
+            self.pending = set(epath for epath in epaths if self.primary_type(epath) == 'data')
+        return True
+    
+    def _snapshot_header(self):
+        return {
+            'tool_version': constants.__versionstr__,
+            'site_url': self.site_url,
+            'sphinx_version': self.contents.get('metadata/sphinx/version')
+        }
+    
+    def save_snapshot(self, path):
+        '''
+        Write the contents of the initialized database to a snapshot 
+        file at `path`. Entries are stored as plain dicts whatever the 
+        C{storage}. Indexes that can be serialized are included, and 
+        so is the state of each page read (see L{refresh}).
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling save_snapshot()")
+        self.load()
+        # an entry of a page is stored once, though it is in the contents too
+        plain = {}
+        def __plain(entry):
+            if id(entry) not in plain:
+                plain[id(entry)] = (entry, dict((key, entry[key]) for key in entry.keys()))
+            return plain[id(entry)][1]
+        with self.update_lock, self.lock.reading():
+            contents = {}
+            for epath, value in self.contents.items():
+                if isinstance(value, ENTRY_LIST_TYPES):
+                    value = [__plain(entry) for entry in value]
+                contents[epath] = value
+            pages = {}
+            for link, (digest, defs, validators) in self.pages.items():
+                defs = dict((_def, [__plain(entry) for entry in entries]) for _def, entries in defs.items())
+                pages[link] = (digest, defs, validators)
+            indexes = {}
+            if 'text' in self.indexes:
+                buf = io.BytesIO()
+                self.indexes['text'].dump(buf)
+                indexes['text'] = buf.getvalue()
+            header = self._snapshot_header()
+            body = {
+                'contents': contents,
+                'epaths': list(self.epaths),
+                'total_entries': self.total_entries,
+                'page_types': dict(self.page_types),
+                'pages': pages,
+                'indexes': indexes
+            }
+        return write_snapshot(path, header, body)
+    
+    def save_mapped(self, path):
+        '''
+        Write the initialized database to `path` in the read-only 
+        mapped format that L{MappedDatabase} opens.
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling save_mapped()")
+        self.load()
+        with self.lock.reading():
+            contents, epaths, header = self.contents, list(self.epaths), self._mapped_header()
+        return write_mapped(path, contents, epaths, header)
+    
+    def freeze(self):
+        '''
+        Return a read-only L{FrozenDatabase} copy of the initialized 
+        database placed in shared memory.
+        
+        The copy uses the compact mapped format, so entries are 
+        decoded field by field when accessed. Worker processes 
+        attach to it without copying: pass it to them (it pickles 
+        to the name of its memory block) or attach with 
+        C{FrozenDatabase(frozen.name)}. Call C{unlink()} on the 
+        returned database when no process needs it any more.
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling freeze()")
+        self.load()
+        with self.lock.reading():
+            data = encode_mapped(self.contents, self.epaths, self._mapped_header())
+        return FrozenDatabase.create(data)
+    
+    def _mapped_header(self):
+        return {
+            'tool_version': constants.__versionstr__,
+            'site_url': self.site_url,
+            'total_entries': self.total_entries
+        }
+    
+    def load_snapshot(self, path, sphinx_version=None, ttl=None):
+        '''
+        Replace the contents with those of the snapshot at `path`.
+        
+        Return False and leave the database untouched if there is no 
+        valid snapshot, i.e. it is missing, of an older format, made 
+        for another site URL or (if given) `sphinx_version`, or older 
+        than `ttl` seconds.
+        '''
+        if not is_valid_snapshot(read_snapshot_header(path), self.site_url, 
+                                 sphinx_version=sphinx_version, ttl=ttl):
+            return False
+        try:
+            _, body = read_snapshot(path)
+        except Exception as e: # IGNORE:W0703
+            if DEBUG:
+                print("E: reading snapshot '%s' failed: %s" % (path, e))
+            return False
+        # entries stored once for the contents and a page stay shared
+        entries = {}
+        def __entry(items):
+            if id(items) not in entries:
+                entries[id(items)] = Entry(items, 'id')
+            return entries[id(items)]
+        contents = {}
+        for epath, value in body['contents'].items():
+            if isinstance(value, list):
+                value = [__entry(items) for items in value]
+            contents[epath] = value
+        pages = {}
+        for link, (digest, defs, validators) in body.get('pages', {}).items():
+            defs = dict((_def, [__entry(items) for items in _entries]) for _def, _entries in defs.items())
+            pages[link] = (digest, defs, validators)
+        indexes = {}
+        if 'text' in body['indexes']:
+            indexes['text'] = FullTextIndex.load(io.BytesIO(body['indexes']['text']))
+        with self.update_lock:
+            with self.lock.writing():
+                self.contents = contents
+                self.epaths = body['epaths']
+                self.total_entries = body['total_entries']
+                self.indexes = indexes
+                self.pages = pages
+                self.page_types = body.get('page_types', {})
+                self.pending = set()
+                self.initialized = True
+            if self.storage == 'columnar':
+                self.compact()
+        return True
+    
+    def _read_page(self, link, validators=None):
+        '''
+        Read the source of registry page `link`.
+        
+        Return a `DataExtractor` holding the source, the hex digest 
+        of the source and the page's validators (see L{_read_if_modified}). 
+        Given the `validators` of the last read, the page is only 
+        downloaded if the server says it changed; otherwise the 
+        extractor and digest are None.
+        '''
+        url = self.site_url + '/' + link
+        source, validators = _read_if_modified(url, validators)
+        if source is None:
+            return None, None, validators
+        de = DataExtractor(url)
+        de.source = source.decode(de.encoding)
+        digest = hashlib.sha1(de.source.encode('utf-8')).hexdigest()
+        return de, digest, validators
+    
+    def _merge_pages(self, types=None):
+        '''
+        Merge the definitions of all pages in C{self.pages} into one 
+        entry list per C{dl} class, going through the pages in 
+        registry order. An entry is dropped if a previous page 
+        already had an entry with the same id.
+        
+        @param types: if given, only merge these classes.
+        @type types: C{set<string>}
+        @return: C{dl} class -> entry list, in order of first appearance
+        @rtype: C{dict}
+        '''
+        merged = {}
+        seen = {}
+        for link in SphinxDatabase.REGISTRY['links']:
+            page = self.pages.get(link)
+            if page is None:
+                continue
+            for _def, _entries in page[1].items():
+                if types is not None and _def not in types:
+                    continue
+                if _def in merged:
+                    ids = seen[_def]
+                    unique_entries = [_e for _e in _entries if _e['id'] not in ids]
+                    merged[_def].extend(unique_entries)
+                else:
+                    ids = seen[_def] = set()
+                    unique_entries = merged[_def] = list(_entries)
+                ids.update(_e['id'] for _e in unique_entries)
+        return merged
+    
+    def refresh(self):
+        '''
+        Bring the initialized database up to date with the site.
+        
+        Every registry page is requested again with the C{ETag} and 
+        C{Last-Modified} the server sent for it last time, so pages 
+        the server reports unchanged aren't downloaded. Of the others, 
+        only pages whose source changed since it was last read are 
+        parsed. The affected C{data/type/*} lists are rebuilt, the 
+        version index is patched for them and the other indexes are 
+        dropped to be rebuilt on next use. Cost is thus proportional 
+        to what changed, apart from one request per page.
+        
+        Snapshots keep the state of the pages, so this holds after 
+        L{load_snapshot} too. Only with a snapshot written without it 
+        the database doesn't know which page produced which entries, 
+        and the first refresh parses all pages.
+        
+        Readers keep using the current contents while the new ones 
+        are built; these are published at once when complete.
+        
+        @return: the entries that were added, removed or modified
+        @rtype: L{ChangeSet}
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling refresh()")
+        self.load()
+        with self.update_lock:
+            return self._refresh()
+    
+    def _refresh(self):
+        changes = ChangeSet()
+        mde = DataExtractor(self.site_url)
+        contents = dict(self.contents)
+        contents['metadata/sphinx/version'] = mde.get_sphinx_version(path='/index.html')
+        epaths = list(self.epaths)
+        page_types = dict(self.page_types)
+        changed_types = set()
+        full = not self.pages
+        for link in SphinxDatabase.REGISTRY['links']:
+            old = self.pages.get(link)
+            de, digest, validators = self._read_page(link, None if old is None else old[2])
+            if de is None or (old is not None and old[0] == digest):
+                if old is not None and old[2] != validators:
+                    self.pages[link] = (old[0], old[1], validators)
+                continue
+            defs = de.get_defs()
+            changed_types.update(defs)
+            if old is not None:
+                changed_types.update(old[1])
+            self.pages[link] = (digest, defs, validators)
+            page_types[link] = sorted(defs)
+            changes.pages.append(link)
+        if full:
+            changed_types.update(epath.split('/')[-1] for epath in self.expand_epath('data/type/*'))
+        if not changes.pages:
+            with self.lock.writing():
+                self.contents = contents
+            return changes
+        merged = self._merge_pages(changed_types)
+        pool = self._string_pool() if self.storage == 'columnar' else None
+        indexes = self._drop_completions(self.indexes, ['data/type/' + _def for _def in changed_types])
+        indexes.pop('names', None)
+        indexes.pop('text', None)
+        version_index = indexes.get('versions')
+        if version_index is not None:
+            version_index = indexes['versions'] = version_index.copy()
+        for _def in changed_types:
+            epath = 'data/type/' + _def
+            old_entries = contents.get(epath, [])
+            new_entries = merged.get(_def, [])
+            old_by_id = dict((entry['id'], entry) for entry in reversed(old_entries))
+            new_by_id = dict((entry['id'], entry) for entry in reversed(new_entries))
+            for entry in new_entries:
+                old_entry = old_by_id.get(entry['id'])
+                if old_entry is None:
+                    changes.added.append((epath, entry))
+                elif old_entry is not entry and old_entry.values() != entry.values():
+                    changes.modified.append((epath, old_entry, entry))
+            for entry in old_entries:
+                if entry['id'] not in new_by_id:
+                    changes.removed.append((epath, entry))
+            if new_entries:
+                if epath not in epaths:
+                    epaths.append(epath)
+                if self.storage == 'columnar':
+                    new_entries = ColumnStore(pool, new_entries)
+                contents[epath] = new_entries
+                if version_index is not None:
+                    version_index.add_entries(epath, new_entries)
+            elif epath in contents:
+                del contents[epath]
+                epaths.remove(epath)
+                if version_index is not None:
+                    version_index.remove(epath)
+        total_entries = 3 + sum(len(contents[epath]) for epath in epaths if self.primary_type(epath) == 'data')
+        contents['metadata/stats/total_entries'] = total_entries
+        with self.lock.writing():
+            self.contents = contents
+            self.epaths = epaths
+            self.indexes = indexes
+            self.page_types = page_types
+            self.total_entries = total_entries
+        return changes
+    
+    def compact(self):
+        '''
+        Move the entries of every *data* epath into a `ColumnStore`.
+        
+        All stores share one `StringPool`, so repeating strings like
+        C{since} values, shared descriptions and link prefixes are
+        kept once. Entries become read-only `EntryView` objects that 
+        support the same item access as `Entry`. Indexes built so 
+        far are dropped because they may reference the old entries.
+        
+        Set C{storage} to C{'columnar'} before L{initialize} to 
+        compact automatically.
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling compact()")
+        with self.update_lock:
+            pool = StringPool()
+            contents = dict(self.contents)
+            for epath, entries in contents.items():
+                if self.primary_type(epath) == 'data' and not isinstance(entries, ColumnStore):
+                    contents[epath] = ColumnStore(pool, entries)
+            with self.lock.writing():
+                self.contents = contents
+                self.indexes = {}
+                self.storage = 'columnar'
 
     def expand_epath(self, epath):
         result = []
@@ -1060,6 +2788,151 @@ class SphinxDatabase(Database):
                 raise ValueError("E: element at epath doesn't exist")
         return result
     
+    def _expand_epaths(self, epaths):
+        '''Return the set of epaths the epath or list of epaths `epaths` expand to.'''
+        if isinstance(epaths, str):
+            epaths = [epaths]
+        result = set()
+        for epath in epaths:
+            result.update(self.expand_epath(epath))
+        return result
+    
+    def parse_predicates(self, predicates):
+        ''' Parse a predicate list like C{'since>=1.0,deprecated<1.2'}.
+        
+        Return a dict mapping each field to a list 
+        C{[lo, lo_inclusive, hi, hi_inclusive]} of the 
+        tightest bounds given for it, in order of first 
+        appearance.
+        '''
+        bounds = {}
+        order = []
+        for predicate in predicates.split(','):
+            mat = self.PREDICATE_REGEX.match(predicate)
+            if not mat:
+                raise ValueError("E: invalid predicate '%s'" % predicate)
+            field, op = mat.group('field'), mat.group('op')
+            version = parse_version(mat.group('version'))
+            if version is None:
+                raise ValueError("E: invalid version in predicate '%s'" % predicate)
+            if field not in bounds:
+                bounds[field] = [None, True, None, False]
+                order.append(field)
+            cur = bounds[field]
+            if op in ('>', '>=', '=', '=='):
+                inclusive = op != '>'
+                if cur[0] is None or version > cur[0] or (version == cur[0] and not inclusive):
+                    cur[0], cur[1] = version, inclusive
+            if op in ('<', '<=', '=', '=='):
+                inclusive = op != '<'
+                if cur[2] is None or version < cur[2] or (version == cur[2] and not inclusive):
+                    cur[2], cur[3] = version, inclusive
+        return [(field, bounds[field]) for field in order]
+    
+    def select(self, epath):
+        ''' Return the entries at `epath` that satisfy its predicates.
+        
+        Predicates follow the epath in square brackets and are 
+        separated by commas, e.g. C{'data/type/*[since>1.0]'} or 
+        C{'data/type/role[deprecated<=1.2]'}. Supported fields 
+        are C{since} and C{deprecated}, supported operators 
+        C{<, <=, >, >=, =}. Entries come in epath order and, within 
+        an epath, in ascending order of the first predicate's field.
+        
+        Lookups use the `VersionIndex`, so each epath costs a 
+        bisection plus the number of entries in range.
+        '''
+        return [entry for _, entry in self.iter_selected(epath)]
+    
+    def iter_selected(self, epath):
+        ''' Generator version of L{select} yielding C{(epath, entry)} tuples.
+        
+        The selection is made under the read lock when iteration 
+        starts, so a concurrent L{refresh} doesn't affect it.
+        '''
+        mat = self.EPATH_PREDICATE_REGEX.match(epath)
+        if not mat:
+            raise ValueError("E: epath '%s' has no predicates" % epath)
+        bounds = self.parse_predicates(mat.group('predicates'))
+        primary_field, (lo, lo_incl, hi, hi_incl) = bounds[0]
+        self.load(self.expand_epath(mat.group('epath')))
+        selected = []
+        with self.lock.reading():
+            index = self.get_version_index()
+            for fe in self.expand_epath(mat.group('epath')):
+                if self.primary_type(fe) != 'data':
+                    continue
+                entries = self.contents[fe]
+                for pos in index.range(fe, primary_field, lo, hi, lo_incl, hi_incl):
+                    entry = entries[pos]
+                    for field, (flo, flo_incl, fhi, fhi_incl) in bounds[1:]:
+                        version = parse_version(entry[field])
+                        if (version is None or
+                            (flo is not None and (version < flo or (version == flo and not flo_incl))) or
+                            (fhi is not None and (version > fhi or (version == fhi and not fhi_incl)))):
+                            break
+                    else:
+                        selected.append((fe, entry))
+        for item in selected:
+            yield item
+    
+    def get_version_index(self):
+        ''' Return the `VersionIndex` over C{since} and C{deprecated}.
+        
+        Versions are parsed once when the index is first used 
+        and kept in C{self.indexes}. Epaths still pending after a 
+        lazy L{initialize} are added when they are loaded.
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling get_version_index()")
+        with self.lock.reading():
+            index = self.indexes.get('versions')
+            if index is None:
+                index = VersionIndex()
+                for epath in self.expand_epath('data*'):
+                    if epath not in self.pending:
+                        index.add_entries(epath, self.contents[epath])
+                index = self.indexes.setdefault('versions', index)
+        return index
+    
+    def query_versions(self, field, lo=None, hi=None, lo_inclusive=True, hi_inclusive=False, epath='data*'):
+        ''' Return entries at `epath` whose `field` lies between `lo` and `hi`.
+        
+        @param field: C{'since'} or C{'deprecated'}
+        @type field: C{string}
+        @param lo: lower bound, e.g. C{'1.0'}, or None.
+        @type lo: C{string}
+        @param hi: upper bound, e.g. C{'1.2'}, or None.
+        @type hi: C{string}
+        '''
+        if field not in VersionIndex.FIELDS:
+            raise ValueError("E: field must be one of %r but is %r" % (VersionIndex.FIELDS, field))
+        lo = parse_version(lo) if lo is not None else None
+        hi = parse_version(hi) if hi is not None else None
+        self.load(self.expand_epath(epath))
+        result = []
+        with self.lock.reading():
+            index = self.get_version_index()
+            for fe in self.expand_epath(epath):
+                if self.primary_type(fe) != 'data':
+                    continue
+                entries = self.contents[fe]
+                for pos in index.range(fe, field, lo, hi, lo_inclusive, hi_inclusive):
+                    result.append(entries[pos])
+        return result
+    
+    def added_between(self, a, b, epath='data*'):
+        '''Return entries added in version `a` or later but before version `b`.'''
+        return self.query_versions('since', a, b, epath=epath)
+    
+    def added_after(self, version, epath='data*'):
+        '''Return entries added after `version`.'''
+        return self.query_versions('since', lo=version, lo_inclusive=False, epath=epath)
+    
+    def deprecated_before(self, version, epath='data*'):
+        '''Return entries deprecated before `version`.'''
+        return self.query_versions('deprecated', hi=version, epath=epath)
+    
 #     def get_metadata(self, value):
 #         return self.get_data('metadata*')
         
@@ -1074,10 +2947,15 @@ class SphinxDatabase(Database):
             every epath that begins with 'data/', while
             'data/type/rol?' returns data for epaths that
             have an arbitrary character at the last pos. 
+            A trailing predicate list filters entries by 
+            version, e.g. 'data/type/*[since>1.0]' (see 
+            L{select}).
         @type epath: C{string}
         '''
         if not isinstance(epath, str):
             raise TypeError('epath is not a string')
+        if epath.endswith(']'):
+            return self.select(epath)
         if epath is None:
             result = []
             # get all entries whose primary type is "data"
@@ -1086,12 +2964,15 @@ class SphinxDatabase(Database):
                 result.append(self[epath])
         else:
             result = []
-            filtered_epaths = self.expand_epath(epath)
+            self.load(self.expand_epath(epath))
+            with self.lock.reading():
+                filtered_epaths = self.expand_epath(epath)
+                contents = self.contents
             if len(filtered_epaths) > 1:
                 for fe in filtered_epaths:
                     try:
-                        cur_data = self[fe]
-                        if isinstance(cur_data, list):
+                        cur_data = contents[fe]
+                        if isinstance(cur_data, ENTRY_LIST_TYPES):
                             result.extend(cur_data)
                         else:
                             result.append(cur_data)
@@ -1099,22 +2980,81 @@ class SphinxDatabase(Database):
                         result.append(None)
             else:
                 try:
-                    result = self.contents[epath]
+                    result = self[epath]
                 except KeyError:
                     return None
         return result
         
+    def iter_data(self, epath=None, fields=None, with_epaths=False):
+        ''' Yield the data at `epath` one item at a time.
+        
+        Streaming counterpart to L{get_data}: nothing is copied 
+        into a combined list. Entries of entry list epaths are 
+        yielded one by one, other values (e.g. metadata) as they 
+        are, in the order of L{expand_epath}.
+        
+        @param epath: element path incl. wildcards and predicates 
+            as for L{get_data}. If None, yield everything.
+        @type epath: C{string}
+        @param fields: if given, yield dicts with just these 
+            fields of each entry instead of the entries.
+        @type fields: C{list<string>}
+        @param with_epaths: if True, yield C{(epath, item)} tuples.
+        @type with_epaths: C{bool}
+        '''
+        if epath is None:
+            items = self._iter_epaths(self.get_epaths())
+        elif epath.endswith(']'):
+            items = self.iter_selected(epath)
+        else:
+            items = self._iter_epaths(self.expand_epath(epath))
+        for fe, item in items:
+            if fields is not None and not isinstance(item, SCALAR_TYPES):
+                item = dict((field, item[field]) for field in fields)
+            if with_epaths:
+                yield fe, item
+            else:
+                yield item
+    
+    def get_digest(self, epath):
+        '''
+        Return a hex digest of the data at the (expanded) `epath`. 
+        
+        The digest changes whenever the data does, which lets 
+        writers tell if output made from it is still current.
+        '''
+        return _value_digest(epath, self[epath])
+    
+    def _iter_epaths(self, epaths):
+        self.load(epaths)
+        contents = self.contents
+        for fe in epaths:
+            if fe not in contents:
+                # dropped by a refresh since the epaths were expanded
+                continue
+            value = contents[fe]
+            if isinstance(value, ENTRY_LIST_TYPES):
+                for entry in value:
+                    yield fe, entry
+            else:
+                yield fe, value
+    
     def get_contents(self):
         '''Return a dict mapping the current data incl. metadata.'''
+        self.load()
         return self.contents
 
     def print_data(self, epaths=None, func=None):
         ''' Print current data to stdout.
         
-        @param epath: if None, print the complete set,
+        Items are printed one at a time as L{iter_data} yields 
+        them: entries as they are, other values as a 
+        C{{epath: value}} dict.
+        
+        @param epaths: if None, print the complete set,
             else just the subset given by the element 
-            path.
-        @type epath: C{string}
+            path(s).
+        @type epaths: C{string} or C{list<string>}
         @param func: printing function to use instead 
             of C{print}, e.g. C{pprint.pprint}
         @type func: C{function}
@@ -1124,21 +3064,14 @@ class SphinxDatabase(Database):
                 print(this_data)
             else:
                 func(this_data)
-        if isinstance(epaths, list):
-            for epath in epaths:
-                self.print_data(epath, func)
-        elif epaths is None:
-            curdata = self.get_contents()
-            __print(curdata)
-        else:
-            if isinstance(epaths, list):
-                for epath in epaths:
-                    curdata = self.get_data(epath)
-                    __print(curdata)
-            else:
-                epath = epaths
-                curdata = self.get_data(epath)
-                __print(curdata)
+        if not isinstance(epaths, list):
+            epaths = [epaths]
+        for epath in epaths:
+            for fe, item in self.iter_data(epath, with_epaths=True):
+                if isinstance(item, SCALAR_TYPES):
+                    __print({fe: item})
+                else:
+                    __print(item)
         
     def get_epaths(self):
         ''' Return element paths available, based on data present. 
@@ -1150,6 +3083,134 @@ class SphinxDatabase(Database):
         if not self.initialized:
             raise InvalidStateError("Database must be initialize'd before calling get_epaths()")
         return self.epaths
+
+    def get_name_index(self):
+        ''' Return the `TrigramIndex` over the names of all *data* entries.
+        
+        The index is built on first use and kept in C{self.indexes}
+        for the lifetime of the initialized database. Its payloads
+        are C{(epath, entry)} tuples.
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling get_name_index()")
+        index = self.indexes.get('names')
+        if index is None:
+            self.load()
+            with self.lock.reading():
+                index = TrigramIndex()
+                for epath in self.expand_epath('data*'):
+                    for entry in self.contents[epath]:
+                        index.add(entry['name'], (epath, entry))
+                index = self.indexes.setdefault('names', index)
+        return index
+
+    def get_text_index(self):
+        ''' Return the `FullTextIndex` over the descriptions of all *data* entries.
+        
+        Built on first use and kept in C{self.indexes} like 
+        L{get_name_index}. Documents are referenced as 
+        C{(epath, position)} so the index can be pickled 
+        independently of the entries.
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling get_text_index()")
+        index = self.indexes.get('text')
+        if index is None:
+            self.load()
+            with self.lock.reading():
+                index = self.indexes.get('text')
+                if index is None:
+                    index = FullTextIndex('description')
+                    for epath in self.expand_epath('data*'):
+                        for pos, entry in enumerate(self.contents[epath]):
+                            index.add((epath, pos), entry['description'])
+                    index = self.indexes.setdefault('text', index)
+        return index
+
+    def get_completions(self, epath):
+        ''' Return C{(completion name, summary)} for each entry at `epath`, in order.
+        
+        The values are derived by the epath's L{CompletionRule} 
+        on first use and kept in C{self.indexes} like 
+        L{get_name_index}, so all completion formats share them.
+        
+        @param epath: a data epath without wildcards.
+        @type epath: C{string}
+        @rtype: C{list<tuple>}
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling get_completions()")
+        self.load([epath])
+        with self.lock.reading():
+            contents, indexes = self.contents, self.indexes
+        if epath not in contents:
+            raise KeyError("E: element '%s' doesn't exist" % epath)
+        return _cached_completions(contents, indexes, epath)
+
+    def search(self, text, epath='data*', limit=None):
+        ''' Return entries whose description matches `text`, best first.
+        
+        Matching is case-insensitive on whole words and ranked 
+        with BM25. Quoted parts of `text` are phrases which must 
+        appear verbatim, e.g. C{'"table of contents" toctree'}.
+        
+        @param text: the search text.
+        @type text: C{string}
+        @param epath: restrict results to entries at these epaths.
+            Supports the same wildcards as L{get_data}. Entries 
+            at more than one of the epaths are returned once.
+        @type epath: C{string} or C{list<string>}
+        @param limit: return at most this many entries.
+        @type limit: C{int}
+        @rtype: C{list<Entry>}
+        '''
+        self.load()
+        result = []
+        with self.lock.reading():
+            # positions must refer to the contents the index was built from
+            index = self.get_text_index()
+            wanted = self._expand_epaths(epath)
+            for (entry_epath, pos), _ in index.search(text):
+                if entry_epath in wanted:
+                    result.append(self.contents[entry_epath][pos])
+                    if limit is not None and len(result) >= limit:
+                        break
+        return result
+
+    def search_names(self, query, max_edits=1, epath='data*', prefix=True, limit=None):
+        ''' Return entries whose name is within C{max_edits} of `query`.
+        
+        Typo-tolerant counterpart to exact name lookups, e.g. 
+        'toctre' finds '.. toctree::' and 'autofunc' finds 
+        'autofunction'. Names are compared without their reST 
+        markup and case-insensitively. Best matches come first.
+        
+        @param query: the (partial) name to look up.
+        @type query: C{string}
+        @param max_edits: max. number of inserted, deleted or 
+            substituted characters. Short queries get fewer (see 
+            L{TrigramIndex.search}).
+        @type max_edits: C{int}
+        @param epath: restrict results to entries at these epaths.
+            Supports the same wildcards as L{get_data}.
+        @type epath: C{string} or C{list<string>}
+        @param prefix: if True, `query` may also match the beginning
+            of a name.
+        @type prefix: C{bool}
+        @param limit: return at most this many entries.
+        @type limit: C{int}
+        @rtype: C{list<Entry>}
+        '''
+        index = self.get_name_index()
+        wanted = self._expand_epaths(epath)
+        result = []
+        for _, _, payloads in index.search(query, max_edits=max_edits, prefix=prefix):
+            for entry_epath, entry in payloads:
+                if entry_epath in wanted:
+                    result.append(entry)
+            if limit is not None and len(result) >= limit:
+                return result[:limit]
+        return result
                 
     def write(self, outdir, format, epaths=None, timestamp=False):  # IGNORE:W0622 @ReservedAssignment
         '''
@@ -1385,14 +3446,114 @@ class SphinxDatabase(Database):
             return result                    
 
 
+class MappedDatabase(SphinxDatabase):
+    '''
+    Read-only `SphinxDatabase` backed by a file written with 
+    L{SphinxDatabase.save_mapped}.
+    
+    Opening the file maps it into memory and reads its header,
+    which holds an offset table per epath. Entries are decoded
+    field by field when they are accessed, so processes that 
+    only look up a few entries stay cheap, and processes that
+    map the same file share its pages.
+    
+    All query methods of `SphinxDatabase` work as usual. 
+    Mapped databases are not kept in the Database flyweight 
+    cache, so they never shadow an in-memory database for 
+    the same site.
+    '''
+    
+    def __new__(cls, path):  # IGNORE:W0221
+        return object.__new__(cls)
+    
+    def __init__(self, path):  # IGNORE:W0231
+        self.path = path
+        self._open(MappedFile(path))
+    
+    def _open(self, mapped):
+        self.mapped = mapped
+        header = mapped.header
+        self.site_url = header['site_url']
+        self.contents = self.mapped.contents
+        self.epaths = [unit[0] for unit in header['units']]
+        self.total_entries = header['total_entries']
+        self.storage = 'mapped'
+        self.indexes = {}
+        self.pending = set()
+        self.lock = ReadWriteLock()
+        self.update_lock = threading.RLock()
+        self.initialized = True
+        
+    def __setitem__(self, key, value):
+        raise TypeError("E: MappedDatabase is read-only")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def compact(self):
+        raise TypeError("E: MappedDatabase is read-only")
+    
+    def refresh(self):
+        raise TypeError("E: MappedDatabase is read-only")
+    
+    def close(self):
+        '''Unmap the database file.'''
+        self.indexes = {}
+        self.contents = {}
+        self.mapped.close()
+
+
+class FrozenDatabase(MappedDatabase):
+    '''
+    Read-only `SphinxDatabase` held in a shared memory block, 
+    as returned by L{SphinxDatabase.freeze}.
+    
+    Works like `MappedDatabase`, but needs no file: any process 
+    on the machine can attach to the block by its C{name}. Each 
+    attached process only pays for the entries it decodes, the 
+    block itself is shared. Instances pickle to the block name, 
+    so they can be handed to C{multiprocessing} workers as is.
+    
+    The instance returned by C{freeze()} owns the block. When 
+    used as a context manager it unlinks the block on exit.
+    '''
+    
+    def __init__(self, name):  # IGNORE:W0231
+        self.path = None
+        self._open(SharedMapped(name))
+    
+    @classmethod
+    def create(cls, data):
+        '''Return an owning instance for a new block holding the encoded database `data`.'''
+        obj = cls.__new__(cls, None)
+        obj.path = None
+        obj._open(SharedMapped.create(data))  # IGNORE:W0212
+        return obj
+    
+    def __reduce__(self):
+        return (FrozenDatabase, (self.name,))
+    
+    def __exit__(self, *args):
+        owner = self.mapped.owner
+        self.close()
+        if owner:
+            self.unlink()
+    
+    @property
+    def name(self):
+        return self.mapped.name
+    
+    def unlink(self):
+        '''Free the shared memory block once all processes have closed it.'''
+        self.mapped.unlink()
+
+
 if __name__ == '__main__':
     
-    # some value callbacks for CSVWriter
-    def to_german_decimals(data, row, header):  # IGNORE:W0613
-        return re.sub(r'(\d+)\.(\d+)', "\\1,\\2", data)
-    def to_german_csv(data, row, header):  # IGNORE:W0613
-        data = data.replace(",", ";")
-        return re.sub(r'(\d+)\.(\d+)', "\\1,\\2", data)
+    # a value callback for HTMLWriter
     def linkify_tabledata(data, row, header):  # IGNORE:W0613
         return re.sub(r'<td>(http://.*?)</td>', '<td><a href="\\1">\\1</a></td>', data)
     
@@ -1409,8 +3570,7 @@ if __name__ == '__main__':
     
     outdir = 'tests/sphinxhp-data'
     cw = CSVWriter(db, os.path.join(outdir, 'csv'))
-    cw.colsep = ';'  # German CSV format
-    cw.value_callback = to_german_decimals
+    cw.dialect = GermanCSVDialect
     print(cw.write())
     
     tmw = TextMateWriter(db, os.path.join(outdir, 'tmprefs'))
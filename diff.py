@@ -0,0 +1,329 @@
+#!/usr/local/bin/python
+# encoding: utf-8
+'''
+sphinxhp.diff -- compare two databases entry by entry.
+
+Used to follow how the Sphinx markup vocabulary changes between
+releases: which directives, roles etc. were added or removed and
+which entries changed, e.g. became deprecated. Entries are matched
+by epath and id and compared by a hash over their content, so the
+databases may come from different site URLs.
+
+:author:    | André Berg
+:copyright: | 2011 Berg Media. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre.bergmedia@googlemail.com
+'''
+
+import io
+import os
+import csv
+import sys
+import shutil
+import hashlib
+
+import constants
+from compat import write_encoded, open_encoded
+from templite import Templite
+from utils import html_escape, url_escape, linkify, nl_to_br, create_path
+from store import MAPPED_MAGIC
+from cache import read_snapshot_header
+from data import (SphinxDatabase, MappedDatabase, HTMLWriter, CSVDialect, ChangeSet,
+                  _data, _data_filename)
+
+
+__all__ = ['FIELDS', 'Change', 'DatabaseDiff', 'diff', 'entry_hash', 'open_database']
+
+__date__ = constants.__date__
+__updated__ = '2026-10-18'
+
+
+DEBUG = 0 or ('BMDebugLevel' in os.environ and os.environ['BMDebugLevel'] > 0)
+TESTRUN = 0 or ('BMTestRunLevel' in os.environ and os.environ['BMTestRunLevel'] > 0)
+PROFILE = 0 or ('BMProfileLevel' in os.environ and os.environ['BMProfileLevel'] > 0)
+
+
+#: entry fields that are compared. C{link} is compared relative
+#: to the site URL of its database.
+FIELDS = ('name', 'classname', 'description', 'since', 'deprecated', 'link')
+
+
+def _relative_link(link, site_url):
+    if link and link.startswith(site_url):
+        return link[len(site_url):]
+    return link or ''
+
+
+def _content(entry, site_url):
+    return [_relative_link(entry[field], site_url) if field == 'link' else (entry[field] or '')
+            for field in FIELDS]
+
+
+def entry_hash(entry, site_url=''):
+    '''
+    Return a digest over the compared fields of `entry`.
+
+    @param site_url: prefix stripped from the entry's link,
+        so entries of databases for different sites compare equal.
+    @type site_url: C{string}
+    @rtype: C{bytes}
+    '''
+    return hashlib.sha1('\0'.join(_content(entry, site_url)).encode('utf-8')).digest()
+
+
+class Change(object):
+    '''
+    One difference between two databases.
+
+    C{kind} is one of C{'added'}, C{'removed'} or C{'modified'}.
+    C{old} and C{new} are the entries (None for the side where
+    the entry doesn't exist), C{fields} lists the fields that
+    differ for modified entries.
+    '''
+    __slots__ = ('kind', 'epath', 'id', 'old', 'new', 'fields')
+
+    def __init__(self, kind, epath, id, old=None, new=None, fields=()):  # IGNORE:W0622 @ReservedAssignment
+        self.kind = kind
+        self.epath = epath
+        self.id = id
+        self.old = old
+        self.new = new
+        self.fields = list(fields)
+
+    def __repr__(self):
+        return "Change(%r, %r, %r, fields=%r)" % (self.kind, self.epath, self.id, self.fields)
+
+    @property
+    def entry(self):
+        '''The current entry, i.e. the old one for removed entries.'''
+        return self.new if self.new is not None else self.old
+
+
+class DatabaseDiff(ChangeSet):
+    '''
+    Result of L{diff}.
+
+    Besides the C{added}, C{removed} and C{modified} lists of
+    a `ChangeSet`, C{changes} holds all changes as `Change`
+    records ordered by epath and id.
+    '''
+
+    KINDS = {'added': '+', 'removed': '-', 'modified': '~'}
+
+    def __init__(self, old_site_url, new_site_url):
+        super(DatabaseDiff, self).__init__()
+        self.old_site_url = old_site_url
+        self.new_site_url = new_site_url
+        self.changes = []
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def _add(self, change):
+        self.changes.append(change)
+        if change.kind == 'added':
+            self.added.append((change.epath, change.new))
+        elif change.kind == 'removed':
+            self.removed.append((change.epath, change.old))
+        else:
+            self.modified.append((change.epath, change.old, change.new))
+
+    def summary(self):
+        '''Return one line per change, e.g. C{'~ data/type/role role-ref (since)'}.'''
+        lines = []
+        for change in self.changes:
+            line = "%s %s %s" % (self.KINDS[change.kind], change.epath, change.id)
+            if change.fields:
+                line += " (%s)" % ', '.join(change.fields)
+            lines.append(line)
+        return lines
+
+    def _rows(self):
+        old_site = self.old_site_url.rstrip('/') + '/'
+        new_site = self.new_site_url.rstrip('/') + '/'
+        for change in self.changes:
+            old = _content(change.old, old_site) if change.old is not None else [''] * len(FIELDS)
+            new = _content(change.new, new_site) if change.new is not None else [''] * len(FIELDS)
+            yield change, old, new
+
+    def _write_csv(self, f, dialect):
+        '''Write the changes to the open file `f` as CSV in `dialect`.'''
+        header = ['kind', 'epath', 'id', 'fields']
+        for field in FIELDS:
+            header.extend(['old_' + field, 'new_' + field])
+        csv.writer(f, dialect, quoting=csv.QUOTE_MINIMAL).writerow(header)
+        writer = csv.writer(f, dialect)
+        for change, old, new in self._rows():
+            values = [change.kind, change.epath, change.id, ' '.join(change.fields)]
+            for old_value, new_value in zip(old, new):
+                values.extend([old_value, new_value])
+            writer.writerow(values)
+
+    def to_csv(self, dialect=CSVDialect):
+        '''
+        Return the changes as CSV text in `dialect` (see L{CSVDialect}) 
+        with the columns C{kind, epath, id, fields} and the old and new 
+        value of each of the compared L{FIELDS} (links relative to their 
+        site).
+        '''
+        buf = io.StringIO()
+        self._write_csv(buf, dialect)
+        return buf.getvalue()
+
+    def write_csv(self, path, encoding=None, dialect=CSVDialect):
+        '''Write L{to_csv} output to the file at `path`.'''
+        if encoding is None:
+            encoding = sys.getdefaultencoding()
+        f = open_encoded(path, encoding=encoding, errors='xmlcharrefreplace', newline='')
+        try:
+            self._write_csv(f, dialect)
+        finally:
+            f.close()
+        return path
+
+    def to_html(self):
+        '''Return the changes as an HTML page using the report's style sheet.'''
+        template_globals = {
+            'escape': html_escape,
+            'html_escape': html_escape,
+            'url_escape': url_escape,
+            'linkify': linkify,
+            'nl_to_br': nl_to_br,
+            '__url__': constants.__url__,
+            '__version__': constants.__versionstr__
+        }
+        tmpl = Templite(_data("htmlfiles/diff.html"), template_globals)
+        rows = []
+        for change, old, new in self._rows():
+            fields = change.fields or FIELDS
+            rows.append({
+                'kind': change.kind,
+                'epath': change.epath,
+                'id': change.id,
+                'name': change.entry['name'],
+                'fields': ', '.join(change.fields),
+                'old': '\n'.join('%s: %s' % (field, old[FIELDS.index(field)]) for field in fields
+                                 if change.old is not None),
+                'new': '\n'.join('%s: %s' % (field, new[FIELDS.index(field)]) for field in fields
+                                 if change.new is not None)
+            })
+        old_site_url = self.old_site_url    # IGNORE:W0612
+        new_site_url = self.new_site_url    # IGNORE:W0612
+        num_added = len(self.added)         # IGNORE:W0612
+        num_removed = len(self.removed)     # IGNORE:W0612
+        num_modified = len(self.modified)   # IGNORE:W0612
+        return tmpl.render(locals())
+
+    def write_html(self, outdir):
+        '''Write C{diff.html} and the static files it uses to `outdir`.'''
+        create_path(outdir)
+        path = os.path.join(outdir, 'diff.html')
+        write_encoded(path, self.to_html(), encoding='ascii', errors='xmlcharrefreplace')
+        for static in HTMLWriter.STATIC_FILES:
+            shutil.copyfile(_data_filename("htmlfiles/" + static), os.path.join(outdir, static))
+        return path
+
+
+def _keyed_entries(database, epaths):
+    '''Return C{((epath, id), hash, entry)} for the entries at `epaths`, sorted by key.'''
+    site_url = database.site_url.rstrip('/') + '/'
+    expanded = set()
+    for epath in epaths:
+        try:
+            expanded.update(database.expand_epath(epath))
+        except ValueError:
+            # epath only exists in the other database
+            pass
+    result = []
+    for fe in expanded:
+        if database.primary_type(fe) != 'data':
+            continue
+        for entry in database.iter_data(fe):
+            result.append(((fe, entry['id']), entry_hash(entry, site_url), entry))
+    result.sort(key=lambda item: item[0])
+    return result
+
+
+def diff(db_a, db_b, epath='data*'):
+    '''
+    Compare the entries of the initialized databases `db_a` (old)
+    and `db_b` (new).
+
+    Entries are keyed by epath and id. Both sides are hashed and
+    sorted by key once, then merged in a single pass, so only
+    entries with equal keys and different hashes are compared
+    field by field.
+
+    @param epath: restrict the comparison to these epaths.
+        Supports the same wildcards as L{SphinxDatabase.get_data}.
+    @type epath: C{string} or C{list<string>}
+    @rtype: L{DatabaseDiff}
+    '''
+    epaths = [epath] if isinstance(epath, str) else epath
+    result = DatabaseDiff(db_a.site_url, db_b.site_url)
+    old = _keyed_entries(db_a, epaths)
+    new = _keyed_entries(db_b, epaths)
+    old_site = db_a.site_url.rstrip('/') + '/'
+    new_site = db_b.site_url.rstrip('/') + '/'
+    i = j = 0
+    while i < len(old) and j < len(new):
+        old_key, old_hash, old_entry = old[i]
+        new_key, new_hash, new_entry = new[j]
+        if old_key == new_key:
+            if old_hash != new_hash:
+                fields = [field for field, a, b in zip(FIELDS, _content(old_entry, old_site),
+                                                       _content(new_entry, new_site)) if a != b]
+                result._add(Change('modified', old_key[0], old_key[1], old_entry, new_entry, fields))  # IGNORE:W0212
+            i += 1
+            j += 1
+        elif old_key < new_key:
+            result._add(Change('removed', old_key[0], old_key[1], old=old_entry))  # IGNORE:W0212
+            i += 1
+        else:
+            result._add(Change('added', new_key[0], new_key[1], new=new_entry))  # IGNORE:W0212
+            j += 1
+    for old_key, _, old_entry in old[i:]:
+        result._add(Change('removed', old_key[0], old_key[1], old=old_entry))  # IGNORE:W0212
+    for new_key, _, new_entry in new[j:]:
+        result._add(Change('added', new_key[0], new_key[1], new=new_entry))  # IGNORE:W0212
+    return result
+
+
+def open_database(spec, cache_dir=None, ttl=None):
+    '''
+    Return an initialized database for `spec`, which is the path
+    of a mapped database file (see L{SphinxDatabase.save_mapped})
+    or snapshot file (see L{SphinxDatabase.save_snapshot}), or
+    else a site URL.
+
+    `cache_dir` and `ttl` are passed to L{SphinxDatabase.initialize}
+    for site URLs.
+    '''
+    if os.path.isfile(spec):
+        f = open(spec, 'rb')
+        try:
+            magic = f.read(len(MAPPED_MAGIC))
+        finally:
+            f.close()
+        if magic == MAPPED_MAGIC:
+            return MappedDatabase(spec)
+        header = read_snapshot_header(spec)
+        if not isinstance(header, dict) or 'site_url' not in header:
+            raise ValueError("E: '%s' is neither a mapped database nor a snapshot" % spec)
+        db = SphinxDatabase(header['site_url'], use_cached=False)
+        if not db.load_snapshot(spec):
+            raise ValueError("E: snapshot '%s' can't be used with this version" % spec)
+        return db
+    db = SphinxDatabase(spec)
+    db.initialize(cache_dir=cache_dir, ttl=ttl)
+    return db
@@ -0,0 +1,492 @@
+#!/usr/local/bin/python
+# encoding: utf-8
+'''
+sphinxhp.index -- in-memory lookup structures over database entries.
+
+The indexes in here are built once from the entries of an
+initialized `SphinxDatabase` and then answer queries without
+looking at every entry again.
+
+:author:    | André Berg
+:copyright: | 2011 Berg Media. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre.bergmedia@googlemail.com
+'''
+
+import os
+import re
+import math
+import pickle
+import bisect
+import functools
+
+import constants
+
+
+__all__ = ['TrigramIndex', 'FullTextIndex', 'VersionIndex', 'normalize_name', 
+           'edit_distance', 'tokenize', 'parse_version']
+
+__date__ = constants.__date__
+__updated__ = '2026-10-18'
+
+
+DEBUG = 0 or ('BMDebugLevel' in os.environ and os.environ['BMDebugLevel'] > 0)
+TESTRUN = 0 or ('BMTestRunLevel' in os.environ and os.environ['BMTestRunLevel'] > 0)
+PROFILE = 0 or ('BMProfileLevel' in os.environ and os.environ['BMProfileLevel'] > 0)
+
+
+#: characters stripped from both ends of a name before indexing,
+#: e.g. '.. toctree::' -> 'toctree', ':ref:' -> 'ref'
+NAME_MARKUP_CHARS = ' .:()|'
+
+#: padding character for the n-grams at the start and end of a key
+PAD = '\x00'
+
+TOKEN_REGEX = re.compile(r'\w+', re.UNICODE)
+PHRASE_REGEX = re.compile(r'"([^"]*)"')
+VERSION_REGEX = re.compile(r'\s*(\d+(?:\.\d+)*)')
+
+
+def normalize_name(name):
+    '''Strip reST markup from `name` and lowercase it.'''
+    return name.strip(NAME_MARKUP_CHARS).lower()
+
+
+def tokenize(text):
+    '''Split `text` into lowercase word tokens.'''
+    return TOKEN_REGEX.findall(text.lower())
+
+
+def parse_version(version):
+    '''
+    Parse a version string like C{'1.0'} or C{'1.2b1'} into a tuple 
+    of ints that compares correctly, e.g. C{(1,)} and C{(1, 2)}.
+    
+    Trailing zeros are dropped so that '1' and '1.0' are equal.
+    Return None if `version` doesn't start with a number.
+    '''
+    if not version:
+        return None
+    mat = VERSION_REGEX.match(version)
+    if not mat:
+        return None
+    parts = [int(part) for part in mat.group(1).split('.')]
+    while len(parts) > 1 and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+
+def edit_distance(a, b, max_edits, prefix=False):
+    '''
+    Return the Levenshtein distance between `a` and `b` or
+    C{max_edits + 1} if it is larger than C{max_edits}.
+
+    The columns of the distance matrix are computed as bit vectors
+    (Myers' bit-parallel algorithm in Hyyrö's formulation), a few
+    integer operations per character of `b` whatever the length
+    of `a`. The computation stops as soon as the characters left
+    in `b` can't bring the distance within the bound.
+
+    @param prefix: if True, return the distance between `a` and
+        the closest prefix of `b` instead, so that 'autofunc'
+        matches 'autofunction' with a distance of 0.
+    @type prefix: C{bool}
+    '''
+    m = len(a)
+    limit = max_edits + 1
+    if prefix:
+        # characters past this point can't lower the prefix distance
+        b = b[:m + max_edits]
+    n = len(b)
+    if not prefix and abs(m - n) > max_edits:
+        return limit
+    if m == 0:
+        return 0 if prefix else min(n, limit)
+    masks = _char_masks(a)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv = full
+    mv = 0
+    score = best = m
+    # without `prefix`, give up once the rest of `b` can't help
+    give_up = n + max_edits
+    for cb in b:
+        eq = masks.get(cb, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (full & ~(xh | pv))
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        if score < best:
+            best = score
+        give_up -= 1
+        if score > give_up and not prefix:
+            return limit
+        ph = full & ((ph << 1) | 1)
+        pv = full & ((mh << 1) | ~(xv | ph))
+        mv = ph & xv
+    return min(best if prefix else score, limit)
+
+
+@functools.lru_cache(maxsize=64)
+def _char_masks(a):
+    '''Return a dict mapping each character of `a` to the bit mask of its positions.'''
+    masks = {}
+    for i, ca in enumerate(a):
+        masks[ca] = masks.get(ca, 0) | (1 << i)
+    return masks
+
+
+class TrigramIndex(object):
+    '''
+    Inverted index from character trigrams to the keys containing them.
+
+    Typo-tolerant lookups use the index to pick candidate keys that
+    share enough trigrams with the query, and only those candidates
+    are checked with a bounded `edit_distance`.
+
+    Each key maps to a list of payloads, so several entries
+    with the same normalized name stay findable.
+    '''
+
+    N = 3
+    #: a query needs more than this many characters per allowed edit
+    MIN_CHARS_PER_EDIT = N
+
+    def __init__(self):
+        super(TrigramIndex, self).__init__()
+        self.keys = []
+        self.payloads = []
+        self.postings = {}
+        self._key_ids = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def grams(key, pad_end=True):
+        '''
+        Return the set of trigrams of `key`, padded at the start
+        (and at the end if C{pad_end} is True).
+        '''
+        padded = PAD * (TrigramIndex.N - 1) + key
+        if pad_end:
+            padded += PAD
+        return set(padded[i:i + TrigramIndex.N] for i in range(len(padded) - TrigramIndex.N + 1))
+
+    def add(self, name, payload):
+        '''Index `payload` under the normalized form of `name`.'''
+        key = normalize_name(name)
+        if not key:
+            return
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            key_id = len(self.keys)
+            self._key_ids[key] = key_id
+            self.keys.append(key)
+            self.payloads.append([payload])
+            for gram in self.grams(key):
+                self.postings.setdefault(gram, []).append(key_id)
+        else:
+            self.payloads[key_id].append(payload)
+
+    def _candidates(self, query, max_edits, prefix):
+        '''
+        Return ids of keys that can be within C{max_edits} of `query`.
+
+        Every edit destroys at most N of the query's n-grams, so a
+        match must share at least C{len(grams) - N * max_edits} of
+        them. If that bound is not positive (very short queries)
+        all keys are candidates.
+        '''
+        qgrams = self.grams(query, pad_end=not prefix)
+        threshold = len(qgrams) - self.N * max_edits
+        if threshold <= 0:
+            return range(len(self.keys))
+        counts = {}
+        for gram in qgrams:
+            for key_id in self.postings.get(gram, ()):
+                counts[key_id] = counts.get(key_id, 0) + 1
+        return [key_id for key_id, count in counts.items() if count >= threshold]
+
+    def search(self, query, max_edits=1, prefix=True, limit=None):
+        '''
+        Return C{(key, distance, payloads)} tuples for keys within
+        C{max_edits} of `query`, best matches first.
+
+        `max_edits` is lowered to what the length of the query 
+        allows: each edit needs more than L{MIN_CHARS_PER_EDIT} 
+        characters, e.g. 'toc' is only matched exactly, 'toctre' 
+        with one edit at most and 'autofunc' with two. Shorter 
+        queries would match most keys, and the trigram filter 
+        couldn't rule out any candidates. This keeps a search of 
+        the Sphinx names well below a millisecond.
+
+        @param prefix: if True, the query may also match the
+            beginning of a key, e.g. 'autofunc' -> 'autofunction'.
+            Ties are broken by the full distance so exact names
+            rank before longer completions.
+        @type prefix: C{bool}
+        @param limit: return at most this many results.
+        @type limit: C{int}
+        '''
+        query = normalize_name(query)
+        if not query:
+            return []
+        max_edits = min(max_edits, (len(query) - 1) // self.MIN_CHARS_PER_EDIT)
+        results = []
+        keys = self.keys
+        head_len = len(query) + max_edits
+        # many keys share the part a prefix match depends on,
+        # e.g. 'autofunction' and 'automodule' for 'aut'
+        head_distances = {}
+        for key_id in self._candidates(query, max_edits, prefix):
+            key = keys[key_id]
+            if not prefix and abs(len(key) - len(query)) > max_edits:
+                continue
+            if prefix:
+                head = key[:head_len]
+                distance = head_distances.get(head)
+                if distance is None:
+                    distance = edit_distance(query, head, max_edits, prefix=True)
+                    head_distances[head] = distance
+            else:
+                distance = edit_distance(query, key, max_edits)
+            if distance > max_edits:
+                continue
+            if prefix:
+                full = edit_distance(query, key, max_edits, prefix=False)
+            else:
+                full = distance
+            results.append((distance, full, len(key), key, key_id))
+        results.sort()
+        if limit is not None:
+            results = results[:limit]
+        return [(key, distance, self.payloads[key_id])
+                for distance, _, _, key, key_id in results]
+
+
+class FullTextIndex(object):
+    '''
+    Positional inverted index over a text field of database entries.
+
+    Documents are referenced by C{(epath, position)} tuples, i.e.
+    the epath of the entry list and the entry's index in it, so
+    the index holds no entries itself and stays cheap to pickle
+    (see L{dump} and L{load}).
+
+    Queries are ranked with Okapi BM25. Quoted parts of a query
+    are phrases: a document only matches if it contains each
+    phrase's tokens in order.
+    '''
+
+    VERSION = 1
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, field='description'):
+        super(FullTextIndex, self).__init__()
+        self.field = field
+        self.docs = []
+        self.doc_lengths = []
+        self.postings = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_ref, text):
+        '''Index `text` as the document referenced by `doc_ref`.'''
+        doc_id = len(self.docs)
+        self.docs.append(doc_ref)
+        tokens = tokenize(text)
+        self.doc_lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        positions = {}
+        for pos, token in enumerate(tokens):
+            positions.setdefault(token, []).append(pos)
+        for token, token_positions in positions.items():
+            self.postings.setdefault(token, {})[doc_id] = token_positions
+
+    def _has_phrase(self, doc_id, tokens):
+        '''Return True if document `doc_id` contains `tokens` in sequence.'''
+        starts = set(self.postings[tokens[0]][doc_id])
+        for offset, token in enumerate(tokens[1:], 1):
+            starts &= set(pos - offset for pos in self.postings[token][doc_id])
+            if not starts:
+                return False
+        return True
+
+    def search(self, query, limit=None):
+        '''
+        Return C{(doc_ref, score)} tuples for documents matching
+        `query`, best matches first.
+
+        Without phrases a document matches if it contains any of
+        the query's terms.
+
+        @param query: search text, e.g. C{'latex "output file"'}
+        @type query: C{string}
+        @param limit: return at most this many results.
+        @type limit: C{int}
+        '''
+        phrases = [tokenize(phrase) for phrase in PHRASE_REGEX.findall(query)]
+        phrases = [phrase for phrase in phrases if phrase]
+        terms = set(tokenize(PHRASE_REGEX.sub(' ', query)))
+        for phrase in phrases:
+            terms.update(phrase)
+        if not terms:
+            return []
+        postings = self.postings
+        if phrases:
+            # all tokens of all phrases must be present
+            required = sorted(set(t for phrase in phrases for t in phrase),
+                              key=lambda t: len(postings.get(t, ())))
+            if any(t not in postings for t in required):
+                return []
+            candidates = set(postings[required[0]])
+            for token in required[1:]:
+                candidates.intersection_update(postings[token])
+            candidates = [doc_id for doc_id in candidates
+                          if all(self._has_phrase(doc_id, phrase) for phrase in phrases)]
+            if not candidates:
+                return []
+            candidates = set(candidates)
+        else:
+            candidates = None
+        num_docs = len(self.docs)
+        avg_length = float(self.total_length) / num_docs if num_docs else 0.0
+        doc_lengths = self.doc_lengths
+        k1 = self.K1
+        b = self.B
+        scores = {}
+        for term in terms:
+            term_postings = postings.get(term)
+            if not term_postings:
+                continue
+            df = len(term_postings)
+            idf = math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+            for doc_id, positions in term_postings.items():
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                tf = len(positions)
+                norm = k1 * (1.0 - b + b * doc_lengths[doc_id] / avg_length) if avg_length else k1
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(self.docs[doc_id], score) for doc_id, score in ranked]
+
+    def dump(self, fileobj):
+        '''Pickle the index to the binary file object `fileobj`.'''
+        state = {
+            'version': self.VERSION,
+            'field': self.field,
+            'docs': self.docs,
+            'doc_lengths': self.doc_lengths,
+            'postings': self.postings,
+            'total_length': self.total_length
+        }
+        pickle.dump(state, fileobj, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fileobj):
+        '''Return a new index unpickled from the binary file object `fileobj`.'''
+        state = pickle.load(fileobj)
+        if state.get('version') != cls.VERSION:
+            raise ValueError("E: unsupported full-text index version %r" % state.get('version'))
+        index = cls(state['field'])
+        index.docs = state['docs']
+        index.doc_lengths = state['doc_lengths']
+        index.postings = state['postings']
+        index.total_length = state['total_length']
+        return index
+
+
+class VersionIndex(object):
+    '''
+    Sorted per-epath indexes over version fields of database entries.
+
+    For each epath and field (C{since}, C{deprecated}) the parsed
+    versions are kept in ascending order next to the position of
+    their entry, so range queries are two bisections plus the
+    size of the result. Entries with an empty field (e.g. not
+    deprecated) are not indexed for that field.
+    '''
+
+    FIELDS = ('since', 'deprecated')
+
+    def __init__(self):
+        super(VersionIndex, self).__init__()
+        self.versions = {}
+        self.positions = {}
+
+    def add_entries(self, epath, entries):
+        '''Index all `entries` of the entry list at `epath`.'''
+        for field in self.FIELDS:
+            pairs = []
+            for pos, entry in enumerate(entries):
+                version = parse_version(entry[field])
+                if version is not None:
+                    pairs.append((version, pos))
+            pairs.sort()
+            self.versions[(epath, field)] = [version for version, _ in pairs]
+            self.positions[(epath, field)] = [pos for _, pos in pairs]
+
+    def copy(self):
+        '''
+        Return a copy sharing the per-epath lists, which are replaced 
+        rather than changed by L{add_entries} and L{remove}.
+        '''
+        result = VersionIndex()
+        result.versions = dict(self.versions)
+        result.positions = dict(self.positions)
+        return result
+
+    def remove(self, epath):
+        '''Drop the indexes of `epath`.'''
+        for field in self.FIELDS:
+            self.versions.pop((epath, field), None)
+            self.positions.pop((epath, field), None)
+
+    def range(self, epath, field, lo=None, hi=None, lo_inclusive=True, hi_inclusive=False):
+        '''
+        Return positions of entries at `epath` whose `field` lies 
+        between `lo` and `hi`, in ascending version order.
+
+        @param lo: lower bound or None for no lower bound.
+        @type lo: C{tuple} as returned by L{parse_version}
+        @param hi: upper bound or None for no upper bound.
+        @type hi: C{tuple} as returned by L{parse_version}
+        '''
+        versions = self.versions.get((epath, field))
+        if not versions:
+            return []
+        if lo is None:
+            start = 0
+        elif lo_inclusive:
+            start = bisect.bisect_left(versions, lo)
+        else:
+            start = bisect.bisect_right(versions, lo)
+        if hi is None:
+            end = len(versions)
+        elif hi_inclusive:
+            end = bisect.bisect_right(versions, hi)
+        else:
+            end = bisect.bisect_left(versions, hi)
+        if start >= end:
+            return []
+        return self.positions[(epath, field)][start:end]
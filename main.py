@@ -25,6 +25,9 @@ import sys
 import os
 import re
 import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # pylint: disable=E0611,F0401
 try:
@@ -41,8 +44,12 @@ from pprint import pprint
 
 import constants
 
-from data import SphinxDatabase, HTMLWriter, CSVWriter, TextMateWriter, ListWriter
-from utils import urlrequest, is_local_url
+from data import (SphinxDatabase, WriterDispatcher, HTMLWriter, CSVWriter, TextMateWriter, ListWriter, 
+                  NDJSONWriter, GermanCSVDialect, PRECOMPRESS_ENCODINGS)
+from utils import urlrequest, is_local_url, printdef
+from diff import diff, open_database
+from archive import OutputArchive, archive_kind, ARCHIVE_KINDS
+from store import shared_memory
 from errors import CLIError
 
 
@@ -59,17 +66,11 @@ DEBUG = 0 or ('BMDebugLevel' in os.environ and os.environ['BMDebugLevel'] > 0)
 TESTRUN = 0 or ('BMTestRunLevel' in os.environ and os.environ['BMTestRunLevel'] > 0)
 PROFILE = 0 or ('BMProfileLevel' in os.environ and os.environ['BMProfileLevel'] > 0)
 
-
-# pylint:disable-msg=W0613
-def replace_decimal_point(value, *args):
-    return re.sub(r'(\d+)\.(\d+)', "\\1,\\2", value)
-
-
-def to_german_csv(data, *args):
-    data = data.replace(",", ";")
-    return re.sub(r'(\d+)\.(\d+)', "\\1,\\2", data)
+#: outdir that makes format ndjson write to stdout
+STDOUT = '-'
 
 
+# pylint:disable-msg=W0613
 def linkify_tabledata(data, *args):
     return re.sub(r'<td>(http://.*?)</td>', '<td><a href="\\1">\\1</a></td>', data)
 
@@ -79,15 +80,187 @@ def linkify(value, *args):
 # pylint:enable-msg=W0613
 
 
+def make_writer(db, format, outdir, verbose=0, buffer_size=None, rebuild=False, compress=False,  # IGNORE:W0622 @ReservedAssignment
+                archive=None, render_jobs=1, precompress=(), minify=False):
+    '''
+    Return the writer for `format` writing the data of the 
+    initialized database `db` to the subdirectory of `outdir` 
+    named after the format, through a buffer of `buffer_size` 
+    bytes (default: C{constants.DEFAULT_BUFFER_SIZE}). 
+    
+    Unless `rebuild` is True, output of the last run that is 
+    still current is kept. `compress` gzips the output of 
+    formats that support it (ndjson). HTML pages are rendered 
+    by a pool of `render_jobs` processes if > 1, minified if 
+    `minify`, and HTML, CSS and JS files get a compressed sibling 
+    per encoding in `precompress` (see L{HTMLWriter}). 
+    
+    An `outdir` of L{STDOUT} writes to stdout (ndjson only). 
+    Given an L{OutputArchive} `archive`, the files are added to 
+    it under the format's name and `outdir` isn't used.
+    '''
+    if outdir == STDOUT:
+        if format != 'ndjson':
+            raise ValueError("E: only format 'ndjson' can be written to stdout but format is %r" % format)
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        return NDJSONWriter(db, stream=stdout, compress=compress)
+    _outdir = os.path.join(outdir, format) if archive is None else None
+    if format == "html":
+        if verbose > 0:
+            print("Writing HTML data to '%s'" % _outdir)
+        writer = HTMLWriter(db, _outdir)
+        writer.render_jobs = render_jobs
+        writer.precompress = tuple(precompress)
+        writer.minify = minify
+    elif format == 'csv':
+        if verbose > 0:
+            print("Writing CSV data to '%s'" % _outdir)
+        writer = CSVWriter(db, _outdir)
+        # CSV seen valid in German Excel: semicolon separated, 
+        # with float values converted from 0.n to 0,n
+        writer.dialect = GermanCSVDialect
+    elif format == 'tmprefs':
+        if verbose > 0:
+            print("Writing TMPrefs data to '%s'" % _outdir)
+        writer = TextMateWriter(db, _outdir)
+    elif format == 'list':
+        if verbose > 0:
+            print("Writing List data to '%s'" % outdir)
+        writer = ListWriter(db, _outdir, include_comments=True)
+    elif format == 'listplain':
+        if verbose > 0:
+            print("Writing List (plain) data to '%s'" % outdir)
+        writer = ListWriter(db, _outdir)
+    elif format == 'ndjson':
+        if verbose > 0:
+            print("Writing NDJSON data to '%s'" % _outdir)
+        writer = NDJSONWriter(db, _outdir, compress=compress)
+    else:
+        raise ValueError("E: format must be one of %r but is %r" % (SphinxDatabase.VALID_FORMATS, format))
+    if buffer_size is not None:
+        writer.buffer_size = buffer_size
+    writer.incremental = not rebuild
+    if archive is not None:
+        writer.archive = archive
+        writer.archive_prefix = format
+    return writer
+
+
+def write_format(db, format, outdir, verbose=0, buffer_size=None, rebuild=False, compress=False,  # IGNORE:W0622 @ReservedAssignment
+                 render_jobs=1, precompress=(), minify=False):
+    '''
+    Write the data of `db` in `format` (see L{make_writer}). 
+    Return the number of seconds it took.
+    '''
+    start = time.time()
+    make_writer(db, format, outdir, verbose=verbose, buffer_size=buffer_size, rebuild=rebuild, 
+                compress=compress, render_jobs=render_jobs, precompress=precompress, minify=minify).write()
+    return time.time() - start
+
+
+def _error_message(e):
+    if DEBUG:
+        return ''.join(traceback.format_exception(e.__class__, e, e.__traceback__))
+    return "%s: %s" % (e.__class__.__name__, e)
+
+
+def _write_format_job(db, format, outdir, verbose, buffer_size, rebuild, compress, render_jobs,  # IGNORE:W0622 @ReservedAssignment
+                      precompress, minify):
+    '''
+    Run L{write_format} and return C{(format, seconds, error)}. 
+    Exceptions are turned into the error message so one failing 
+    format doesn't affect the others.
+    '''
+    try:
+        return format, write_format(db, format, outdir, verbose=verbose, buffer_size=buffer_size, 
+                                    rebuild=rebuild, compress=compress, render_jobs=render_jobs, 
+                                    precompress=precompress, minify=minify), None
+    except Exception as e:  # IGNORE:W0703
+        return format, None, _error_message(e)
+
+
+def _write_formats_single_pass(db, formats, outdir, verbose, buffer_size, rebuild, compress, archive=None, 
+                               render_jobs=1, precompress=(), minify=False):
+    '''Write all `formats` with one L{WriterDispatcher} pass over `db`.'''
+    results = {}
+    writers = []
+    for format in formats:  # @ReservedAssignment
+        try:
+            writer = make_writer(db, format, outdir, verbose=verbose, buffer_size=buffer_size, rebuild=rebuild, 
+                                 compress=compress, archive=archive, render_jobs=render_jobs, 
+                                 precompress=precompress, minify=minify)
+            writers.append((format, writer))
+        except Exception as e:  # IGNORE:W0703
+            results[format] = (format, None, _error_message(e))
+    dispatcher = WriterDispatcher(db, [writer for _, writer in writers], isolate_errors=True)
+    dispatcher.run()
+    for format, writer in writers:  # @ReservedAssignment
+        if writer in dispatcher.errors:
+            results[format] = (format, None, _error_message(dispatcher.errors[writer]))
+        else:
+            results[format] = (format, dispatcher.timings[writer], None)
+    return [results[format] for format in formats]
+
+
+def write_formats(db, formats, outdir, jobs=1, verbose=0, buffer_size=None, rebuild=False, compress=False, 
+                  archive=None, render_jobs=1, precompress=(), minify=False):
+    '''
+    Write the data of the initialized database `db` in each of 
+    `formats` (see L{write_format}).
+    
+    By default all writers are fed by a single pass over `db` 
+    (see L{WriterDispatcher}). With `jobs` > 1 up to that many 
+    formats are written at the same time instead, each walking 
+    the data on its own. The writers run in worker processes 
+    which share a L{FrozenDatabase} copy of `db`, or in threads 
+    if shared memory isn't available.
+    
+    With an L{OutputArchive} `archive` all files go there (see 
+    L{make_writer}), always in a single pass.
+    
+    Return a list of C{(format, seconds, error)} in the order of 
+    `formats`. C{seconds} is None and C{error} the message for 
+    a format whose writer failed. In a single pass C{seconds} 
+    is the time spent in the writer itself, excluding the walk 
+    over the database shared by all writers.
+    '''
+    if jobs <= 1 or len(formats) <= 1 or archive is not None:
+        return _write_formats_single_pass(db, formats, outdir, verbose, buffer_size, rebuild, compress, archive, 
+                                          render_jobs, precompress, minify)
+    frozen = None
+    if shared_memory is not None:
+        frozen = db.freeze()
+        executor = ProcessPoolExecutor(min(jobs, len(formats)))
+    else:
+        executor = ThreadPoolExecutor(min(jobs, len(formats)))
+    try:
+        futures = [(format, executor.submit(_write_format_job, frozen or db, format, outdir, verbose, 
+                                              buffer_size, rebuild, compress, render_jobs, precompress, minify))
+                   for format in formats]
+        results = []
+        for format, future in futures:  # @ReservedAssignment
+            try:
+                results.append(future.result())
+            except Exception as e:  # IGNORE:W0703
+                # e.g. the worker process died
+                results.append((format, None, _error_message(e)))
+        return results
+    finally:
+        executor.shutdown()
+        if frozen is not None:
+            frozen.close()
+            frozen.unlink()
+
+
 def print_formats():
     print("Valid formats:\n")
     for mode in SphinxDatabase.VALID_FORMATS:
         print("%s" % mode)
 
 
-def print_epaths(site_url):
+def print_epaths(site_url, cache_dir=None, ttl=None, refresh=False, check_version=False):
     db = SphinxDatabase(site_url)
-    db.initialize()
+    db.initialize(cache_dir=cache_dir, ttl=ttl, refresh=refresh, lazy=True, check_version=check_version)
     available_epaths = db.get_epaths()
     print("Available epaths:\n")
     for epath in sorted(available_epaths):
@@ -126,14 +299,33 @@ USAGE
         parser = ArgumentParser(description=program_license, formatter_class=RawDescriptionHelpFormatter)
         parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="set verbosity level [default: %(default)s]")
         parser.add_argument("-l", "--list-epaths", dest="listepaths", action="store_true", help="list element paths available for querying the database and exit")
-        parser.add_argument("-o", "--outdir", dest="outdir", help="default output directory. [default: %(default)s]", metavar="path" )
+        parser.add_argument("-o", "--outdir", dest="outdir", help="default output directory, or '-' to write format ndjson to stdout. [default: %(default)s]", metavar="path" )
         parser.add_argument("-f", "--force", dest="force", action="store_true", help="force creation of outdir if it doesn't exist. [default: %(default)s]")
         parser.add_argument("-s", "--siteurl", dest="siteurl", help="default url of the Sphinx homepage. can be a local file url [default: %(default)s]", metavar="url" )
+        parser.add_argument("-S", "--search", dest="search", help="print entries whose description matches the search text and exit. quote words to search for a phrase, e.g. '\"table of contents\"'. epaths, if given, restrict the search", metavar="text")
+        parser.add_argument("-D", "--diff", dest="diff", nargs=2, help="compare two databases and exit. each one is given by a site url, snapshot file or mapped database file. changes are printed, or written to diff.csv and diff.html with -F csv/html. epaths, if given, restrict the comparison", metavar=("old", "new"))
         parser.add_argument("-F", "--format", dest="format", help=("output format. One of %r or 'all'. "  % (valid_formats)) + "You can specify multiple formats by separating with a colon, e.g. 'format1:format2' [default: %(default)s]")
+        parser.add_argument("-c", "--cache-dir", dest="cachedir", help="directory for database snapshots that let later runs skip extraction. [default: %(default)s]", metavar="path")
+        parser.add_argument("--cache-ttl", dest="cachettl", type=int, help="max. age of a database snapshot in seconds. [default: %(default)s]", metavar="seconds")
+        parser.add_argument("--check-version", dest="checkversion", action="store_true", help="only use a database snapshot if the site still has the Sphinx version it was made for. needs a request to the site. [default: %(default)s]")
+        parser.add_argument("--no-cache", dest="nocache", action="store_true", help="neither read nor write database snapshots. [default: %(default)s]")
+        parser.add_argument("-j", "--jobs", dest="jobs", type=int, help="number of formats to write at the same time. [default: %(default)s]", metavar="n")
+        parser.add_argument("--render-jobs", dest="renderjobs", type=int, help="number of processes rendering HTML pages. [default: %(default)s]", metavar="n")
+        parser.add_argument("--precompress", dest="precompress", help="comma separated encodings of the compressed copies to write next to each HTML, CSS and JS file for static web servers, from %r. [default: none]" % sorted(PRECOMPRESS_ENCODINGS), metavar="encodings")
+        parser.add_argument("--minify-html", dest="minifyhtml", action="store_true", help="write HTML pages without indentation and blank lines. [default: %(default)s]")
+        parser.add_argument("--buffer-size", dest="buffersize", type=int, help="size in bytes of the buffer output files are written through. [default: %(default)s]", metavar="bytes")
+        parser.add_argument("-A", "--archive", dest="archive", help="write all output into a single zip or tar archive at this path instead of outdir, '-' for stdout. [default: %(default)s]", metavar="path")
+        parser.add_argument("--archive-format", dest="archiveformat", choices=sorted(set(kind for _, kind in ARCHIVE_KINDS)), help="kind of archive. [default: from the archive's extension, else zip]")
+        parser.add_argument("-z", "--gzip", dest="gzip", action="store_true", help="gzip ndjson output. [default: %(default)s]")
+        parser.add_argument("--rebuild", dest="rebuild", action="store_true", help="write all output files even if the last run's are still current. [default: %(default)s]")
+        parser.add_argument("-r", "--refresh", dest="refresh", action="store_true", help="extract the data again even if a valid snapshot exists. [default: %(default)s]")
         parser.add_argument('-V', '--version', action='version', version=program_version_message)
-        parser.add_argument(dest="epaths", help="element paths of the data units to fetch. if None all that is considered 'data' will be emitted by the Database. [default: %(default)s]", metavar="epath", nargs='*')
+        parser.add_argument(dest="epaths", help="element paths of the data units to fetch. if None all that is considered 'data' will be emitted by the Database. may end in version predicates, e.g. 'data/type/*[since>=1.0,since<1.2]' or 'data/type/role[deprecated<1.2]' [default: %(default)s]", metavar="epath", nargs='*')
         
-        parser.set_defaults(siteurl=constants.DEFAULT_REMOTE_SITE_URL, outdir=os.curdir, epaths=None, force=False)
+        parser.set_defaults(siteurl=constants.DEFAULT_REMOTE_SITE_URL, outdir=os.curdir, epaths=None, force=False, verbose=0, 
+                            cachedir=constants.DEFAULT_CACHE_DIR, cachettl=constants.DEFAULT_SNAPSHOT_TTL, 
+                            nocache=False, refresh=False, checkversion=False, rebuild=False, gzip=False, jobs=1, renderjobs=1, minifyhtml=False, 
+                            buffersize=constants.DEFAULT_BUFFER_SIZE)
         
         parser.prog = program_name
 
@@ -145,13 +337,28 @@ USAGE
         verbose = args.verbose
         formatstr = args.format
         siteurl = args.siteurl
-        outdir = os.path.realpath(args.outdir)
+        outdir = args.outdir if args.outdir == STDOUT else os.path.realpath(args.outdir)
         force = args.force
+        search = args.search
+        diffspecs = args.diff
+        cachedir = None if args.nocache else os.path.realpath(args.cachedir)
+        cachettl = args.cachettl
+        refresh = args.refresh
+        checkversion = args.checkversion
+        jobs = args.jobs
+        renderjobs = args.renderjobs
+        buffersize = args.buffersize
+        rebuild = args.rebuild
+        compress = args.gzip
+        precompress = args.precompress.split(",") if args.precompress else []
+        minifyhtml = args.minifyhtml
+        archivepath = args.archive
+        archiveformat = args.archiveformat or archive_kind(archivepath or '')
         
         db = None
         
         if listepaths:
-            print_epaths(siteurl)
+            print_epaths(siteurl, cache_dir=cachedir, ttl=cachettl, refresh=refresh, check_version=checkversion)
             return 0
         
         if formatstr is None:
@@ -165,6 +372,24 @@ USAGE
                     if format not in valid_formats:
                         raise CLIError("format '%s' not recognized" % format)
         
+        for encoding in precompress:
+            if encoding not in PRECOMPRESS_ENCODINGS:
+                if encoding == 'br':
+                    raise CLIError("--precompress br needs the brotli module")
+                raise CLIError("precompress encoding '%s' not recognized" % encoding)
+        
+        if archivepath is not None:
+            if formats == ['stdout'] or diffspecs or search or outdir == STDOUT:
+                raise CLIError("--archive needs output formats (-F) and can't be combined with -o -, -D or -S")
+            if archivepath == STDOUT and verbose > 0:
+                raise CLIError("-v can't be used when writing to stdout")
+        
+        if outdir == STDOUT:
+            if formats != ['ndjson'] or diffspecs or search:
+                raise CLIError("only format ndjson can be written to stdout")
+            if verbose > 0:
+                raise CLIError("-v can't be used when writing to stdout")
+        
         if verbose > 0:
             print("Verbose mode on")
             print("format(s): %s" % ', '.join(formats))
@@ -172,19 +397,20 @@ USAGE
             print("outdir: %s" % outdir)
             print("force: %s" % force)
             print("epaths: %s" % epaths)
+            print("cachedir: %s" % cachedir)
 
         try:
             urlcomps = urlsplit(siteurl)
             siteurl_base = urlcomps.netloc
             site_path = urlcomps.path
-            if not is_local_url(siteurl):
+            if not is_local_url(siteurl) and not diffspecs:
                 response = urlrequest(siteurl_base, site_path)
                 if response.status != 200:
                     raise ValueError("E: siteurl may be malformed.")
         except Exception as e:
             raise(e)
         
-        if 'stdout' not in formats:
+        if 'stdout' not in formats and outdir != STDOUT and archivepath is None:
             if not os.path.exists(outdir):
                 if force:
                     try:
@@ -197,49 +423,85 @@ USAGE
                     raise CLIError("outdir %r doesn't exist.\nPass -f/--force if you want to have it created anway." % outdir)
 
  
+        if diffspecs:
+            db_a, db_b = [open_database(spec, cache_dir=cachedir, ttl=cachettl) for spec in diffspecs]
+            changes = diff(db_a, db_b, epaths or 'data*')
+            for format in formats:  # @ReservedAssignment
+                _outdir = os.path.join(outdir, format)
+                if format == 'csv':
+                    if not os.path.exists(_outdir):
+                        os.makedirs(_outdir, 0o755)
+                    path = changes.write_csv(os.path.join(_outdir, 'diff.csv'))
+                elif format == 'html':
+                    path = changes.write_html(_outdir)
+                elif format == 'stdout':
+                    for line in changes.summary():
+                        print(line)
+                    continue
+                else:
+                    if verbose > 0:
+                        print("Format '%s' doesn't apply to --diff, skipping" % format)
+                    continue
+                if verbose > 0:
+                    print("Wrote changes to '%s'" % path)
+            return 0
+        
         if not db:
             db = SphinxDatabase(siteurl)
             if verbose > 0:
                 print("Initializing SphinxDatabase %d..." % id(db))
-            db.initialize()
+            # with explicit epaths only the pages contributing to them are read. 
+            # for stdout each unit is read right before it is written
+            db.initialize(cache_dir=cachedir, ttl=cachettl, refresh=refresh, 
+                          lazy=bool(epaths) or outdir == STDOUT, check_version=checkversion)
         
-        for format in formats:  # @ReservedAssignment
-            _outdir = os.path.join(outdir, format)
-            if format == "html":
-                if verbose > 0:
-                    print("Writing HTML data to '%s'" % _outdir)
-                writer = HTMLWriter(db, _outdir)
-                writer.write()
-            elif format == 'csv':
-                if verbose > 0:
-                    print("Writing CSV data to '%s'" % _outdir)
-                writer = CSVWriter(db, _outdir)
-                # could just specify semicolon as colsep to get CSV seen 
-                # valid in German Excel, but we need to convert float values 
-                # from 0.n to 0,n as well so we use the callback function
-                writer.value_callback = to_german_csv
-                writer.write()
-            elif format == 'tmprefs':
-                if verbose > 0:
-                    print("Writing TMPrefs data to '%s'" % _outdir)
-                writer = TextMateWriter(db, _outdir)
-                writer.write()
-            elif format == 'list':
-                if verbose > 0:
-                    print("Writing List data to '%s'" % outdir)
-                writer = ListWriter(db, _outdir)
-                writer.write(include_comments=True)
-            elif format == 'listplain':
-                if verbose > 0:
-                    print("Writing List (plain) data to '%s'" % outdir)
-                writer = ListWriter(db, _outdir)
-                writer.write()
-            else: # mode == 'stdout'
-                if len(epaths) == 0:
-                    db.print_data(func=pprint)
-                else:
-                    db.print_data(epaths=epaths, func=pprint)
-        return 0
+        if search:
+            # one ranking over all epaths, each entry once
+            printdef(db.search(search, epath=epaths or 'data*'))
+            return 0
+        
+        if 'stdout' in formats:
+            if len(epaths) == 0:
+                db.print_data(func=pprint)
+            else:
+                db.print_data(epaths=epaths, func=pprint)
+            return 0
+        
+        if outdir == STDOUT:
+            # like the default output, restricted to the epaths given
+            try:
+                make_writer(db, 'ndjson', STDOUT, compress=compress).write(epaths or None)
+            except BrokenPipeError:
+                # the consumer stopped reading, e.g. `| head`. point stdout
+                # at devnull so flushing it at exit doesn't fail again
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
+                os.close(devnull)
+            return 0
+        
+        start = time.time()
+        failed = 0
+        archive = None
+        if archivepath == STDOUT:
+            archive = OutputArchive(stream=getattr(sys.stdout, 'buffer', sys.stdout), kind=archiveformat)
+        elif archivepath is not None:
+            archive = OutputArchive(archivepath, kind=archiveformat)
+        try:
+            results = write_formats(db, formats, outdir, jobs=jobs, verbose=verbose, buffer_size=buffersize, 
+                                    rebuild=rebuild, compress=compress, archive=archive, 
+                                    render_jobs=renderjobs, precompress=precompress, minify=minifyhtml)
+        finally:
+            if archive is not None:
+                archive.close()
+        for format, seconds, error in results:  # @ReservedAssignment
+            if error is not None:
+                failed += 1
+                print("E: writing format '%s' failed: %s" % (format, error), file=sys.stderr)
+            elif verbose > 0:
+                print("Wrote %s in %.2fs" % (format, seconds))
+        if verbose > 0:
+            print("Wrote %d format(s) in %.2fs" % (len(formats) - failed, time.time() - start))
+        return 2 if failed else 0
     except KeyboardInterrupt:
         if verbose > 0:
             print("Aborted")
@@ -0,0 +1,181 @@
+#!/usr/local/bin/python
+# encoding: utf-8
+'''
+sphinxhp.manifest -- build manifests for incremental output.
+
+A writer keeps a manifest in its output directory. It records a
+digest of the writer's settings, a digest of each data unit's
+input together with the files the unit produced, and a digest of
+every output file. On the next run a unit whose input digest is
+unchanged and whose files still exist isn't written again, and
+a file whose new content has the recorded digest isn't replaced.
+After a build of all units, the files of units that are gone are
+removed.
+
+:author:    | André Berg
+:copyright: | 2011 Berg Media. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre.bergmedia@googlemail.com
+'''
+
+import os
+import json
+import hashlib
+
+import constants
+from cache import atomic_write
+
+
+__all__ = ['MANIFEST_NAME', 'BuildManifest', 'file_digest', 'text_digest']
+
+__date__ = constants.__date__
+__updated__ = '2026-10-18'
+
+
+DEBUG = 0 or ('BMDebugLevel' in os.environ and os.environ['BMDebugLevel'] > 0)
+TESTRUN = 0 or ('BMTestRunLevel' in os.environ and os.environ['BMTestRunLevel'] > 0)
+PROFILE = 0 or ('BMProfileLevel' in os.environ and os.environ['BMProfileLevel'] > 0)
+
+
+#: file name of the manifest in a writer's output directory
+MANIFEST_NAME = '.sphinxhp-manifest.json'
+
+#: bump whenever the layout of the manifest changes
+MANIFEST_FORMAT = 1
+
+
+def file_digest(path, blocksize=64 * 1024):
+    '''Return the hex SHA-1 digest of the contents of the file at `path`.'''
+    sha = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        block = f.read(blocksize)
+        while block:
+            sha.update(block)
+            block = f.read(blocksize)
+    finally:
+        f.close()
+    return sha.hexdigest()
+
+
+def text_digest(*parts):
+    '''Return the hex SHA-1 digest of the strings `parts`.'''
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(str(part).encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+class BuildManifest(object):
+    '''
+    Manifest of the files a writer built in `outdir`.
+
+    Records of the last build are only trusted if it was made
+    with the same `settings` digest. Records of units that aren't
+    visited again are carried over, so building a subset of the
+    units keeps the others current. A build of all units drops
+    them instead (see L{drop_unvisited}).
+    '''
+
+    def __init__(self, outdir, settings):
+        super(BuildManifest, self).__init__()
+        self.outdir = outdir
+        self.path = os.path.join(outdir, MANIFEST_NAME)
+        self.settings = settings
+        self.units = {}
+        self.files = {}
+        self.visited = set()
+
+    def load(self):
+        '''Read the manifest of the last build. Return True if it can be used.'''
+        try:
+            f = open(self.path, 'rb')
+        except (IOError, OSError):
+            return False
+        try:
+            data = json.loads(f.read().decode('utf-8'))
+        except ValueError as e:
+            if DEBUG:
+                print("E: reading manifest '%s' failed: %s" % (self.path, e))
+            return False
+        finally:
+            f.close()
+        if not isinstance(data, dict) or data.get('format') != MANIFEST_FORMAT \
+                or data.get('settings') != self.settings:
+            return False
+        self.units = data.get('units', {})
+        self.files = data.get('files', {})
+        return True
+
+    def save(self):
+        '''Write the manifest, replacing the old one atomically.'''
+        data = {
+            'format': MANIFEST_FORMAT,
+            'tool_version': constants.__versionstr__,
+            'settings': self.settings,
+            'units': self.units,
+            'files': self.files
+        }
+        with atomic_write(self.path) as f:
+            f.write(json.dumps(data, indent=1, sort_keys=True).encode('utf-8'))
+
+    def is_current(self, key, digest):
+        '''
+        Return True if unit `key` was built from input with `digest`
+        and all its files are still in place.
+        '''
+        unit = self.units.get(key)
+        if unit is None or unit['input'] != digest:
+            return False
+        for fname in unit['outputs']:
+            if fname not in self.files or not os.path.exists(os.path.join(self.outdir, fname)):
+                return False
+        return True
+
+    def visit(self, key):
+        '''Note that unit `key` still exists in this build.'''
+        self.visited.add(key)
+
+    def drop_unvisited(self):
+        '''
+        Drop the records of the units not visited in this build and
+        return the files that only they produced, which are stale now.
+        '''
+        kept = set()
+        for key, unit in self.units.items():
+            if key in self.visited:
+                kept.update(unit['outputs'])
+        stale = []
+        for key in [key for key in self.units if key not in self.visited]:
+            for fname in self.units.pop(key)['outputs']:
+                if fname not in kept and fname in self.files:
+                    del self.files[fname]
+                    stale.append(fname)
+        return stale
+
+    def start_unit(self, key, digest):
+        '''Begin a new record for unit `key` built from input with `digest`.'''
+        self.units[key] = {'input': digest, 'outputs': []}
+
+    def has_file(self, fname, digest):
+        '''Return True if `fname` exists and was recorded with `digest`.'''
+        return self.files.get(fname) == digest and os.path.exists(os.path.join(self.outdir, fname))
+
+    def add_file(self, fname, digest, key=None):
+        '''Record `fname` with `digest`, as an output of unit `key` if given.'''
+        self.files[fname] = digest
+        if key is not None:
+            outputs = self.units[key]['outputs']
+            if fname not in outputs:
+                outputs.append(fname)
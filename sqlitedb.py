@@ -0,0 +1,365 @@
+#!/usr/local/bin/python
+# encoding: utf-8
+'''
+sphinxhp.sqlitedb -- SQLite storage backend for SphinxDatabase.
+
+One database file can hold the data of several sites. Entries
+go into one table with indexes on id, name, type and since, and
+their descriptions into an FTS5 full-text table (if the SQLite
+library was built with FTS5).
+
+:author:    | André Berg
+:copyright: | 2011 Berg Media. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre.bergmedia@googlemail.com
+'''
+
+import os
+import sqlite3
+import threading
+
+try:
+    # Python 3
+    from collections.abc import Mapping
+except ImportError:
+    # Python 2
+    from collections import Mapping
+
+import constants
+from data import SphinxDatabase, Entry, ENTRY_LIST_TYPES
+from index import tokenize, PHRASE_REGEX
+from errors import InvalidStateError
+from utils import ReadWriteLock
+
+
+__all__ = ['SQLiteDatabase']
+
+__date__ = constants.__date__
+__updated__ = '2026-10-18'
+
+
+DEBUG = 0 or ('BMDebugLevel' in os.environ and os.environ['BMDebugLevel'] > 0)
+TESTRUN = 0 or ('BMTestRunLevel' in os.environ and os.environ['BMTestRunLevel'] > 0)
+PROFILE = 0 or ('BMProfileLevel' in os.environ and os.environ['BMProfileLevel'] > 0)
+
+
+ENTRY_COLUMNS = ('id', 'name', 'classname', 'description', 'since', 'deprecated', 'link')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sites (
+    site_id         INTEGER PRIMARY KEY,
+    site_url        TEXT NOT NULL UNIQUE,
+    total_entries   INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS units (
+    site_id         INTEGER NOT NULL REFERENCES sites(site_id),
+    ord             INTEGER NOT NULL,
+    epath           TEXT NOT NULL,
+    kind            TEXT NOT NULL,
+    value,
+    PRIMARY KEY (site_id, epath)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    rowid           INTEGER PRIMARY KEY,
+    site_id         INTEGER NOT NULL REFERENCES sites(site_id),
+    epath           TEXT NOT NULL,
+    type            TEXT NOT NULL,
+    pos             INTEGER NOT NULL,
+    id              TEXT,
+    name            TEXT,
+    classname       TEXT,
+    description     TEXT,
+    since           TEXT,
+    deprecated      TEXT,
+    link            TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_epath_idx ON entries (site_id, epath, pos);
+CREATE INDEX IF NOT EXISTS entries_id_idx ON entries (site_id, id);
+CREATE INDEX IF NOT EXISTS entries_name_idx ON entries (site_id, name);
+CREATE INDEX IF NOT EXISTS entries_type_idx ON entries (site_id, type);
+CREATE INDEX IF NOT EXISTS entries_since_idx ON entries (site_id, since);
+'''
+
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    description, content='entries', content_rowid='rowid'
+);
+'''
+
+
+def has_fts5(conn):
+    '''Return True if the SQLite library behind `conn` supports FTS5.'''
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def fts_query(text):
+    '''
+    Translate search `text` into an FTS5 query that matches the
+    same entries as L{SphinxDatabase.search}: if there are quoted
+    phrases, all of them are required, otherwise any word matches.
+
+    FTS5 has no optional terms, so with phrases present the other
+    words don't take part in the ranking.
+    '''
+    phrases = [tokenize(phrase) for phrase in PHRASE_REGEX.findall(text)]
+    phrases = [phrase for phrase in phrases if phrase]
+    if phrases:
+        return ' AND '.join('"%s"' % ' '.join(phrase) for phrase in phrases)
+    return ' OR '.join('"%s"' % term for term in tokenize(text))
+
+
+class SQLiteContents(Mapping):
+    '''
+    Read-only mapping of epath to value or entry list that
+    reads from the SQLite tables of one site on access.
+
+    Stands in for the C{contents} dict of `SphinxDatabase`,
+    so the inherited query methods work unchanged. Every 
+    query holds the read side of the database's `lock`, so 
+    it never sees an import half done.
+    '''
+
+    def __init__(self, conn, site_id, lock):
+        super(SQLiteContents, self).__init__()
+        self.conn = conn
+        self.site_id = site_id
+        self.lock = lock
+
+    def _unit(self, epath):
+        with self.lock.reading():
+            return self.conn.execute(
+                "SELECT kind, value FROM units WHERE site_id = ? AND epath = ?",
+                (self.site_id, epath)).fetchone()
+
+    def __getitem__(self, epath):
+        with self.lock.reading():
+            unit = self._unit(epath)
+            if unit is None:
+                raise KeyError(epath)
+            kind, value = unit
+            if kind != 'entries':
+                return value
+            rows = self.conn.execute(
+                "SELECT %s FROM entries WHERE site_id = ? AND epath = ? ORDER BY pos" % ', '.join(ENTRY_COLUMNS),
+                (self.site_id, epath))
+            return [Entry(dict(zip(ENTRY_COLUMNS, row)), 'id') for row in rows]
+
+    def __contains__(self, epath):
+        return self._unit(epath) is not None
+
+    def __iter__(self):
+        with self.lock.reading():
+            rows = self.conn.execute(
+                "SELECT epath FROM units WHERE site_id = ? ORDER BY ord", (self.site_id,))
+            return iter([row[0] for row in rows])
+
+    def __len__(self):
+        with self.lock.reading():
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM units WHERE site_id = ?", (self.site_id,)).fetchone()[0]
+
+
+class SQLiteDatabase(SphinxDatabase):
+    '''
+    `SphinxDatabase` whose contents live in an SQLite file.
+
+    Behaves like the in-memory database for C{__getitem__},
+    L{get_data}, L{iter_data}, L{expand_epath} and L{get_epaths},
+    but entries are read from indexed tables when they are asked
+    for instead of being kept in Python dicts. L{search} uses the
+    FTS5 table and its BM25 ranking when available.
+
+    Use L{initialize} to fill the file from the site (or from a
+    snapshot) if it doesn't hold the site's data yet, or
+    L{import_database} to copy an initialized database into it.
+
+    SQLite databases are not kept in the Database flyweight cache.
+    
+    One connection is shared by all threads. Queries hold the read 
+    side of C{lock} and L{import_database} the write side, so 
+    readers run side by side but never during an import.
+    '''
+
+    def __new__(cls, path, site_url=constants.DEFAULT_REMOTE_SITE_URL):  # IGNORE:W0221
+        return object.__new__(cls)
+
+    def __init__(self, path, site_url=constants.DEFAULT_REMOTE_SITE_URL):  # IGNORE:W0231
+        self.path = path
+        self.site_url = site_url
+        # access from other threads is serialized by self.lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.fts = has_fts5(self.conn)
+        if self.fts:
+            self.conn.executescript(FTS_SCHEMA)
+        self.conn.commit()
+        self.storage = 'sqlite'
+        self.indexes = {}
+        self.pending = set()
+        self.lock = ReadWriteLock()
+        self.update_lock = threading.RLock()
+        self.site_id = None
+        self.contents = {}
+        self.epaths = []
+        self.total_entries = -1
+        self.initialized = False
+        self._load_site()
+
+    def __setitem__(self, key, value):
+        raise TypeError("E: SQLiteDatabase can only be changed through import_database()")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _load_site(self):
+        '''Attach to the site's rows if the file already holds them.'''
+        row = self.conn.execute(
+            "SELECT site_id, total_entries FROM sites WHERE site_url = ?", (self.site_url,)).fetchone()
+        if row is None:
+            return False
+        self.site_id, self.total_entries = row
+        self.contents = SQLiteContents(self.conn, self.site_id, self.lock)
+        self.epaths = list(self.contents)
+        self.indexes = {}
+        self.initialized = True
+        return True
+
+    def initialize(self, cache_dir=None, ttl=None, refresh=False):
+        '''
+        Make the site's data available, extracting and importing
+        it unless the file already holds it (or `refresh` is True).
+        `cache_dir` and `ttl` are passed on to the extracting
+        `SphinxDatabase`.
+        '''
+        if self.initialized and not refresh:
+            return
+        source = SphinxDatabase(self.site_url, use_cached=not refresh)
+        source.initialize(cache_dir=cache_dir, ttl=ttl, refresh=refresh)
+        self.import_database(source)
+
+    def import_database(self, database):
+        '''
+        Replace the rows of this site with the contents of the
+        initialized `database` in a single transaction.
+        '''
+        if not database.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling import_database()")
+        database.load()
+        with self.update_lock, self.lock.writing():
+            self._import(database)
+    
+    def _import(self, database):
+        conn = self.conn
+        with conn:
+            row = conn.execute("SELECT site_id FROM sites WHERE site_url = ?", (self.site_url,)).fetchone()
+            if row is not None:
+                site_id = row[0]
+                if self.fts:
+                    conn.execute(
+                        "INSERT INTO entries_fts(entries_fts, rowid, description) "
+                        "SELECT 'delete', rowid, description FROM entries WHERE site_id = ?", (site_id,))
+                conn.execute("DELETE FROM entries WHERE site_id = ?", (site_id,))
+                conn.execute("DELETE FROM units WHERE site_id = ?", (site_id,))
+                conn.execute("UPDATE sites SET total_entries = ? WHERE site_id = ?",
+                             (database.total_entries, site_id))
+            else:
+                site_id = conn.execute("INSERT INTO sites (site_url, total_entries) VALUES (?, ?)",
+                                       (self.site_url, database.total_entries)).lastrowid
+            units = []
+            rows = []
+            for ord_, epath in enumerate(database.get_epaths()):
+                value = database[epath]
+                if isinstance(value, ENTRY_LIST_TYPES):
+                    units.append((site_id, ord_, epath, 'entries', None))
+                    entry_type = epath.split('/')[-1]
+                    for pos, entry in enumerate(value):
+                        rows.append((site_id, epath, entry_type, pos) +
+                                    tuple(entry[column] for column in ENTRY_COLUMNS))
+                else:
+                    units.append((site_id, ord_, epath, 'value', value))
+            conn.executemany("INSERT INTO units (site_id, ord, epath, kind, value) VALUES (?, ?, ?, ?, ?)", units)
+            conn.executemany(
+                "INSERT INTO entries (site_id, epath, type, pos, %s) VALUES (?, ?, ?, ?, %s)" %
+                (', '.join(ENTRY_COLUMNS), ', '.join('?' * len(ENTRY_COLUMNS))), rows)
+            if self.fts:
+                conn.execute(
+                    "INSERT INTO entries_fts(rowid, description) "
+                    "SELECT rowid, description FROM entries WHERE site_id = ?", (site_id,))
+        self._load_site()
+
+    def lookup(self, id=None, name=None, type=None):  # IGNORE:W0622 @ReservedAssignment
+        '''
+        Return entries with the given `id`, `name` and/or `type`
+        (e.g. C{'role'}) using the table's indexes.
+        '''
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling lookup()")
+        clauses = ['site_id = ?']
+        params = [self.site_id]
+        for column, value in (('id', id), ('name', name), ('type', type)):
+            if value is not None:
+                clauses.append('%s = ?' % column)
+                params.append(value)
+        with self.lock.reading():
+            rows = self.conn.execute(
+                "SELECT %s FROM entries WHERE %s ORDER BY epath, pos" % (', '.join(ENTRY_COLUMNS), ' AND '.join(clauses)),
+                params)
+            return [Entry(dict(zip(ENTRY_COLUMNS, row)), 'id') for row in rows]
+
+    def search(self, text, epath='data*', limit=None):
+        '''
+        Full-text search like L{SphinxDatabase.search}, answered
+        by the FTS5 table and ranked with its C{bm25()} function.
+        Without FTS5 the in-memory index is used.
+        '''
+        if not self.fts:
+            return super(SQLiteDatabase, self).search(text, epath=epath, limit=limit)
+        if not self.initialized:
+            raise InvalidStateError("Database must be initialize'd before calling search()")
+        query = fts_query(text)
+        if not query:
+            return []
+        wanted = self._expand_epaths(epath)
+        sql = ("SELECT e.epath, %s FROM entries_fts JOIN entries e ON e.rowid = entries_fts.rowid "
+               "WHERE entries_fts MATCH ? AND e.site_id = ? ORDER BY bm25(entries_fts), e.rowid" %
+               ', '.join('e.' + column for column in ENTRY_COLUMNS))
+        result = []
+        with self.lock.reading():
+            for row in self.conn.execute(sql, (query, self.site_id)):
+                if row[0] in wanted:
+                    result.append(Entry(dict(zip(ENTRY_COLUMNS, row[1:])), 'id'))
+                    if limit is not None and len(result) >= limit:
+                        break
+        return result
+
+    def compact(self):
+        raise TypeError("E: SQLiteDatabase doesn't support compact()")
+
+    def refresh(self):
+        raise TypeError("E: SQLiteDatabase can't be refreshed in place, use initialize(refresh=True)")
+
+    def close(self):
+        '''Close the connection to the database file.'''
+        with self.lock.writing():
+            self.indexes = {}
+            self.contents = {}
+            self.initialized = False
+            self.conn.close()
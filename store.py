@@ -0,0 +1,533 @@
+#!/usr/local/bin/python
+# encoding: utf-8
+'''
+sphinxhp.store -- compact column-oriented storage for database entries.
+
+Instead of one dict per entry, a `ColumnStore` keeps one array
+per field. Strings that repeat across the dataset (``since``,
+``deprecated``, ``classname``, shared descriptions and the page
+part of each ``link``) are stored once in a `StringPool` and
+referenced by integer codes.
+
+:author:    | André Berg
+:copyright: | 2011 Berg Media. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre.bergmedia@googlemail.com
+'''
+
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+import constants
+from cache import atomic_write
+
+
+__all__ = ['StringPool', 'ColumnStore', 'RowView', 'EntryView', 'MappedEntry', 
+           'MappedEntryList', 'MappedFile', 'SharedMapped', 'encode_mapped', 'write_mapped']
+
+__date__ = constants.__date__
+__updated__ = '2026-10-18'
+
+
+DEBUG = 0 or ('BMDebugLevel' in os.environ and os.environ['BMDebugLevel'] > 0)
+TESTRUN = 0 or ('BMTestRunLevel' in os.environ and os.environ['BMTestRunLevel'] > 0)
+PROFILE = 0 or ('BMProfileLevel' in os.environ and os.environ['BMProfileLevel'] > 0)
+
+
+#: first bytes of a mapped database file
+MAPPED_MAGIC = b'SPHXMAP1'
+
+#: magic, header length
+MAPPED_PREAMBLE = struct.Struct('<8sQ')
+
+#: byte length of each field of an entry record
+MAPPED_RECORD = struct.Struct('<7I')
+
+#: one entry of an offset table
+MAPPED_OFFSET = struct.Struct('<Q')
+
+
+class StringPool(object):
+    '''
+    Table of unique strings addressed by integer codes.
+
+    One pool is meant to be shared by all column stores of a
+    database so that e.g. a 'see X' description that occurs
+    in several types is kept only once.
+    '''
+
+    def __init__(self):
+        super(StringPool, self).__init__()
+        self.strings = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, code):
+        return self.strings[code]
+
+    def code(self, value):
+        '''Return the code for `value`, adding it to the pool if needed.'''
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(value)
+            self.codes[value] = code
+        return code
+
+
+class ColumnStore(object):
+    '''
+    Sequence of entries stored column by column.
+
+    Supports the parts of the list interface the database and
+    writers use (``len()``, indexing, slicing, iteration,
+    ``in``, ``append`` and ``extend``). Items are `EntryView`
+    row views which behave like `Entry` objects.
+
+    Column layout:
+
+    - ``id``, ``name``: one string per row (interned)
+    - ``classname``, ``since``, ``deprecated``, ``description``:
+      codes into the shared pool
+    - ``link``: a pool code for the part up to and including
+      ``#`` plus a per-row anchor string, or None if the anchor
+      is the entry's id
+    '''
+
+    FIELDS = ('id', 'name', 'classname', 'description', 'since', 'deprecated', 'link')
+    POOLED_FIELDS = ('classname', 'description', 'since', 'deprecated')
+
+    def __init__(self, pool=None, entries=None, primary_key='id'):
+        super(ColumnStore, self).__init__()
+        if pool is None:
+            pool = StringPool()
+        self.pool = pool
+        self.primary_key = primary_key
+        self.ids = []
+        self.names = []
+        self.codes = dict((field, array('I')) for field in self.POOLED_FIELDS)
+        self.link_prefixes = array('I')
+        self.link_anchors = []
+        if entries is not None:
+            self.extend(entries)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [EntryView(self, i) for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("E: row %d out of range" % row)
+        return EntryView(self, row)
+
+    def __iter__(self):
+        for row in range(len(self.ids)):
+            yield EntryView(self, row)
+
+    def __contains__(self, entry):
+        return entry[self.primary_key] in self.ids
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __iadd__(self, entries):
+        self.extend(entries)
+        return self
+
+    def append(self, entry):
+        '''Append `entry` (any mapping with all C{FIELDS}) as a new row.'''
+        pool = self.pool
+        self.ids.append(sys.intern(entry['id'] or ''))
+        self.names.append(sys.intern(entry['name'] or ''))
+        for field in self.POOLED_FIELDS:
+            self.codes[field].append(pool.code(entry[field] or ''))
+        link = entry['link'] or ''
+        prefix, sep, anchor = link.rpartition('#')
+        if sep:
+            self.link_prefixes.append(pool.code(prefix + sep))
+            # Sphinx permalinks point at the dt's id
+            self.link_anchors.append(None if anchor == entry['id'] else anchor)
+        else:
+            self.link_prefixes.append(pool.code(link))
+            self.link_anchors.append('')
+
+    def extend(self, entries):
+        '''Append each entry in `entries`.'''
+        for entry in entries:
+            self.append(entry)
+
+    def value(self, row, field):
+        '''Return the value of `field` at `row`.'''
+        if field == 'id':
+            return self.ids[row]
+        elif field == 'name':
+            return self.names[row]
+        elif field == 'link':
+            anchor = self.link_anchors[row]
+            if anchor is None:
+                anchor = self.ids[row]
+            return self.pool[self.link_prefixes[row]] + anchor
+        try:
+            return self.pool[self.codes[field][row]]
+        except KeyError:
+            raise KeyError(field)
+
+    def row_dict(self, row):
+        '''Return the entry at `row` as a plain dict.'''
+        return dict((field, self.value(row, field)) for field in self.FIELDS)
+
+
+class RowView(object):
+    '''
+    Base class for read-only entry views over packed storage.
+
+    Mirrors the `Entry` interface: item access by field name,
+    ``keys()``/``values()`` in field order, and comparison and
+    hashing on the primary key. Subclasses implement
+    ``__getitem__``.
+    '''
+
+    __slots__ = ()
+
+    primary_key = 'id'
+
+    def __getitem__(self, key):
+        raise NotImplementedError('RowView.__getitem__() is abstract for %s' % type(self))
+
+    def __iter__(self):
+        return iter(ColumnStore.FIELDS)
+
+    def __len__(self):
+        return len(ColumnStore.FIELDS)
+
+    def __contains__(self, key):
+        return key in ColumnStore.FIELDS
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def __hash__(self):
+        return hash(self[self.primary_key])
+
+    def __eq__(self, other):
+        return self[self.primary_key] == other[self.primary_key]
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def get(self, key, default=None):
+        if key in ColumnStore.FIELDS:
+            return self[key]
+        return default
+
+    def keys(self):
+        return list(ColumnStore.FIELDS)
+
+    def values(self):
+        return [self[field] for field in ColumnStore.FIELDS]
+
+    def items(self):
+        return [(field, self[field]) for field in ColumnStore.FIELDS]
+
+
+class EntryView(RowView):
+    '''Read-only view of one row of a `ColumnStore`.'''
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._store.value(self._row, key)
+
+    def __repr__(self):
+        return repr(self._store.row_dict(self._row))
+
+    @property
+    def primary_key(self):
+        return self._store.primary_key
+
+
+class MappedEntry(RowView):
+    '''
+    Read-only view of one entry record in a mapped database buffer.
+
+    Fields are decoded from the buffer only when they are accessed.
+    '''
+
+    __slots__ = ('_buf', '_offset')
+
+    def __init__(self, buf, offset):
+        self._buf = buf
+        self._offset = offset
+
+    def __getitem__(self, key):
+        try:
+            field_idx = ColumnStore.FIELDS.index(key)
+        except ValueError:
+            raise KeyError(key)
+        lengths = MAPPED_RECORD.unpack_from(self._buf, self._offset)
+        start = self._offset + MAPPED_RECORD.size + sum(lengths[:field_idx])
+        return str(self._buf[start:start + lengths[field_idx]], 'utf-8')
+
+
+class MappedEntryList(object):
+    '''
+    Sequence of the `MappedEntry` records of one epath.
+
+    Indexing reads one slot of the epath's offset table, so
+    looking up an entry doesn't decode any other entry.
+    '''
+
+    def __init__(self, buf, table_offset, count):
+        super(MappedEntryList, self).__init__()
+        self._buf = buf
+        self._table_offset = table_offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def _record_offset(self, row):
+        return MAPPED_OFFSET.unpack_from(self._buf, self._table_offset + row * MAPPED_OFFSET.size)[0]
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(self._count))]
+        if row < 0:
+            row += self._count
+        if not 0 <= row < self._count:
+            raise IndexError("E: row %d out of range" % row)
+        return MappedEntry(self._buf, self._record_offset(row))
+
+    def __iter__(self):
+        for row in range(self._count):
+            yield MappedEntry(self._buf, self._record_offset(row))
+
+    def __contains__(self, entry):
+        key = entry[RowView.primary_key]
+        for mapped in self:
+            if mapped[RowView.primary_key] == key:
+                return True
+        return False
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def encode_mapped(contents, epaths, header=None):
+    '''
+    Encode database `contents` into the mapped database format.
+
+    Layout (all integers little-endian)::
+
+        magic 'SPHXMAP1' | header length (u64) | header (JSON)
+        for each entry list epath:
+            offset table: count + 1 absolute offsets (u64)
+            records: 7 field lengths (u32) + UTF-8 field bytes
+
+    The header holds `header`, the plain (e.g. metadata) values
+    and, per entry list epath, the position of its offset table
+    and its entry count.
+
+    @param contents: mapping of epath to value or entry list.
+    @param epaths: epaths to encode, in order.
+    @return: the encoded database
+    @rtype: C{bytes}
+    '''
+    header = dict(header or {})
+    header['fields'] = list(ColumnStore.FIELDS)
+    units = []
+    blobs = []
+    for epath in epaths:
+        value = contents[epath]
+        if isinstance(value, (str, int, float, type(None))):
+            units.append([epath, 'value', value, 0])
+            continue
+        records = []
+        for entry in value:
+            fields = [(entry[field] or '').encode('utf-8') for field in ColumnStore.FIELDS]
+            records.append(MAPPED_RECORD.pack(*[len(f) for f in fields]) + b''.join(fields))
+        units.append([epath, 'entries', 0, len(records)])
+        blobs.append(records)
+    # offsets depend on the header length, which depends on the
+    # offsets, so encode the header until its length is stable
+    header_len = 0
+    while True:
+        pos = MAPPED_PREAMBLE.size + header_len
+        blob_idx = 0
+        for unit in units:
+            if unit[1] != 'entries':
+                continue
+            unit[2] = pos
+            records = blobs[blob_idx]
+            pos += (len(records) + 1) * MAPPED_OFFSET.size + sum(len(r) for r in records)
+            blob_idx += 1
+        header['units'] = units
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        if len(header_bytes) == header_len:
+            break
+        header_len = len(header_bytes)
+    parts = [MAPPED_PREAMBLE.pack(MAPPED_MAGIC, header_len), header_bytes]
+    blob_idx = 0
+    for unit in units:
+        if unit[1] != 'entries':
+            continue
+        records = blobs[blob_idx]
+        offset = unit[2] + (len(records) + 1) * MAPPED_OFFSET.size
+        table = []
+        for record in records:
+            table.append(MAPPED_OFFSET.pack(offset))
+            offset += len(record)
+        table.append(MAPPED_OFFSET.pack(offset))
+        parts.extend(table)
+        parts.extend(records)
+        blob_idx += 1
+    return b''.join(parts)
+
+
+def write_mapped(path, contents, epaths, header=None):
+    '''Write `contents` to `path` in the mapped database format (see L{encode_mapped}).'''
+    data = encode_mapped(contents, epaths, header)
+    with atomic_write(path) as f:
+        f.write(data)
+    return path
+
+
+def read_mapped_header(buf):
+    '''Return the header dict of the mapped database in `buf`.'''
+    magic, header_len = MAPPED_PREAMBLE.unpack_from(buf, 0)
+    if magic != MAPPED_MAGIC:
+        raise ValueError("E: not a mapped database (bad magic %r)" % magic)
+    start = MAPPED_PREAMBLE.size
+    return json.loads(bytes(buf[start:start + header_len]).decode('utf-8'))
+
+
+def mapped_contents(buf, header):
+    '''Return a dict mapping each epath in `header` to its value or `MappedEntryList`.'''
+    contents = {}
+    for epath, kind, value, count in header['units']:
+        if kind == 'entries':
+            contents[epath] = MappedEntryList(buf, value, count)
+        else:
+            contents[epath] = value
+    return contents
+
+
+class MappedFile(object):
+    '''
+    A mapped database file opened read-only with C{mmap}.
+
+    Opening reads only the header. Pages of the file are loaded
+    by the OS as entries are accessed and are shared between all
+    processes that map the same file.
+    '''
+
+    def __init__(self, path):
+        super(MappedFile, self).__init__()
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        self.header = read_mapped_header(self.mmap)
+        self.contents = mapped_contents(self.mmap, self.header)
+
+    def close(self):
+        self.contents = {}
+        self.mmap.close()
+
+
+class SharedMapped(object):
+    '''
+    A mapped database held in a C{multiprocessing.shared_memory} block.
+
+    The creating process copies the encoded database (see
+    L{encode_mapped}) into a new block once; other processes
+    attach to the block by name and decode entries from it on
+    demand, like from a `MappedFile`, without copying it.
+
+    The block outlives the processes using it until the owner
+    calls L{unlink}.
+    '''
+
+    def __init__(self, name):
+        super(SharedMapped, self).__init__()
+        if shared_memory is None:
+            raise RuntimeError("E: shared memory needs Python 3.8 or later")
+        self.shm = self._attach(name)
+        self.owner = False
+        self._setup()
+
+    @classmethod
+    def create(cls, data):
+        '''Copy the encoded database `data` into a new block and return it attached.'''
+        if shared_memory is None:
+            raise RuntimeError("E: shared memory needs Python 3.8 or later")
+        obj = cls.__new__(cls)
+        obj.shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        obj.shm.buf[:len(data)] = data
+        obj.owner = True
+        obj._setup()  # IGNORE:W0212
+        return obj
+
+    @staticmethod
+    def _attach(name):
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            pass
+        # before Python 3.13 attaching registers the block with the resource 
+        # tracker. A process that shares the owner's tracker (e.g. a worker 
+        # started by the owner) just repeats the owner's registration, any 
+        # other process starts its own tracker, which would unlink the block 
+        # behind the owner's back when the process exits
+        own_tracker = getattr(resource_tracker._resource_tracker, '_fd', None) is None  # IGNORE:W0212
+        shm = shared_memory.SharedMemory(name=name)
+        if own_tracker:
+            try:
+                resource_tracker.unregister(shm._name, 'shared_memory')  # IGNORE:W0212
+            except Exception:  # IGNORE:W0703
+                pass
+        return shm
+
+    def _setup(self):
+        self.name = self.shm.name
+        self.header = read_mapped_header(self.shm.buf)
+        self.contents = mapped_contents(self.shm.buf, self.header)
+
+    def close(self):
+        self.contents = {}
+        self.shm.close()
+
+    def unlink(self):
+        '''Free the block once all processes have closed it.'''
+        self.shm.unlink()
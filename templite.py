@@ -103,12 +103,71 @@ class Templite(object):
         engine.execute(self.ops)
         return "".join(engine.result)
 
+    def render_to(self, write, context=None):
+        """Render this template like `render`, but pass the output in
+        pieces to the function `write` instead of returning it.
+
+        """
+        ctx = dict(self.context)
+        if context:
+            ctx.update(context)
+        engine = _TempliteEngine(ctx, write)
+        engine.execute(self.ops)
+
+    def stream(self, write, listexpr, context=None):
+        """Start rendering this template to the function `write`, with the
+        items of the top-level `{% for var in listexpr %}` loop supplied one
+        at a time instead of by `context`.
+
+        Returns a `TempliteStream`. Call its `push` method with each item,
+        then `close`. Only the output for one item is held in memory.
+
+        """
+        ctx = dict(self.context)
+        if context:
+            ctx.update(context)
+        return TempliteStream(self.ops, write, listexpr, ctx)
+
+
+class TempliteStream(object):
+    """Renders a template whose loop items are pushed, see `Templite.stream`."""
+    def __init__(self, ops, write, listexpr, context):
+        for i, (op, args) in enumerate(ops):
+            if op == 'for' and args[1] == listexpr:
+                break
+        else:
+            raise ValueError("No top-level loop over %r" % listexpr)
+        self.var, _, self.body = ops[i][1]
+        self.tail = ops[i+1:]
+        self.write = write
+        self.pieces = []
+        self.engine = _TempliteEngine(context, self.pieces.append)
+        self.engine.execute(ops[:i])
+        self._flush()
+
+    def _flush(self):
+        if self.pieces:
+            self.write("".join(self.pieces))
+            del self.pieces[:]
+
+    def push(self, item):
+        """Render the loop body for `item`."""
+        self.engine.context[self.var] = item
+        self.engine.execute(self.body)
+        self._flush()
+
+    def close(self):
+        """Render the rest of the template after the loop."""
+        self.engine.execute(self.tail)
+        self._flush()
+
 
 class _TempliteEngine(object):
     """Executes Templite objects to produce strings."""
-    def __init__(self, context):
+    def __init__(self, context, write=None):
         self.context = context
         self.result = []
+        self.write = write or self.result.append
 
     def execute(self, ops):
         """Execute `ops` in the engine.
@@ -118,10 +177,10 @@ class _TempliteEngine(object):
         """
         for op, args in ops:
             if op == 'lit':
-                self.result.append(args)
+                self.write(args)
             elif op == 'exp':
                 try:
-                    self.result.append(str(self.evaluate(args)))
+                    self.write(str(self.evaluate(args)))
                 except:
                     exc_class, exc, _ = sys.exc_info()
                     new_exc = exc_class("Couldn't evaluate {{ %s }}: %s"
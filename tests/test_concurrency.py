@@ -0,0 +1,173 @@
+#!/usr/local/bin/python
+# encoding: utf-8
+'''
+sphinxhp.tests.test_concurrency -- stress test for sharing a database between threads.
+
+Reader threads query a L{SphinxDatabase} and write output from it
+while another thread keeps changing the site and calling C{refresh()}
+and C{__setitem__}. Every reader must see a consistent version of
+the data and none may raise.
+
+:author:    | André Berg
+:copyright: | 2011 Berg Media. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre.bergmedia@googlemail.com
+'''
+
+import os
+import sys
+import shutil
+import time
+import tempfile
+import threading
+import traceback
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import SphinxDatabase, CSVWriter, TextMateWriter, NDJSONWriter  # IGNORE:F0401
+
+
+NUM_READERS = 6
+NUM_REFRESHES = 30
+
+#: entry types of the fixture site and how their names are marked up
+TYPES = [
+    ('directive', '.. %s::'),
+    ('role', ':%s:'),
+    ('confval', '%s'),
+    ('function', '%s()')
+]
+
+#: the page with the only entries of type 'xrole', which come and go
+VOLATILE_PAGE = 'ext/todo.html'
+VOLATILE_TYPE = ('xrole', ':%s:')
+
+WORDS = "the toctree directive inserts a table of contents with links to other documents".split()
+
+
+def _dl(kind, markup, name, num):
+    description = ' '.join(WORDS[(num + i) % len(WORDS)] for i in range(12))
+    if num % 3 == 0:
+        description += ' New in version 1.%d.' % (num % 10)
+    return ('<dl class="%s"><dt id="%s-%s"><tt class="descname">%s</tt></dt><dd><p>%s.</p></dd></dl>' %
+            (kind, kind, name, markup % name, description))
+
+
+def _page(dls):
+    return '<html><body><div class="section">%s</div></body></html>' % ''.join(dls)
+
+
+def make_site(root):
+    '''Write a small Sphinx-like site to `root`. Return the page with the volatile type, without it.'''
+    with open(os.path.join(root, 'index.html'), 'w') as f:
+        f.write("<html><body><script>var DOCUMENTATION_OPTIONS = { VERSION: '1.2', };</script></body></html>")
+    num = 0
+    pages = {}
+    for link in SphinxDatabase.REGISTRY['links']:
+        dls = []
+        for _ in range(4):
+            kind, markup = TYPES[num % len(TYPES)]
+            dls.append(_dl(kind, markup, 'name%d' % num, num))
+            num += 1
+        pages[link] = dls
+        path = os.path.join(root, link)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(_page(dls))
+    plain = _page(pages[VOLATILE_PAGE])
+    kind, markup = VOLATILE_TYPE
+    volatile = _page(pages[VOLATILE_PAGE] + [_dl(kind, markup, 'x%d' % i, i) for i in range(3)])
+    return plain, volatile
+
+
+class ConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='sphinxhp-test-')
+        self.root = os.path.join(self.tmpdir, 'site')
+        os.makedirs(self.root)
+        self.plain, self.volatile = make_site(self.root)
+        self.write_volatile_page(self.volatile)
+        self.db = SphinxDatabase('file://' + self.root, use_cached=False)
+        self.db.initialize()
+        self.errors = []
+        self.reads = 0
+        self.stop = threading.Event()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write_volatile_page(self, source):
+        with open(os.path.join(self.root, VOLATILE_PAGE), 'w') as f:
+            f.write(source)
+
+    def reader(self, num):
+        db = self.db
+        outdir = os.path.join(self.tmpdir, 'out%d' % num)
+        try:
+            num_roles = len(db.get_data('data/type/role'))
+            while not self.stop.is_set():
+                entries = db.get_data('data/type/*')
+                self.assertIn(len(entries), self.totals)
+
+                self.assertIn(sum(1 for _ in db.iter_data('data*')), self.totals)
+
+                for entry in db.search('toctree'):
+                    self.assertIn('toctree', entry['description'])
+
+                names = [entry['name'] for entry in db.search_names('name17', max_edits=0, prefix=False)]
+                self.assertEqual(names, [':name17:'])
+
+                completions = db.get_completions('data/type/role')
+                self.assertEqual(len(completions), num_roles)
+                self.assertTrue(all(name and summary for name, summary in completions))
+
+                for writer in (CSVWriter(db, os.path.join(outdir, 'csv')),
+                               TextMateWriter(db, os.path.join(outdir, 'tmprefs')),
+                               NDJSONWriter(db, os.path.join(outdir, 'ndjson'))):
+                    writer.write()
+                self.reads += 1
+        except Exception:  # IGNORE:W0703
+            self.errors.append(traceback.format_exc())
+
+    def test_readers_during_refresh(self):
+        with_volatile = len(self.db.get_data('data/type/*'))
+        self.totals = (with_volatile, with_volatile - 3)
+        readers = [threading.Thread(target=self.reader, args=(num,)) for num in range(NUM_READERS)]
+        for thread in readers:
+            thread.start()
+        try:
+            for i in range(NUM_REFRESHES):
+                # let the readers get some work done on each version
+                reads = self.reads
+                deadline = time.time() + 10
+                while self.reads < reads + NUM_READERS and not self.errors and time.time() < deadline:
+                    time.sleep(0.001)
+                # every other refresh drops type 'xrole', the next brings it back
+                self.write_volatile_page(self.plain if i % 2 == 0 else self.volatile)
+                changes = self.db.refresh()
+                self.assertEqual(changes.pages, [VOLATILE_PAGE])
+                self.assertEqual(('data/type/xrole' in self.db.get_epaths()), i % 2 == 1)
+                self.db['metadata/test/refreshes'] = i
+        finally:
+            self.stop.set()
+            for thread in readers:
+                thread.join()
+        self.assertEqual(self.errors, [], '\n'.join(self.errors))
+        self.assertGreaterEqual(self.reads, NUM_REFRESHES * NUM_READERS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,6 +24,8 @@ import re
 import time
 import functools
 import warnings
+import threading
+import contextlib
 
 # pylint:disable-msg=F0401, E0611
 try:
@@ -45,7 +47,7 @@ from docutils.core import publish_string
 
 
 __date__ = constants.__date__
-__updated__ = '2013-08-16'
+__updated__ = '2026-10-18'
 
 
 DEBUG = 0 or ('BMDebugLevel' in os.environ and os.environ['BMDebugLevel'] > 0)
@@ -90,6 +92,93 @@ def deprecated(level=1, since=None, info=None):
     return __decorate
 
 
+class ReadWriteLock(object):
+    '''
+    A lock that admits any number of readers or one writer.
+    
+    Writers are preferred: while a writer waits, new readers wait
+    as well, so a steady stream of readers can't starve it. Both
+    sides are reentrant and the writing thread may also read. A
+    thread holding only the read lock can't upgrade to the write
+    lock; trying raises RuntimeError instead of deadlocking.
+    
+    Use the L{reading} and L{writing} context managers::
+    
+        with lock.reading():
+            ...
+    '''
+    def __init__(self):
+        super(ReadWriteLock, self).__init__()
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+    
+    def acquire_read(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            if self._writer == threading.current_thread():
+                self._local.counted = False
+            else:
+                with self._cond:
+                    while self._writer is not None or self._writers_waiting:
+                        self._cond.wait()
+                    self._readers += 1
+                self._local.counted = True
+        self._local.depth = depth + 1
+    
+    def release_read(self):
+        depth = self._local.depth - 1
+        self._local.depth = depth
+        if depth == 0 and self._local.counted:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+    
+    def acquire_write(self):
+        me = threading.current_thread()
+        if self._writer == me:
+            self._writer_depth += 1
+            return
+        if getattr(self._local, 'depth', 0):
+            raise RuntimeError("E: can't acquire the write lock while holding the read lock")
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+    
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+    
+    @contextlib.contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+    
+    @contextlib.contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+
 def create_path(path, mode=0o755):
     '''Create the path incl. intermediary directories using ``os.makedirs``.
     
@@ -209,6 +298,31 @@ def nl_to_br(text):
     return text.replace(os.linesep, '<br>')
 
 
+def minify_html(html):
+    '''
+    Strip the indentation, trailing whitespace and blank lines 
+    from the lines of `html`, except inside ``<pre>`` and 
+    ``<textarea>``. Line breaks are kept, so the page renders 
+    the same and inline scripts still parse.
+    '''
+    lines = []
+    verbatim = False
+    for line in html.splitlines():
+        was_verbatim = verbatim
+        lower = line.lower()
+        opened = max(lower.rfind('<pre'), lower.rfind('<textarea'))
+        closed = max(lower.rfind('</pre'), lower.rfind('</textarea'))
+        if opened != closed:
+            verbatim = opened > closed
+        if not was_verbatim:
+            line = line.lstrip()
+        if not verbatim:
+            line = line.rstrip()
+        if line or was_verbatim or verbatim:
+            lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
 def printdef(defdict):
     '''
     Print a definition nicely formatted to stdout.